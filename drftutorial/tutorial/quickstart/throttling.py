@@ -0,0 +1,107 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: buckets are only atomic within a process
+    fcntl = None
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+# Token buckets in a memory-mapped file that every worker on the host maps
+# (the same design as the polls app's RateLimitMiddleware 'shared' backend).
+# Each take is one read-modify-write of a 24-byte slot under an exclusive
+# flock, so concurrent requests in any process never spend the same token.
+
+SLOT = struct.Struct('<Qdd')  # key hash (0 = free), tokens, last update
+PROBES = 8
+
+
+class SharedBuckets:
+    """
+    Fixed table of token buckets found by hashing the key; when every
+    candidate slot belongs to another key, the least recently used one
+    is taken over and its owner starts again with a full bucket.
+    """
+
+    def __init__(self, path, slots=65536):
+        self._lock = threading.Lock()  # flock does not order threads sharing one descriptor
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = max(os.fstat(self._fd).st_size, slots * SLOT.size)
+        os.ftruncate(self._fd, size)
+        self.slots = size // SLOT.size
+        self._map = mmap.mmap(self._fd, size)
+
+    def take(self, key, rate, burst):
+        """
+        Take one token; returns 0 if allowed, else seconds until one is available.
+        """
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                offset, tokens, last = self._find(digest, now, burst)
+                tokens = min(burst, tokens + max(now - last, 0) * rate)
+                wait = 0 if tokens >= 1 else (1 - tokens) / rate
+                if not wait:
+                    tokens -= 1
+                SLOT.pack_into(self._map, offset, digest, tokens, now)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return wait
+
+    def _find(self, digest, now, burst):
+        oldest = None
+        for probe in range(PROBES):
+            offset = (digest + probe) % self.slots * SLOT.size
+            owner, tokens, last = SLOT.unpack_from(self._map, offset)
+            if owner == digest:
+                return offset, tokens, last
+            if owner == 0:
+                return offset, burst, now
+            if oldest is None or last < oldest[1]:
+                oldest = (offset, last)
+        return oldest[0], burst, now
+
+
+_buckets = None
+
+
+def get_buckets():
+    global _buckets
+    if _buckets is None:
+        _buckets = SharedBuckets(
+            getattr(settings, 'TOKEN_BUCKET_PATH', os.path.join(tempfile.gettempdir(), 'tutorial-throttle')),
+        )
+    return _buckets
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Limit POST requests per client with a token bucket.
+
+    The bucket for ``scope`` is configured in settings.TOKEN_BUCKET_RATES as
+    {'rate': tokens per second, 'burst': bucket size}.
+    """
+    scope = 'post'
+
+    def allow_request(self, request, view):
+        if request.method != 'POST':
+            return True
+        limit = settings.TOKEN_BUCKET_RATES[self.scope]
+        self.wait_time = get_buckets().take(
+            f'throttle:{self.scope}:{self.get_ident(request)}', limit['rate'], limit['burst']
+        )
+        return not self.wait_time
+
+    def wait(self):
+        return self.wait_time
@@ -6,6 +6,7 @@ from rest_framework import status
 
 from tutorial.quickstart.serializers import GroupSerializer, UserSerializer, PostSerializer
 from tutorial.quickstart.models import Post
+from tutorial.quickstart.throttling import TokenBucketThrottle
 from tutorial.quickstart.permissions import IsOwnerOrReadOnly, IsAdminOrReadOnly, IsOwnerOrAdmin
 
 
@@ -18,6 +19,7 @@ class PostList(generics.ListCreateAPIView):
     queryset = Post.objects.all()
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    throttle_classes = [TokenBucketThrottle]
 
     def perform_create(self, serializer):
         # Automatically set the owner to the current user
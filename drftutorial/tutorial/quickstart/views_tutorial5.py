@@ -6,6 +6,7 @@ from rest_framework.reverse import reverse
 
 from tutorial.quickstart.serializers_tutorial5 import GroupSerializer, UserSerializer, PostSerializer
 from tutorial.quickstart.models import Post
+from tutorial.quickstart.throttling import TokenBucketThrottle
 from tutorial.quickstart.permissions import IsOwnerOrReadOnly, IsAdminOrReadOnly
 
 
@@ -31,6 +32,7 @@ class PostList(generics.ListCreateAPIView):
     queryset = Post.objects.all()
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    throttle_classes = [TokenBucketThrottle]
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
@@ -6,6 +6,7 @@ from rest_framework.reverse import reverse
 
 from tutorial.quickstart.serializers_tutorial5 import GroupSerializer, UserSerializer, PostSerializer
 from tutorial.quickstart.models import Post
+from tutorial.quickstart.throttling import TokenBucketThrottle
 from tutorial.quickstart.permissions import IsOwnerOrReadOnly, IsAdminOrReadOnly
 
 
@@ -32,6 +33,12 @@ class PostViewSet(viewsets.ModelViewSet):
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
 
+    def get_throttles(self):
+        """Throttle post creation (post-list) only."""
+        if self.action == 'create':
+            return [TokenBucketThrottle()]
+        return super().get_throttles()
+
     def perform_create(self, serializer):
         """Automatically set the owner to the current user."""
         serializer.save(owner=self.request.user)
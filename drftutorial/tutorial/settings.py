@@ -127,3 +127,11 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10
 }
+
+# Token buckets for TokenBucketThrottle (post-list writes), shared by every
+# worker on the host through this file; rate is tokens per second
+TOKEN_BUCKET_RATES = {
+    'post': {'rate': 1, 'burst': 10},
+}
+TOKEN_BUCKET_PATH = BASE_DIR / 'throttle.buckets'
+
@@ -3,6 +3,11 @@ ASGI config for myapp project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the project through this module (e.g. ``uvicorn myapp.asgi:application``)
+to use the live results stream at /polls/<id>/results/stream/: under ASGI each
+open server-sent-events connection is a cheap coroutine, whereas under WSGI it
+would hold a worker thread for as long as the page is open.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
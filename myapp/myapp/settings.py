@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'polls.middleware.RateLimitMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -77,10 +78,42 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # The vote views claim the voter (polls.voters) and count the vote
+            # in one transaction. Take the write lock when it starts, so
+            # concurrent votes wait for each other instead of failing with
+            # "database is locked" when upgrading from a read (Django 5.1+)
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/5.2/ref/settings/#caches
+#
+# 'shared' holds what every worker must agree on (version stamps, cached
+# counts); the file cache shares it between processes on one host. Point it
+# at memcached or redis when running on several hosts.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'polls_cache',
+        # Room for every question's fragments and stamps; when full, drop a
+        # tenth of the entries rather than the default third
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+            'CULL_FREQUENCY': 10,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -121,3 +154,144 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Polls voting
+# 'strict' writes every vote immediately, 'buffered' batches increments
+# in memory and flushes them on a size/time threshold (and at shutdown),
+# 'event_log' appends VoteEvent rows (same thresholds) and materializes
+# Choice.votes from the log (SQLite only: the log is folded by id high-water
+# mark, which needs ids to commit in order)
+
+POLLS_VOTE_MODE = 'strict'
+POLLS_VOTE_BUFFER_SIZE = 100
+POLLS_VOTE_BUFFER_INTERVAL = 2.0
+POLLS_VOTE_LOG_CHUNK_SIZE = 10000
+POLLS_BALLOT_MAX_VOTES = 50
+# Votes reach the materialized statistics (polls.statistics) in batches:
+# strict votes are buffered per worker and written every INTERVAL seconds
+# or BUFFER_SIZE votes
+POLLS_STATISTICS_BUFFER_SIZE = 1000
+POLLS_STATISTICS_BUFFER_INTERVAL = 5.0
+
+# Live results stream (server-sent events, served through myapp.asgi; under
+# WSGI the stream view only answers with one snapshot)
+POLLS_LIVE_STREAM = True
+POLLS_LIVE_MAX_UPDATES_PER_SECOND = 2
+POLLS_LIVE_POLL_INTERVAL = 5.0
+POLLS_LIVE_KEEPALIVE = 15.0
+
+# Duplicate-vote guard: one vote per user/session and question, checked
+# against a per-worker Bloom filter backed by the VoterRecord ledger
+POLLS_ONE_VOTE_PER_VOTER = True
+POLLS_VOTER_BLOOM_CAPACITY = 1000000
+POLLS_VOTER_BLOOM_ERROR_RATE = 0.01
+
+# Admission control for write endpoints (token buckets, see polls.middleware)
+# keyed by URL name; 'rate' is tokens per second, 'burst' the bucket size.
+# (The DRF tutorial project limits post-list writes with a throttle over
+# the same kind of shared buckets, see tutorial/quickstart/throttling.py.)
+POLLS_RATE_LIMITS = {
+    'polls:vote': {
+        'client': {'rate': 2, 'burst': 20},
+        'question': {'rate': 200, 'burst': 400},
+    },
+    'polls:vote_ajax': {
+        'client': {'rate': 2, 'burst': 20},
+        'question': {'rate': 200, 'burst': 400},
+    },
+    'polls:vote_ballot': {
+        'client': {'rate': 1, 'burst': 5},
+    },
+}
+# Buckets are shared by every worker on the host through a memory-mapped
+# file ('shared'); use 'cache' with memcached/redis across hosts
+POLLS_RATE_LIMIT_BACKEND = 'shared'
+POLLS_RATE_LIMIT_SHARED_PATH = BASE_DIR / 'polls_ratelimit.buckets'
+POLLS_RATE_LIMIT_SHARED_SLOTS = 65536
+POLLS_RATE_LIMIT_CACHE = 'default'
+POLLS_RATE_LIMIT_TRUST_X_FORWARDED_FOR = False
+
+# Search backend for QuestionManager.search: 'fts' (SQLite FTS5, falls back
+# to icontains elsewhere), 'bm25' (portable BM25 ranking from the Search*
+# statistics tables, only kept up to date while selected: run
+# `manage.py rebuild_search_index` after switching to it), 'trigram'
+# (in-process trigram index memory-mapped from POLLS_TRIGRAM_INDEX_PATH) or
+# 'db' (plain icontains). MAX_POSTINGS bounds the work of one BM25 query.
+POLLS_SEARCH_BACKEND = 'fts'
+POLLS_BM25_TOP_K = 500
+POLLS_BM25_MAX_POSTINGS = 100000
+POLLS_TRIGRAM_INDEX_PATH = BASE_DIR / 'polls_trigram.idx'
+
+# List pagination: 'keyset' seeks by (pub_date, id) cursor with next/prev
+# links only; 'offset' uses numbered pages (OFFSET + COUNT per page)
+POLLS_PAGINATION = 'keyset'
+
+# Cached result counts (polls.counts): counts are cached per filter and
+# invalidated by Question/Choice/Category writes; once a count reaches the
+# threshold, a stale value up to MAX_AGE seconds old is shown as "about N"
+POLLS_COUNT_CACHE = 'shared'
+POLLS_COUNT_CACHE_TIMEOUT = 3600
+POLLS_COUNT_ESTIMATE_THRESHOLD = 10000
+POLLS_COUNT_ESTIMATE_MAX_AGE = 300
+
+# Cache holding version stamps (polls.versions) that per-process caches, such
+# as the category list, check on every read; must be shared across workers
+POLLS_VERSION_CACHE = 'shared'
+# Per-process category list (polls.categories): reloaded when its version
+# stamp moves, and at least every MAX_AGE seconds
+POLLS_CATEGORY_CACHE_MAX_AGE = 300
+
+# Template fragment cache ({% cachefragment %}, polls.fragments); shared so
+# that every worker drops a fragment when its version stamps move, and so
+# `manage.py fragment_cache_stats` sees every worker's hits and misses
+POLLS_FRAGMENT_CACHE = 'shared'
+POLLS_FRAGMENT_CACHE_TIMEOUT = 3600
+# Count hits and misses per fragment (a cache write per lookup; for measuring)
+POLLS_FRAGMENT_CACHE_STATS = False
+
+# Typeahead endpoint (polls.typeahead)
+POLLS_TYPEAHEAD_MIN_LENGTH = 2
+POLLS_TYPEAHEAD_MAX_LIMIT = 20
+POLLS_TYPEAHEAD_CACHE_SIZE = 1024
+POLLS_TYPEAHEAD_REFRESH_INTERVAL = 30
+POLLS_TYPEAHEAD_REBUILD_INTERVAL = 3600
+
+# Vote time series (polls.timeseries): per-minute counts gathered in memory
+# and flushed every INTERVAL seconds (or BUFFER_SIZE votes) into minute, hour
+# and day buckets; RETENTION is in days per resolution (None = forever)
+POLLS_VOTE_ROLLUPS = True
+POLLS_VOTE_ROLLUP_INTERVAL = 10.0
+POLLS_VOTE_ROLLUP_BUFFER_SIZE = 1000
+POLLS_VOTE_ROLLUP_RETENTION = {'minute': 2, 'hour': 90, 'day': None}
+POLLS_VOTE_ROLLUP_PRUNE_INTERVAL = 3600
+POLLS_VOTE_SERIES_MAX_POINTS = 720
+
+# Approximate vote analytics (polls.sketches): HyperLogLog unique voters per
+# question/category and a count-min sketch + top-k heap of heavy hitters per
+# WINDOW seconds, merged into shared rows every FLUSH_INTERVAL seconds
+POLLS_VOTE_SKETCHES = True
+POLLS_SKETCH_FLUSH_INTERVAL = 30.0
+POLLS_SKETCH_BUFFER_SIZE = 1000
+POLLS_HLL_PRECISION = 11
+POLLS_CMS_WIDTH = 2048
+POLLS_CMS_DEPTH = 4
+POLLS_HEAVY_HITTERS = 20
+POLLS_SKETCH_WINDOW = 3600
+POLLS_SKETCH_RECENT_WINDOWS = 2
+POLLS_SKETCH_WINDOWS_KEPT = 48
+
+# Trending leaderboard (polls.trending): votes decay by half every HALF_LIFE
+# seconds; each worker rebuilds its board every REBUILD_INTERVAL seconds from
+# vote rollups within HORIZON half-lives
+POLLS_TRENDING_HALF_LIFE = 6 * 3600
+POLLS_TRENDING_REBUILD_INTERVAL = 300
+POLLS_TRENDING_HORIZON = 10
+POLLS_TRENDING_PAGE_SIZE = 20
+POLLS_TRENDING_MAX_LIMIT = 50
+
+# Admin autocomplete (polls.autocomplete): labels of the selected author /
+# category in filters and change forms are cached in this cache alias, shared
+# so that a rename in one worker drops the label everywhere
+POLLS_ADMIN_LABEL_CACHE = 'shared'
+POLLS_ADMIN_LABEL_CACHE_TIMEOUT = 3600
@@ -1,7 +1,12 @@
 from django.contrib import admin
-from django.db.models import Count, Sum
+from django.db import transaction
+from django.db.models import Count, F, FloatField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
 from django.utils.html import format_html
-from .models import Question, Choice, Category, Person, Article, Tag
+from .models import Question, Choice, ChoiceVoteShard, Category, Person, Article, Tag
+from .tallies import percentage as vote_share, with_live_totals, with_live_votes
+from .counts import CachedCountPaginator
+from .autocomplete import AutocompleteAdminMixin, AutocompleteListFilter
 
 # Register your models here.
 
@@ -15,13 +20,18 @@ class ChoiceInline(admin.TabularInline):
 
 
 @admin.register(Question)
-class QuestionAdmin(admin.ModelAdmin):
+class QuestionAdmin(AutocompleteAdminMixin, admin.ModelAdmin):
     """Admin configuration for Question model"""
-    list_display = ('question_text', 'author', 'category', 'pub_date', 'is_active', 'choice_count', 'total_votes')
-    list_filter = ('is_active', 'pub_date', 'category', 'author')
+    list_display = ('question_text', 'author', 'category', 'pub_date', 'is_active', 'choice_count', 'vote_count')
+    list_filter = (
+        'is_active', 'pub_date', ('category', AutocompleteListFilter), ('author', AutocompleteListFilter)
+    )
+    autocomplete_fields = ('category', 'author')  # searched on demand, not one <option> per row
     search_fields = ('question_text', 'author__username', 'category__name')
     date_hierarchy = 'pub_date'
     list_per_page = 20
+    paginator = CachedCountPaginator
+    show_full_result_count = False  # skip the second, unfiltered COUNT(*)
     
     fieldsets = (
         ('Question Information', {
@@ -31,31 +41,48 @@ class QuestionAdmin(admin.ModelAdmin):
             'fields': ('pub_date',),
             'classes': ('collapse',)
         }),
+        ('Vote Counting', {
+            'fields': ('vote_shards',),
+            'classes': ('collapse',)
+        }),
     )
     
     inlines = [ChoiceInline]
     
     def choice_count(self, obj):
         """Display number of choices for this question"""
-        return obj.choices.count()
+        return obj.choice_total
     choice_count.short_description = 'Choices'
+    choice_count.admin_order_field = 'choice_total'
     
-    def total_votes(self, obj):
-        """Display total votes for this question"""
-        return obj.total_votes()
-    total_votes.short_description = 'Total Votes'
+    def vote_count(self, obj):
+        """Display votes, including those still held in shard rows"""
+        return obj.live_total_votes
+    vote_count.short_description = 'Total votes'
+    vote_count.admin_order_field = 'live_total_votes'
     
     def get_queryset(self, request):
-        """Optimize queryset with select_related"""
-        return super().get_queryset(request).select_related(
+        """Optimize queryset: joined FKs, choices and shard votes counted in the same query"""
+        return with_live_totals(super().get_queryset(request).select_related(
             'author', 'category'
-        ).prefetch_related('choices')
+        ).annotate(choice_total=Count('choices')))
     
     actions = ['make_active', 'make_inactive']
     
+    def _set_active(self, queryset, is_active):
+        """Save each question whose flag changes, so the signal handlers keep
+        statistics, cached counts, fragments and leaderboards in step"""
+        updated = 0
+        with transaction.atomic():
+            for question in queryset.exclude(is_active=is_active).order_by():
+                question.is_active = is_active
+                question.save(update_fields=['is_active'])
+                updated += 1
+        return updated
+    
     def make_active(self, request, queryset):
         """Bulk action to make questions active"""
-        updated = queryset.update(is_active=True)
+        updated = self._set_active(queryset, True)
         self.message_user(
             request,
             f'{updated} question(s) were successfully marked as active.'
@@ -64,7 +91,7 @@ class QuestionAdmin(admin.ModelAdmin):
     
     def make_inactive(self, request, queryset):
         """Bulk action to make questions inactive"""
-        updated = queryset.update(is_active=False)
+        updated = self._set_active(queryset, False)
         self.message_user(
             request,
             f'{updated} question(s) were successfully marked as inactive.'
@@ -80,10 +107,24 @@ class ChoiceAdmin(admin.ModelAdmin):
     search_fields = ('choice_text', 'question__question_text')
     list_select_related = ('question',)
     date_hierarchy = 'created_at'
+    paginator = CachedCountPaginator
+    show_full_result_count = False
+    
+    def get_queryset(self, request):
+        """Annotate each choice's share of its question's live votes (shards included) so the column sorts"""
+        question_shard_votes = ChoiceVoteShard.objects.filter(choice__question=OuterRef('question')).order_by().values(
+            'choice__question'
+        ).annotate(total=Sum('votes')).values('total')
+        return with_live_votes(super().get_queryset(request)).annotate(
+            question_live_total=F('question__total_votes') + Coalesce(Subquery(question_shard_votes), Value(0)),
+        ).annotate(
+            vote_share=Cast('live_votes', FloatField()) / NullIf(F('question_live_total'), 0)
+        )
     
     def vote_percentage(self, obj):
         """Display vote percentage with progress bar"""
-        percentage = obj.vote_percentage()
+        # both totals are annotated by get_queryset, so no per-row query
+        percentage = vote_share(obj.live_votes, obj.question_live_total)
         if percentage > 0:
             return format_html(
                 '<div style="width:100px; background-color:#f8f9fa; border-radius:3px;">'
@@ -93,6 +134,7 @@ class ChoiceAdmin(admin.ModelAdmin):
             )
         return "0%"
     vote_percentage.short_description = 'Vote %'
+    vote_percentage.admin_order_field = 'vote_share'
     vote_percentage.allow_tags = True
 
 
@@ -135,10 +177,17 @@ class CategoryAdmin(admin.ModelAdmin):
     icon_display.short_description = 'Icon'
     icon_display.allow_tags = True
     
+    def get_queryset(self, request):
+        """Count active questions per category in the changelist query"""
+        return super().get_queryset(request).annotate(
+            active_questions=Count('question', filter=Q(question__is_active=True))
+        )
+    
     def question_count(self, obj):
         """Display number of questions in this category"""
-        return obj.question_count()
+        return obj.active_questions
     question_count.short_description = 'Questions'
+    question_count.admin_order_field = 'active_questions'
 
 
 @admin.register(Person)
@@ -171,10 +220,13 @@ class PersonAdmin(admin.ModelAdmin):
 
 
 @admin.register(Article)
-class ArticleAdmin(admin.ModelAdmin):
+class ArticleAdmin(AutocompleteAdminMixin, admin.ModelAdmin):
     """Admin configuration for Article model"""
     list_display = ('title', 'author', 'category', 'status', 'views', 'like_count', 'created_at')
-    list_filter = ('status', 'category', 'created_at', 'updated_at')
+    list_filter = (
+        'status', ('category', AutocompleteListFilter), ('author', AutocompleteListFilter), 'created_at', 'updated_at'
+    )
+    autocomplete_fields = ('author', 'category')
     search_fields = ('title', 'content', 'author__username')
     prepopulated_fields = {'slug': ('title',)}
     date_hierarchy = 'created_at'
@@ -197,14 +249,15 @@ class ArticleAdmin(admin.ModelAdmin):
     
     def like_count(self, obj):
         """Display number of likes"""
-        return obj.like_count()
+        return obj.like_total
     like_count.short_description = 'Likes'
+    like_count.admin_order_field = 'like_total'
     
     def get_queryset(self, request):
-        """Optimize queryset"""
+        """Optimize queryset: likes are counted, not fetched"""
         return super().get_queryset(request).select_related(
             'author', 'category'
-        ).prefetch_related('tags', 'likes')
+        ).annotate(like_total=Count('likes'))
 
 
 @admin.register(Tag)
@@ -213,10 +266,15 @@ class TagAdmin(admin.ModelAdmin):
     list_display = ('name', 'article_count', 'created_at')
     search_fields = ('name',)
     
+    def get_queryset(self, request):
+        """Count tagged articles in the changelist query"""
+        return super().get_queryset(request).annotate(article_total=Count('article'))
+    
     def article_count(self, obj):
         """Display number of articles with this tag"""
-        return obj.article_set.count()
+        return obj.article_total
     article_count.short_description = 'Articles'
+    article_count.admin_order_field = 'article_total'
 
 
 # Admin site customization
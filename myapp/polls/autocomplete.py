@@ -0,0 +1,131 @@
+from django import forms
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.utils import get_fields_from_path
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+
+# Autocomplete admin inputs
+#
+# Foreign keys to big tables (users, categories) must not be rendered as a
+# full <select> or a list of filter links. CachedAutocompleteSelect and
+# AutocompleteListFilter fetch matches page by page from the admin's
+# autocomplete view (the related admin's search_fields) as the user types,
+# and only look up the labels of the values currently selected. Those labels
+# come from the cache named by POLLS_ADMIN_LABEL_CACHE; saving or deleting a
+# related object drops its label (polls.signals).
+
+
+def _cache():
+    return caches[getattr(settings, 'POLLS_ADMIN_LABEL_CACHE', 'default')]
+
+
+def label_key(model, pk):
+    return f'polls:label:{model._meta.label_lower}:{pk}'
+
+
+def cached_labels(model, pks):
+    """Return {str(pk): str(obj)} for the existing objects among ``pks``"""
+    pks = {str(pk) for pk in pks if pk not in (None, '')}
+    if not pks:
+        return {}
+    cache = _cache()
+    keys = {label_key(model, pk): pk for pk in pks}
+    labels = {keys[key]: label for key, label in cache.get_many(keys).items()}
+    missing = pks - labels.keys()
+    if missing:
+        try:
+            found = {str(obj.pk): str(obj) for obj in model._default_manager.filter(pk__in=missing)}
+        except (ValueError, TypeError):
+            found = {}  # malformed pk in the query string
+        cache.set_many(
+            {label_key(model, pk): label for pk, label in found.items()},
+            getattr(settings, 'POLLS_ADMIN_LABEL_CACHE_TIMEOUT', 3600),
+        )
+        labels.update(found)
+    return labels
+
+
+def forget_label(instance):
+    _cache().delete(label_key(type(instance), instance.pk))
+
+
+class CachedAutocompleteSelect(AutocompleteSelect):
+    """AutocompleteSelect whose selected option label comes from the label cache"""
+
+    def optgroups(self, name, value, attr=None):
+        default = (None, [], 0)
+        groups = [default]
+        if not self.is_required:
+            default[1].append(self.create_option(name, '', '', False, 0))
+        labels = cached_labels(self.field.remote_field.model, value)
+        for option_value in value:
+            if str(option_value) in labels:
+                default[1].append(self.create_option(
+                    name, option_value, labels[str(option_value)], True, len(default[1])
+                ))
+                break
+        return groups
+
+
+class AutocompleteListFilter(admin.RelatedFieldListFilter):
+    """Foreign key list filter with a search-as-you-type input instead of one link per object"""
+
+    template = 'admin/polls/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.model_admin = model_admin
+        super().__init__(field, request, params, model, model_admin, field_path)
+
+    def field_choices(self, field, request, model_admin):
+        return []  # never load the related table
+
+    def has_output(self):
+        return True
+
+    def get_facet_counts(self, pk_attname, filtered_qs):
+        return {}
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.lookup_val is None and not self.lookup_val_isnull,
+            'query_string': changelist.get_query_string(remove=[self.lookup_kwarg, self.lookup_kwarg_isnull]),
+            'display': _('All'),
+        }
+        if self.include_empty_choice:
+            yield {
+                'selected': bool(self.lookup_val_isnull),
+                'query_string': changelist.get_query_string(
+                    {self.lookup_kwarg_isnull: 'True'}, [self.lookup_kwarg]
+                ),
+                'display': self.empty_value_display,
+            }
+
+    def widget(self):
+        """The autocomplete <select>, with the current value's label"""
+        widget = CachedAutocompleteSelect(self.field, self.model_admin.admin_site)
+        value = self.lookup_val[-1] if self.lookup_val else ''
+        return widget.render(
+            self.lookup_kwarg, value, attrs={'class': 'polls-autocomplete-filter', 'style': 'width: 100%'}
+        )
+
+
+class AutocompleteAdminMixin:
+    """Cached autocomplete widgets for autocomplete_fields, plus the media of AutocompleteListFilter"""
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name in self.get_autocomplete_fields(request) and 'widget' not in kwargs:
+            kwargs['widget'] = CachedAutocompleteSelect(db_field, self.admin_site, using=kwargs.get('using'))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    @property
+    def media(self):
+        media = super().media
+        for list_filter in self.list_filter:
+            if isinstance(list_filter, (list, tuple)) and issubclass(list_filter[1], AutocompleteListFilter):
+                field = get_fields_from_path(self.model, list_filter[0])[-1]
+                media += CachedAutocompleteSelect(field, self.admin_site).media
+                media += forms.Media(js=['polls/admin/autocomplete_filter.js'])
+                break
+        return media
@@ -0,0 +1,200 @@
+import heapq
+import math
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .search import TOKEN_RE
+
+# BM25 ranking
+#
+# Statistics live in four tables, maintained on every Question/Choice write
+# (polls.signals) while POLLS_SEARCH_BACKEND is 'bm25', so ranking never
+# scans question text. Other backends leave them alone; run
+# `manage.py rebuild_search_index` when switching to 'bm25'.
+#
+#   SearchDocument  question -> length in tokens
+#   SearchTerm      term -> number of questions containing it (df)
+#   SearchPosting   (term, question) -> occurrences (tf)
+#   SearchCorpus    one row: question count and total length (for avgdl)
+#
+# A query reads the postings of its terms (each query word also matches up
+# to MAX_PREFIX_EXPANSIONS longer terms it is a prefix of, as with the FTS
+# backend), scores them with BM25 and keeps the best POLLS_BM25_TOP_K with a
+# heap rather than sorting every match. At most POLLS_BM25_MAX_POSTINGS
+# postings are scored, rarest terms first (they weigh most); the term that
+# crosses the limit only contributes its highest-frequency postings.
+#
+# Re-indexing a question subtracts its old contribution and adds the new one
+# with F() updates grouped by amount, so concurrent writers never overwrite
+# each other's counts. Terms left in no document are deleted.
+
+K1 = 1.2
+B = 0.75
+MAX_TERM_LENGTH = 100
+MAX_PREFIX_EXPANSIONS = 50
+
+
+def enabled():
+    return getattr(settings, 'POLLS_SEARCH_BACKEND', 'fts') == 'bm25'
+
+
+def tokenize(text):
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(text.casefold())]
+
+
+def _grouped_update(queryset_for, amounts, field):
+    """Apply {pk: delta} as one UPDATE per distinct delta"""
+    by_amount = defaultdict(list)
+    for pk, amount in amounts.items():
+        if amount:
+            by_amount[amount].append(pk)
+    for amount, pks in by_amount.items():
+        queryset_for(pks).update(**{field: F(field) + amount})
+
+
+def _documents(question_ids):
+    from .models import Question, Choice
+
+    texts = dict(Question.objects.filter(pk__in=question_ids).values_list('id', 'question_text'))
+    for question_id, choice_text in Choice.objects.filter(question_id__in=question_ids).values_list(
+        'question_id', 'choice_text'
+    ):
+        if question_id in texts:
+            texts[question_id] += ' ' + choice_text
+    return {question_id: Counter(tokenize(text)) for question_id, text in texts.items()}
+
+
+def _unindex(question_ids):
+    from .models import SearchCorpus, SearchDocument, SearchPosting, SearchTerm
+
+    documents = SearchDocument.objects.filter(question_id__in=question_ids)
+    totals = documents.aggregate(count=Count('pk'), length=Sum('length'))
+    if not totals['count']:
+        return
+    term_counts = dict(
+        SearchPosting.objects.filter(document_id__in=question_ids)
+        .values_list('term_id').annotate(n=Count('pk')).order_by()
+    )
+    _grouped_update(
+        lambda pks: SearchTerm.objects.filter(pk__in=pks),
+        {term_id: -n for term_id, n in term_counts.items()},
+        'document_count',
+    )
+    documents.delete()  # cascades to the postings
+    SearchTerm.objects.filter(pk__in=term_counts, document_count__lte=0).delete()
+    SearchCorpus.objects.filter(pk=1).update(
+        document_count=F('document_count') - totals['count'],
+        total_length=F('total_length') - totals['length'],
+    )
+
+
+def index_questions(question_ids):
+    """(Re)compute the BM25 statistics of ``question_ids`` from their current text"""
+    from .models import SearchCorpus, SearchDocument, SearchPosting, SearchTerm
+
+    question_ids = list(question_ids)
+    if not question_ids:
+        return
+    with transaction.atomic():
+        SearchCorpus.objects.get_or_create(pk=1)
+        _unindex(question_ids)
+        documents = _documents(question_ids)
+        if not documents:
+            return
+
+        vocabulary = set().union(*documents.values())
+        SearchTerm.objects.bulk_create(
+            [SearchTerm(term=term) for term in vocabulary], ignore_conflicts=True
+        )
+        term_ids = dict(SearchTerm.objects.filter(term__in=vocabulary).values_list('term', 'id'))
+
+        SearchDocument.objects.bulk_create([
+            SearchDocument(question_id=question_id, length=sum(counts.values()))
+            for question_id, counts in documents.items()
+        ])
+        SearchPosting.objects.bulk_create([
+            SearchPosting(term_id=term_ids[term], document_id=question_id, frequency=frequency)
+            for question_id, counts in documents.items()
+            for term, frequency in counts.items()
+        ], batch_size=1000)
+
+        document_frequency = Counter(term_ids[term] for counts in documents.values() for term in counts)
+        _grouped_update(
+            lambda pks: SearchTerm.objects.filter(pk__in=pks), document_frequency, 'document_count'
+        )
+        SearchCorpus.objects.filter(pk=1).update(
+            document_count=F('document_count') + len(documents),
+            total_length=F('total_length') + sum(sum(counts.values()) for counts in documents.values()),
+        )
+
+
+def unindex_question(question_id):
+    with transaction.atomic():
+        _unindex([question_id])
+
+
+def rebuild_index(chunk_size=1000):
+    """Recompute all statistics from scratch; returns the number of questions indexed"""
+    from .models import Question, SearchCorpus, SearchDocument, SearchTerm
+
+    with transaction.atomic():
+        SearchDocument.objects.all().delete()
+        SearchTerm.objects.all().delete()
+        SearchCorpus.objects.all().delete()
+    ids = list(Question.objects.order_by('pk').values_list('pk', flat=True))
+    for i in range(0, len(ids), chunk_size):
+        index_questions(ids[i:i + chunk_size])
+    return len(ids)
+
+
+def search(query, k=None):
+    """Return up to ``k`` (question_id, score) pairs, best first"""
+    from .models import SearchCorpus, SearchPosting, SearchTerm
+
+    k = k or getattr(settings, 'POLLS_BM25_TOP_K', 500)
+    words = set(tokenize(query))
+    if not words:
+        return []
+    corpus = SearchCorpus.objects.filter(pk=1).first()
+    if corpus is None or not corpus.document_count:
+        return []
+    average_length = corpus.total_length / corpus.document_count
+
+    document_frequency = {}
+    for word in words:
+        document_frequency.update(
+            SearchTerm.objects.filter(term__startswith=word, document_count__gt=0)
+            .order_by('-document_count').values_list('id', 'document_count')[:MAX_PREFIX_EXPANSIONS]
+        )
+    if not document_frequency:
+        return []
+
+    # Rarest terms first, until the posting budget runs out
+    budget = getattr(settings, 'POLLS_BM25_MAX_POSTINGS', 100000)
+    whole, partial = [], None
+    for term_id, df in sorted(document_frequency.items(), key=lambda item: item[1]):
+        if df > budget:
+            partial = term_id
+            break
+        whole.append(term_id)
+        budget -= df
+    fields = ('term_id', 'document_id', 'frequency', 'document__length')
+    postings = [SearchPosting.objects.filter(term_id__in=whole).values_list(*fields)]
+    if partial is not None and budget:
+        postings.append(
+            SearchPosting.objects.filter(term_id=partial).order_by('-frequency').values_list(*fields)[:budget]
+        )
+
+    idf = {
+        term_id: math.log(1 + (corpus.document_count - df + 0.5) / (df + 0.5))
+        for term_id, df in document_frequency.items()
+    }
+    scores = defaultdict(float)
+    for queryset in postings:
+        for term_id, question_id, frequency, length in queryset.iterator(chunk_size=5000):
+            norm = K1 * (1 - B + B * length / average_length)
+            scores[question_id] += idf[term_id] * frequency * (K1 + 1) / (frequency + norm)
+    return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
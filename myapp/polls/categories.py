@@ -0,0 +1,53 @@
+import threading
+import time
+
+from django.conf import settings
+
+from .models import Category
+from .versions import get_version, bump_version
+
+# Per-process category cache
+#
+# Categories change rarely but are listed on almost every page. Each worker
+# keeps the full list in memory, tagged with the 'categories' version stamp
+# (polls.versions). Every read compares that stamp, a cache get with no
+# database query, and reloads only after a Category save or delete somewhere
+# has bumped it (see polls.signals). Should a bump not reach this worker (a
+# cache that is not shared, an evicted or failed write), the list is still
+# reloaded once it is POLLS_CATEGORY_CACHE_MAX_AGE seconds old.
+
+VERSION_NAME = 'categories'
+
+
+class CategoryCache:
+    """All categories, ordered by name, reloaded when the version stamp moves"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._loaded_at = None
+        self._categories = ()
+
+    def all(self):
+        version = get_version(VERSION_NAME)
+        now = time.monotonic()
+        max_age = getattr(settings, 'POLLS_CATEGORY_CACHE_MAX_AGE', 300)
+        if version != self._version or now - self._loaded_at >= max_age:
+            categories = tuple(Category.objects.order_by('name'))
+            with self._lock:
+                self._version, self._loaded_at, self._categories = version, now, categories
+        return self._categories
+
+    def active(self):
+        return [category for category in self.all() if category.is_active]
+
+    def invalidate(self):
+        bump_version(VERSION_NAME)
+
+
+category_cache = CategoryCache()
+
+
+def active_categories():
+    """Active categories ordered by name, normally without a query"""
+    return category_cache.active()
@@ -0,0 +1,91 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+
+from .versions import get_version
+
+# Cached result counts
+#
+# COUNT(*) over a filtered queryset is cached under a key derived from the
+# queryset's SQL with ordering stripped, so one entry serves every page and
+# sort order of the same filter (search query, category, is_active, admin
+# list filters...). Each entry records the 'counts' version it was computed
+# at; saving or deleting a Question, Choice or Category bumps that version
+# (see polls.signals and polls.versions), making every cached count stale.
+#
+# Once a count reaches POLLS_COUNT_ESTIMATE_THRESHOLD, a stale entry younger
+# than POLLS_COUNT_ESTIMATE_MAX_AGE is served as an estimate instead of being
+# recounted, and is flagged ``approximate`` so templates can say "about N".
+#
+# Counts live in the cache named by POLLS_COUNT_CACHE ('shared' in
+# settings, so every worker sees the same counts and version).
+
+VERSION_NAME = 'counts'
+
+
+def _cache():
+    return caches[getattr(settings, 'POLLS_COUNT_CACHE', 'default')]
+
+
+class ResultCount:
+    """A row count, possibly an estimate served from a stale cache entry"""
+
+    def __init__(self, value, approximate=False):
+        self.value = value
+        self.approximate = approximate
+
+    def __int__(self):
+        return self.value
+
+    def __str__(self):
+        return str(self.value)
+
+    def __eq__(self, other):
+        if isinstance(other, ResultCount):
+            return (self.value, self.approximate) == (other.value, other.approximate)
+        return self.value == other
+
+    def __repr__(self):
+        return f'<ResultCount {"~" if self.approximate else ""}{self.value}>'
+
+
+def count_cache_key(queryset):
+    sql = str(queryset.order_by().query)
+    digest = hashlib.sha1(f'{queryset.model._meta.label}:{sql}'.encode()).hexdigest()
+    return f'polls:counts:{digest}'
+
+
+def cached_count(queryset):
+    """Return a ResultCount for ``queryset``, from the cache when possible"""
+    cache = _cache()
+    key = count_cache_key(queryset)
+    generation = get_version(VERSION_NAME)
+    now = time.time()
+
+    entry = cache.get(key)
+    if entry is not None:
+        entry_generation, value, counted_at = entry
+        if entry_generation == generation:
+            return ResultCount(value)
+        threshold = getattr(settings, 'POLLS_COUNT_ESTIMATE_THRESHOLD', 10000)
+        max_age = getattr(settings, 'POLLS_COUNT_ESTIMATE_MAX_AGE', 300)
+        if value >= threshold and now - counted_at < max_age:
+            return ResultCount(value, approximate=True)
+
+    value = queryset.count()
+    cache.set(key, (generation, value, now), getattr(settings, 'POLLS_COUNT_CACHE_TIMEOUT', 3600))
+    return ResultCount(value)
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator whose total comes from cached_count()"""
+
+    @cached_property
+    def count(self):
+        if hasattr(self.object_list, 'query'):
+            return cached_count(self.object_list).value
+        return super().count
@@ -0,0 +1,40 @@
+from collections import namedtuple
+
+from django.db.models import CharField, Count, Value
+
+# Faceted counts
+#
+# facet_counts() answers "how many of these results fall in each category /
+# tag" for every facet at once: one GROUP BY per facet field, glued together
+# with UNION ALL into a single statement, instead of one COUNT per facet
+# value. The results queryset is used as a pk subquery, so search rank
+# annotations and ordering never leak into the grouping.
+
+FacetedResults = namedtuple('FacetedResults', ['results', 'facets'])
+
+
+def facet_counts(queryset, fields):
+    """Return {field: {value: count}} for ``fields`` over ``queryset`` in one query
+
+    ``fields`` are foreign key or many-to-many field names of the model;
+    values are the related primary keys (None for a null foreign key).
+    Counts are of distinct result rows.
+    """
+    fields = list(fields)
+    if not fields:
+        return {}
+    model = queryset.model
+    base = model._default_manager.filter(pk__in=queryset.order_by().values('pk'))
+
+    parts = [
+        base.order_by()
+        .values_list(Value(field, output_field=CharField()), field)
+        .annotate(count=Count('pk', distinct=True))
+        for field in fields
+    ]
+    query = parts[0].union(*parts[1:], all=True) if len(parts) > 1 else parts[0]
+
+    counts = {field: {} for field in fields}
+    for field, value, count in query:
+        counts[field][value] = count
+    return counts
@@ -3,9 +3,20 @@ from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
 from django.utils.text import slugify
 from .models import Question, Choice, Category, Person, Article, Tag
+from .categories import active_categories, category_cache
 
 
-class QuestionForm(forms.ModelForm):
+class CachedCategoryChoicesMixin:
+    """Build the category select from the category cache instead of a query per render"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        field = self.fields['category']
+        blank = [] if field.empty_label is None else [('', field.empty_label)]
+        field.choices = blank + [(category.pk, str(category)) for category in category_cache.all()]
+
+
+class QuestionForm(CachedCategoryChoicesMixin, forms.ModelForm):
     """Form for creating/editing questions"""
     
     class Meta:
@@ -59,7 +70,7 @@ ChoiceFormSet = forms.modelformset_factory(
 )
 
 
-class QuestionWithChoicesForm(forms.ModelForm):
+class QuestionWithChoicesForm(CachedCategoryChoicesMixin, forms.ModelForm):
     """Combined form for question with inline choices"""
     
     choice_1 = forms.CharField(
@@ -310,10 +321,9 @@ class SearchForm(forms.Form):
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # Populate category choices dynamically
-        categories = Category.objects.filter(is_active=True)
+        # Populate category choices from the per-process category cache
         category_choices = [('', 'All Categories')]
-        category_choices.extend([(cat.slug, cat.name) for cat in categories])
+        category_choices.extend([(cat.slug, cat.name) for cat in active_categories()])
         self.fields['category'].choices = category_choices
 
 
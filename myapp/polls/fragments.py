@@ -0,0 +1,135 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import models, transaction
+
+from .versions import bump_version, get_versions
+
+# Template fragment caching
+#
+# {% cachefragment %} (polls_cache tag library) caches a rendered block under
+# a key built from the version stamps (polls.versions) of what it shows. A
+# model instance contributes two stamps, its own ("polls.question:12") and its
+# model's ("polls.question"); a plain string is used as a stamp name as is
+# ("categories", "counts"). Writers bump stamps instead of deleting keys:
+#
+#   Question / Choice save or delete   -> that question's stamp
+#   vote counters written              -> the stamps of the questions voted on
+#   Category save or delete            -> "categories" and every question
+#
+# All stamps are read with one get_many, and a bump makes the old key
+# unreachable for every worker reading the same version cache, so a fragment
+# is not served after its data changed. That needs POLLS_VERSION_CACHE and
+# POLLS_FRAGMENT_CACHE to be shared by all workers (the 'shared' alias in
+# settings); with a per-process cache, other workers keep serving what they
+# cached until POLLS_FRAGMENT_CACHE_TIMEOUT. Bumps wait for the transaction
+# to commit, so a concurrent render cannot cache the old rows under the new
+# stamp.
+#
+# Hits and misses are counted per fragment name in the fragment cache when
+# POLLS_FRAGMENT_CACHE_STATS is on; `manage.py fragment_cache_stats` reads
+# them from there, so it only sees the web workers' lookups when that cache
+# is shared. Counting costs a cache write per lookup (a file rewrite on the
+# file cache, whose incr is not atomic either), so it is off by default:
+# switch it on for a while to measure hit rates, then off again.
+
+STATS_KEY = 'polls:fragment-stats'
+
+
+def _cache():
+    return caches[getattr(settings, 'POLLS_FRAGMENT_CACHE', 'default')]
+
+
+def model_stamp(model):
+    return model._meta.label_lower
+
+
+def object_stamp(instance):
+    return f'{model_stamp(type(instance))}:{instance.pk}'
+
+
+def question_stamp(question_id):
+    from .models import Question
+
+    return f'{model_stamp(Question)}:{question_id}'
+
+
+def stamp_names(dependency):
+    """Version stamp names for a model instance, an iterable of them, or a stamp name"""
+    if isinstance(dependency, str):
+        return [dependency]
+    if isinstance(dependency, models.Model):
+        return [object_stamp(dependency), model_stamp(type(dependency))]
+    names = []
+    for item in dependency:
+        names.extend(stamp_names(item))
+    return names
+
+
+def touch(names):
+    """Bump ``names`` once the current transaction (if any) commits"""
+    names = list(names)
+    transaction.on_commit(lambda: [bump_version(name) for name in names])
+
+
+def touch_questions(question_ids=None):
+    """Invalidate fragments showing these questions (all questions when None)"""
+    from .models import Question
+
+    if question_ids is None:
+        touch([model_stamp(Question)])
+    else:
+        touch(question_stamp(question_id) for question_id in set(question_ids))
+
+
+def fragment_key(name, dependencies, vary_on=()):
+    names = []
+    for dependency in dependencies:
+        names.extend(stamp_names(dependency))
+    versions = get_versions(names)
+    parts = [f'{stamp}={versions[stamp]}' for stamp in names] + [str(value) for value in vary_on]
+    digest = hashlib.md5(':'.join(parts).encode(), usedforsecurity=False).hexdigest()
+    return f'polls:fragment:{name}:{digest}'
+
+
+def get_fragment(key):
+    return _cache().get(key)
+
+
+def set_fragment(key, content):
+    _cache().set(key, content, getattr(settings, 'POLLS_FRAGMENT_CACHE_TIMEOUT', 3600))
+
+
+def record_lookup(name, hit):
+    if not getattr(settings, 'POLLS_FRAGMENT_CACHE_STATS', False):
+        return
+    cache = _cache()
+    key = f'{STATS_KEY}:{name}:{"hits" if hit else "misses"}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+        cache.set(STATS_KEY, set(cache.get(STATS_KEY, ())) | {name}, None)
+
+
+def fragment_stats():
+    """Return {fragment name: (hits, misses)} across all workers sharing the cache"""
+    cache = _cache()
+    stats = {}
+    for name in sorted(cache.get(STATS_KEY, ())):
+        stats[name] = (
+            cache.get(f'{STATS_KEY}:{name}:hits', 0),
+            cache.get(f'{STATS_KEY}:{name}:misses', 0),
+        )
+    return stats
+
+
+def reset_fragment_stats():
+    cache = _cache()
+    names = cache.get(STATS_KEY, ())
+    cache.delete_many(
+        [f'{STATS_KEY}:{name}:{kind}' for name in names for kind in ('hits', 'misses')]
+    )
+    cache.delete(STATS_KEY)
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+
+from .tallies import tally_question
+
+# Live results
+#
+# One producer task per question reads the tally and fans it out to every
+# connected client. Producers wake up when a vote is recorded in this process
+# (notify) or every POLLS_LIVE_POLL_INTERVAL seconds to catch votes from other
+# workers, and never publish more than POLLS_LIVE_MAX_UPDATES_PER_SECOND.
+# Each subscriber only keeps the latest snapshot, so slow clients skip stale
+# updates instead of queueing them. A failing tally (e.g. a database error) is
+# logged and retried with exponential backoff; a producer that ends anyway
+# unregisters itself so the next subscriber starts a fresh one.
+#
+# Streaming only pays off under ASGI: a WSGI worker would spend its whole
+# thread on one open page, so there the stream view answers with a single
+# snapshot and results.html does not open an EventSource at all.
+# POLLS_LIVE_STREAM = False turns the stream off everywhere.
+
+logger = logging.getLogger(__name__)
+
+
+def stream_enabled(request):
+    """Whether live tallies are streamed to clients served by ``request``"""
+    return getattr(settings, 'POLLS_LIVE_STREAM', True) and isinstance(request, ASGIRequest)
+
+
+def tally_event(snapshot):
+    """Format a tally snapshot as a server-sent event"""
+    return f'event: tally\ndata: {json.dumps(snapshot)}\n\n'
+
+
+class TallyBroadcaster:
+    """Fan out tally snapshots for a question to all subscribed streams"""
+
+    def __init__(self):
+        self._loop = None
+        self._subscribers = {}  # question_id -> set of asyncio.Queue
+        self._producers = {}  # question_id -> asyncio.Task
+        self._wakeups = {}  # question_id -> asyncio.Event
+        self._latest = {}  # question_id -> last published snapshot
+        self.retry_delay = 0.5  # first backoff after a failed tally, doubled per failure
+        self.max_retry_delay = 30.0
+
+    @property
+    def max_updates_per_second(self):
+        return getattr(settings, 'POLLS_LIVE_MAX_UPDATES_PER_SECOND', 2)
+
+    @property
+    def poll_interval(self):
+        return getattr(settings, 'POLLS_LIVE_POLL_INTERVAL', 5.0)
+
+    def notify(self, question_id):
+        """Wake the producer for ``question_id``; safe to call from any thread"""
+        loop = self._loop
+        if loop is None or question_id not in self._wakeups or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._wake, question_id)
+
+    def _wake(self, question_id):
+        wakeup = self._wakeups.get(question_id)
+        if wakeup is not None:
+            wakeup.set()
+
+    def subscribe(self, question_id):
+        self._loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=1)
+        self._subscribers.setdefault(question_id, set()).add(queue)
+        if question_id in self._latest:
+            queue.put_nowait(self._latest[question_id])
+        if question_id not in self._producers:
+            self._wakeups[question_id] = asyncio.Event()
+            self._producers[question_id] = asyncio.create_task(self._produce(question_id))
+        return queue
+
+    def unsubscribe(self, question_id, queue):
+        subscribers = self._subscribers.get(question_id, set())
+        subscribers.discard(queue)
+        if not subscribers:
+            # Last client left: stop polling this question
+            self._subscribers.pop(question_id, None)
+            self._wakeups.pop(question_id, None)
+            self._latest.pop(question_id, None)
+            producer = self._producers.pop(question_id, None)
+            if producer is not None:
+                producer.cancel()
+
+    async def _produce(self, question_id):
+        wakeup = self._wakeups[question_id]
+        last_snapshot = None
+        failures = 0
+        try:
+            while True:
+                try:
+                    snapshot = await sync_to_async(tally_question)(question_id)
+                except Exception:
+                    failures += 1
+                    delay = min(self.retry_delay * 2 ** (failures - 1), self.max_retry_delay)
+                    logger.exception('Live tally for question %s failed, retrying in %.1fs', question_id, delay)
+                    await asyncio.sleep(delay)
+                    continue
+                failures = 0
+                if snapshot != last_snapshot:
+                    last_snapshot = snapshot
+                    self._publish(question_id, snapshot)
+
+                # Coalesce bursts of votes into one update per window
+                await asyncio.sleep(1 / self.max_updates_per_second)
+                try:
+                    await asyncio.wait_for(wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                wakeup.clear()
+        finally:
+            if self._producers.get(question_id) is asyncio.current_task():
+                self._producers.pop(question_id, None)
+                self._wakeups.pop(question_id, None)
+
+    def _publish(self, question_id, snapshot):
+        self._latest[question_id] = snapshot
+        for queue in self._subscribers.get(question_id, ()):
+            if queue.full():
+                queue.get_nowait()  # drop the stale snapshot
+            queue.put_nowait(snapshot)
+
+    async def stream(self, question_id):
+        """Yield server-sent events for ``question_id`` until the client disconnects"""
+        queue = self.subscribe(question_id)
+        keepalive = getattr(settings, 'POLLS_LIVE_KEEPALIVE', 15.0)
+        try:
+            while True:
+                try:
+                    snapshot = await asyncio.wait_for(queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield tally_event(snapshot)
+        finally:
+            self.unsubscribe(question_id, queue)
+
+
+live_tallies = TallyBroadcaster()
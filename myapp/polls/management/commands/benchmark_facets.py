@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from polls.facets import facet_counts
+from polls.models import Question, Category, Article, Tag
+
+
+class Command(BaseCommand):
+    help = "Compare one-COUNT-per-facet against the single grouped facet query"
+
+    def add_arguments(self, parser):
+        parser.add_argument('query', help='Search text for the question facets')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        questions = Question.objects.search(options['query']).filter(is_active=True)
+        articles = Article.objects.all()
+        categories = list(Category.objects.values_list('pk', flat=True))
+        tags = list(Tag.objects.values_list('pk', flat=True))
+
+        def naive():
+            counts = {'question categories': {}, 'article categories': {}, 'article tags': {}}
+            for pk in categories:
+                counts['question categories'][pk] = questions.filter(category=pk).count()
+                counts['article categories'][pk] = articles.filter(category=pk).count()
+            for pk in tags:
+                counts['article tags'][pk] = articles.filter(tags=pk).count()
+            return counts
+
+        def grouped():
+            return facet_counts(questions, ['category']), facet_counts(articles, ['category', 'tags'])
+
+        self.stdout.write(
+            f'{len(categories)} categories, {len(tags)} tags, {repeat} runs '
+            f'({connection.vendor} backend)'
+        )
+        for label, run in (('naive', naive), ('grouped', grouped)):
+            with CaptureQueriesContext(connection) as queries:
+                run()
+            started = time.perf_counter()
+            for _ in range(repeat):
+                run()
+            elapsed = (time.perf_counter() - started) / repeat
+            self.stdout.write(
+                f'  {label:>8}: {elapsed * 1000:8.2f} ms/run, {len(queries)} quer{"y" if len(queries) == 1 else "ies"}'
+            )
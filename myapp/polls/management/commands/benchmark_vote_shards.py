@@ -0,0 +1,67 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection, OperationalError
+from django.test.utils import override_settings
+
+from polls.models import Question, Choice
+from polls.voting import record_vote, fold_vote_shards, statistics_buffer
+
+
+class Command(BaseCommand):
+    help = "Compare single-row vs sharded vote counters under concurrent writers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--votes', type=int, default=2000, help='Total votes per run')
+        parser.add_argument('--shards', type=int, default=16)
+
+    @override_settings(POLLS_VOTE_MODE='strict')
+    def handle(self, *args, **options):
+        threads = options['threads']
+        votes = options['votes']
+
+        self.stdout.write(
+            f'{votes} votes on one choice from {threads} threads '
+            f'({connection.vendor} backend)'
+        )
+        for shard_count in (1, options['shards']):
+            question = Question.objects.create(
+                question_text='Vote shard benchmark', is_active=False, vote_shards=shard_count
+            )
+            choice = Choice.objects.create(question=question, choice_text='Hot choice')
+            try:
+                elapsed, errors = self.run(choice, threads, votes)
+                fold_vote_shards([question.id])
+                choice.refresh_from_db()
+                label = 'single row' if shard_count == 1 else f'{shard_count} shards'
+                self.stdout.write(
+                    f'  {label:>12}: {votes / elapsed:8.0f} votes/sec, '
+                    f'{errors} lock error(s), {choice.votes} counted'
+                )
+            finally:
+                # Count the run's votes while the question still exists
+                statistics_buffer.flush()
+                question.delete()
+
+    def run(self, choice, threads, votes):
+        per_thread = votes // threads
+        choice = Choice.objects.select_related('question').get(pk=choice.pk)
+
+        def worker(_):
+            errors = 0
+            try:
+                for _ in range(per_thread):
+                    try:
+                        record_vote(choice)
+                    except OperationalError:
+                        errors += 1
+            finally:
+                connection.close()
+            return errors
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            errors = sum(pool.map(worker, range(threads)))
+        return time.perf_counter() - started, errors
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from polls.voting import fold_vote_shards
+
+
+class Command(BaseCommand):
+    help = "Fold sharded vote counters back into Choice.votes and Question.total_votes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'question_ids', nargs='*', type=int,
+            help='Only fold shards of these questions (default: all)',
+        )
+
+    def handle(self, *args, **options):
+        question_ids = options['question_ids'] or None
+        folded = fold_vote_shards(question_ids)
+        self.stdout.write(self.style.SUCCESS(f'Folded {folded} sharded vote(s).'))
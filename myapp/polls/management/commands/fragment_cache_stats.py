@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from polls.fragments import fragment_stats, reset_fragment_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Show hit rates of the cached template fragments, as recorded in POLLS_FRAGMENT_CACHE "
+        "while POLLS_FRAGMENT_CACHE_STATS is on"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Zero the counters afterwards")
+
+    def handle(self, *args, **options):
+        stats = fragment_stats()
+        if not stats:
+            self.stdout.write('No fragment lookups recorded (is POLLS_FRAGMENT_CACHE_STATS on?).')
+        for name, (hits, misses) in stats.items():
+            lookups = hits + misses
+            rate = hits / lookups * 100 if lookups else 0
+            self.stdout.write(f'{name:<20} {hits:>8} hits {misses:>8} misses {rate:6.1f}%')
+        if options['reset']:
+            reset_fragment_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset.'))
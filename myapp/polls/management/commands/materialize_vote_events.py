@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from polls.voting import materialize_vote_events
+
+
+class Command(BaseCommand):
+    help = "Fold VoteEvent rows above the high-water mark into Choice.votes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        folded = materialize_vote_events(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Materialized {folded} vote event(s).'))
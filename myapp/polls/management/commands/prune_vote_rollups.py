@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from polls.timeseries import prune_rollups
+
+
+class Command(BaseCommand):
+    help = "Delete vote time-series buckets older than POLLS_VOTE_ROLLUP_RETENTION"
+
+    def handle(self, *args, **options):
+        deleted = prune_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired bucket(s).'))
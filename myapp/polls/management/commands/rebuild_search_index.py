@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from polls import bm25
+from polls.search import fts_available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index and BM25 statistics for questions and choices"
+
+    def handle(self, *args, **options):
+        indexed = bm25.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Computed BM25 statistics for {indexed} question(s).'))
+        if not fts_available():
+            self.stdout.write(self.style.WARNING('Full-text search is not available on this database.'))
+            return
+        indexed = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} question(s).'))
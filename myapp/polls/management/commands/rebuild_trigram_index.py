@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from polls.trigrams import trigram_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the memory-mapped trigram search index from the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        indexed = trigram_index.rebuild(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {indexed} question(s) into {trigram_index.path}.'
+        ))
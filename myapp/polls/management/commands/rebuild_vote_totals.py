@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from polls.models import Question
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized Question.total_votes column from Choice rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'question_ids', nargs='*', type=int,
+            help='Only rebuild these questions (default: all)',
+        )
+
+    def handle(self, *args, **options):
+        question_ids = options['question_ids'] or None
+        updated = Question.objects.rebuild_total_votes(question_ids)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt total_votes for {updated} question(s).'))
@@ -0,0 +1,27 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.voting import rebuild_votes_from_log
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute Choice.votes and Question.total_votes from the VoteEvent log. "
+        "Refused unless POLLS_VOTE_MODE = 'event_log', the only mode that logs every vote."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'question_ids', nargs='*', type=int,
+            help='Only rebuild these questions (default: all)',
+        )
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            rebuilt = rebuild_votes_from_log(
+                options['question_ids'] or None, chunk_size=options['chunk_size']
+            )
+        except ImproperlyConfigured as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt vote counts for {rebuilt} choice(s).'))
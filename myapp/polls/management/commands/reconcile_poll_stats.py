@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from polls.statistics import reconcile
+
+
+class Command(BaseCommand):
+    help = "Recompute the materialized poll statistics and report any drift"
+
+    def handle(self, *args, **options):
+        drift = reconcile()
+        for label, stored, actual in drift:
+            self.stdout.write(f'  {label}: {stored} -> {actual}')
+        if drift:
+            self.stdout.write(self.style.WARNING(f'Corrected {len(drift)} drifted value(s).'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Statistics were up to date.'))
@@ -0,0 +1,217 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+# Admission control for write endpoints
+#
+# Token buckets per client (IP address) and per question, configured per URL
+# name in POLLS_RATE_LIMITS. Requests over the limit get a plain 429 from
+# process_view, i.e. after URL resolution but before the view runs any query.
+# A request turned away by one bucket gets back the tokens it already took
+# from the others, so a busy question does not use up its clients' budgets.
+#
+# POLLS_RATE_LIMIT_BACKEND = 'shared' (default) keeps the buckets in a
+# memory-mapped file (POLLS_RATE_LIMIT_SHARED_PATH) that every worker on the
+# host maps; each take is one locked read-modify-write of a 24-byte slot.
+# POLLS_RATE_LIMIT_BACKEND = 'cache' keeps them in the Django cache named by
+# POLLS_RATE_LIMIT_CACHE for workers spread over several hosts; the cache
+# needs an atomic add() (memcached, redis, locmem), which guards each bucket.
+# POLLS_RATE_LIMIT_BACKEND = 'local' keeps them in this process only, and is
+# used where 'shared' is unavailable (no fcntl).
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+
+def refill(tokens, last, now, rate, burst, cost=1):
+    """Take ``cost`` tokens from a bucket; returns (tokens left, seconds to wait or 0)
+
+    A negative cost puts tokens back, up to ``burst``.
+    """
+    tokens = min(burst, tokens + max(now - last, 0) * rate)
+    if tokens >= cost:
+        return min(burst, tokens - cost), 0
+    return tokens, (cost - tokens) / rate
+
+
+class LocalBuckets:
+    """Token buckets held in this process's memory"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> (tokens, timestamp)
+
+    def take(self, key, rate, burst, cost=1):
+        """Take ``cost`` tokens; returns 0 if allowed, else seconds until they are available"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (burst, now))
+            tokens, wait = refill(tokens, last, now, rate, burst, cost)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return wait
+
+    def _prune(self, now):
+        # Drop the oldest half; an unseen key starts with a full bucket anyway
+        stale = sorted(self._buckets, key=lambda key: self._buckets[key][1])
+        for key in stale[:len(stale) // 2]:
+            del self._buckets[key]
+
+
+SLOT = struct.Struct('<Qdd')  # key hash (0 = free), tokens, last update
+PROBES = 8
+
+
+class SharedMemoryBuckets:
+    """Token buckets in a memory-mapped file shared by every worker on this host
+
+    Buckets live in a fixed table of slots found by hashing the key; when all
+    PROBES candidate slots belong to other keys the least recently used one is
+    taken over (its owner simply starts again with a full bucket). Each take
+    holds an exclusive flock on the file, so no two requests, in any process,
+    can spend the same token.
+    """
+
+    def __init__(self, path, slots=65536):
+        self._lock = threading.Lock()  # flock does not order threads sharing one descriptor
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = max(os.fstat(self._fd).st_size, slots * SLOT.size)
+        os.ftruncate(self._fd, size)
+        self.slots = size // SLOT.size
+        self._map = mmap.mmap(self._fd, size)
+
+    def take(self, key, rate, burst, cost=1):
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                offset, tokens, last = self._find(digest, now, burst)
+                tokens, wait = refill(tokens, last, now, rate, burst, cost)
+                SLOT.pack_into(self._map, offset, digest, tokens, now)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return wait
+
+    def _find(self, digest, now, burst):
+        """(offset, tokens, last) of the key's slot, claiming one for a new key"""
+        oldest = None
+        for probe in range(PROBES):
+            offset = (digest + probe) % self.slots * SLOT.size
+            owner, tokens, last = SLOT.unpack_from(self._map, offset)
+            if owner == digest:
+                return offset, tokens, last
+            if owner == 0:
+                return offset, burst, now
+            if oldest is None or last < oldest[1]:
+                oldest = (offset, last)
+        return oldest[0], burst, now
+
+
+class CacheBuckets:
+    """Token buckets in a Django cache shared by all workers
+
+    Each bucket is updated under a short lock taken with cache.add(), so
+    concurrent requests cannot both spend the last token. A request that
+    cannot get the lock within LOCK_WAIT seconds is shed.
+    """
+
+    LOCK_WAIT = 0.05
+    LOCK_TIMEOUT = 1
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def take(self, key, rate, burst, cost=1):
+        lock = f'{key}:lock'
+        deadline = time.monotonic() + self.LOCK_WAIT
+        while not self.cache.add(lock, 1, self.LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                return 1 / rate
+            time.sleep(0.001)
+        try:
+            now = time.time()
+            tokens, last = self.cache.get(key, (burst, now))
+            tokens, wait = refill(tokens, last, now, rate, burst, cost)
+            self.cache.set(key, (tokens, now), math.ceil(burst / rate) + 1)
+        finally:
+            self.cache.delete(lock)
+        return wait
+
+
+def get_buckets():
+    """The bucket store named by POLLS_RATE_LIMIT_BACKEND"""
+    backend = getattr(settings, 'POLLS_RATE_LIMIT_BACKEND', 'shared')
+    if backend == 'cache':
+        return CacheBuckets(getattr(settings, 'POLLS_RATE_LIMIT_CACHE', 'default'))
+    if backend == 'shared' and fcntl is not None:
+        return SharedMemoryBuckets(
+            getattr(settings, 'POLLS_RATE_LIMIT_SHARED_PATH', os.path.join(tempfile.gettempdir(), 'polls-ratelimit')),
+            getattr(settings, 'POLLS_RATE_LIMIT_SHARED_SLOTS', 65536),
+        )
+    return LocalBuckets()
+
+
+class RateLimitMiddleware:
+    """Shed excess writes to rate-limited URL names with a cheap 429"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.limits = getattr(settings, 'POLLS_RATE_LIMITS', {})
+        self.buckets = get_buckets()
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method in SAFE_METHODS or request.resolver_match is None:
+            return None
+        view_name = request.resolver_match.view_name
+        limits = self.limits.get(view_name)
+        if not limits:
+            return None
+
+        scopes = []
+        if 'client' in limits:
+            scopes.append((f'client:{self.client_id(request)}', limits['client']))
+        question_id = view_kwargs.get('question_id')
+        if 'question' in limits and question_id is not None:
+            scopes.append((f'question:{question_id}', limits['question']))
+
+        taken = []
+        for scope, limit in scopes:
+            key = f'ratelimit:{view_name}:{scope}'
+            wait = self.buckets.take(key, limit['rate'], limit['burst'])
+            if wait:
+                # Rejected: give back what the earlier scopes spent on it
+                for spent_key, spent_limit in taken:
+                    self.buckets.take(spent_key, spent_limit['rate'], spent_limit['burst'], cost=-1)
+                response = HttpResponse('Too many requests', status=429, content_type='text/plain')
+                response['Retry-After'] = str(math.ceil(wait))
+                return response
+            taken.append((key, limit))
+        return None
+
+    @staticmethod
+    def client_id(request):
+        # Deliberately avoids request.user, which would hit the session store
+        if getattr(settings, 'POLLS_RATE_LIMIT_TRUST_X_FORWARDED_FOR', False):
+            forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+            if forwarded:
+                return forwarded.split(',')[0].strip()
+        return request.META.get('REMOTE_ADDR', '')
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:30
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_total_votes(apps, schema_editor):
+    Question = apps.get_model('polls', 'Question')
+    Choice = apps.get_model('polls', 'Choice')
+    choice_sums = Choice.objects.filter(question=OuterRef('pk')).order_by().values(
+        'question'
+    ).annotate(total=Sum('votes')).values('total')
+    Question.objects.update(total_votes=Coalesce(Subquery(choice_sums), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0002_article_tag_alter_category_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='total_votes',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_total_votes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0003_question_total_votes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='vote_shards',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Number of counter shards per choice (1 disables sharding)'),
+        ),
+        migrations.CreateModel(
+            name='ChoiceVoteShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('votes', models.IntegerField(default=0)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='polls.choice')),
+            ],
+            options={
+                'unique_together': {('choice', 'shard')},
+            },
+        ),
+    ]
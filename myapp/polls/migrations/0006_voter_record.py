@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:37
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0005_vote_event_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoterRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('voter_key', models.CharField(max_length=32)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='voter_records', to='polls.question')),
+            ],
+            options={
+                'unique_together': {('question', 'voter_key')},
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import OperationalError, migrations
+
+# Same table as polls.search.FTS_TABLE, spelled out so this migration does
+# not depend on the current code
+FTS_TABLE = 'polls_question_fts'
+
+
+def create_and_fill_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return  # QuestionManager.search() keeps using icontains
+    try:
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "question_text, choices_text, tokenize='unicode61 remove_diacritics 2')"
+        )
+    except OperationalError:
+        return  # no FTS5 in this SQLite build
+    schema_editor.execute(
+        f"INSERT INTO {FTS_TABLE} (rowid, question_text, choices_text) "
+        "SELECT q.id, q.question_text, "
+        "COALESCE((SELECT group_concat(c.choice_text, ' ') FROM polls_choice c "
+        "WHERE c.question_id = q.id), '') "
+        "FROM polls_question q"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0006_voter_record'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_and_fill_index, drop_index),
+    ]
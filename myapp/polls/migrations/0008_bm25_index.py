@@ -0,0 +1,102 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:52
+
+import re
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Tokenized as polls.bm25.tokenize() did when this migration was written
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+MAX_TERM_LENGTH = 100
+
+
+def fill_index(apps, schema_editor, chunk_size=1000):
+    Question = apps.get_model('polls', 'Question')
+    Choice = apps.get_model('polls', 'Choice')
+    SearchDocument = apps.get_model('polls', 'SearchDocument')
+    SearchTerm = apps.get_model('polls', 'SearchTerm')
+    SearchPosting = apps.get_model('polls', 'SearchPosting')
+    SearchCorpus = apps.get_model('polls', 'SearchCorpus')
+
+    document_frequency = Counter()
+    document_count = total_length = 0
+    ids = list(Question.objects.order_by('pk').values_list('pk', flat=True))
+    for i in range(0, len(ids), chunk_size):
+        texts = dict(Question.objects.filter(pk__in=ids[i:i + chunk_size]).values_list('id', 'question_text'))
+        for question_id, choice_text in Choice.objects.filter(question_id__in=texts).values_list(
+            'question_id', 'choice_text'
+        ):
+            texts[question_id] += ' ' + choice_text
+        documents = {
+            question_id: Counter(token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(text.casefold()))
+            for question_id, text in texts.items()
+        }
+        vocabulary = set().union(*documents.values())
+        SearchTerm.objects.bulk_create([SearchTerm(term=term) for term in vocabulary], ignore_conflicts=True)
+        term_ids = dict(SearchTerm.objects.filter(term__in=vocabulary).values_list('term', 'id'))
+        SearchDocument.objects.bulk_create([
+            SearchDocument(question_id=question_id, length=sum(counts.values()))
+            for question_id, counts in documents.items()
+        ])
+        SearchPosting.objects.bulk_create([
+            SearchPosting(term_id=term_ids[term], document_id=question_id, frequency=frequency)
+            for question_id, counts in documents.items()
+            for term, frequency in counts.items()
+        ], batch_size=1000)
+        for counts in documents.values():
+            document_frequency.update(counts.keys())
+            total_length += sum(counts.values())
+        document_count += len(documents)
+
+    terms = list(SearchTerm.objects.all())
+    for term in terms:
+        term.document_count = document_frequency[term.term]
+    SearchTerm.objects.bulk_update(terms, ['document_count'], batch_size=1000)
+    SearchCorpus.objects.create(pk=1, document_count=document_count, total_length=total_length)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0007_question_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchCorpus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_count', models.PositiveIntegerField(default=0)),
+                ('total_length', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='polls.question')),
+                ('length', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100, unique=True)),
+                ('document_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('frequency', models.PositiveIntegerField()),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='polls.searchdocument')),
+                ('term', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='polls.searchterm')),
+            ],
+            options={
+                'unique_together': {('term', 'document')},
+            },
+        ),
+        migrations.RunPython(fill_index, migrations.RunPython.noop),
+    ]
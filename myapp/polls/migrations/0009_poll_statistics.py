@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+
+def fill_statistics(apps, schema_editor):
+    Question = apps.get_model('polls', 'Question')
+    Choice = apps.get_model('polls', 'Choice')
+    ChoiceVoteShard = apps.get_model('polls', 'ChoiceVoteShard')
+    Category = apps.get_model('polls', 'Category')
+    PollStatistics = apps.get_model('polls', 'PollStatistics')
+    CategoryStatistics = apps.get_model('polls', 'CategoryStatistics')
+
+    PollStatistics.objects.create(
+        pk=1,
+        question_count=Question.objects.filter(is_active=True).count(),
+        category_count=Category.objects.filter(is_active=True).count(),
+        total_votes=(
+            (Choice.objects.aggregate(total=Sum('votes'))['total'] or 0)
+            + (ChoiceVoteShard.objects.aggregate(total=Sum('votes'))['total'] or 0)
+        ),
+        reconciled_at=timezone.now(),
+    )
+    categories = {pk: [0, 0] for pk in Category.objects.values_list('pk', flat=True)}
+    active = Question.objects.filter(is_active=True, category__isnull=False).order_by()
+    for category_id, questions in active.values_list('category').annotate(n=Count('pk')):
+        categories[category_id][0] = questions
+    for field in ('choices__votes', 'choices__shards__votes'):
+        for category_id, votes in active.values_list('category').annotate(total=Sum(field)):
+            categories[category_id][1] += votes or 0
+    CategoryStatistics.objects.bulk_create([
+        CategoryStatistics(category_id=pk, question_count=questions, total_votes=votes)
+        for pk, (questions, votes) in categories.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_bm25_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryStatistics',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='statistics', serialize=False, to='polls.category')),
+                ('question_count', models.IntegerField(default=0)),
+                ('total_votes', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Category statistics',
+            },
+        ),
+        migrations.CreateModel(
+            name='PollStatistics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question_count', models.IntegerField(default=0)),
+                ('category_count', models.IntegerField(default=0)),
+                ('total_votes', models.BigIntegerField(default=0)),
+                ('reconciled_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Poll statistics',
+            },
+        ),
+        migrations.RunPython(fill_statistics, migrations.RunPython.noop),
+    ]
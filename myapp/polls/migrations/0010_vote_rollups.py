@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0009_poll_statistics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour'), ('day', 'Day')], max_length=6)),
+                ('bucket', models.DateTimeField(help_text='Start of the bucket (UTC)')),
+                ('votes', models.IntegerField(default=0)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vote_rollups', to='polls.choice')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vote_rollups', to='polls.question')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['question', 'resolution', 'bucket'], name='polls_voter_questio_870b96_idx'), models.Index(fields=['resolution', 'bucket'], name='polls_voter_resolut_448367_idx')],
+                'unique_together': {('choice', 'resolution', 'bucket')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0010_vote_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('data', models.BinaryField(default=bytes)),
+                ('meta', models.JSONField(blank=True, default=dict)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
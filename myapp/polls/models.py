@@ -1,10 +1,17 @@
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
 from django.contrib.auth.models import User
 from django.urls import reverse
-from django.db.models import Q
+from django.db.models import Q, Sum, OuterRef, Subquery, Value, Case, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
 import datetime
 
+from .search import FTS_TABLE, build_match_query, fts_available
+from .fragments import touch_questions
+from .facets import FacetedResults, facet_counts
+
 # Create your models here.
 
 # Custom Manager for Question
@@ -13,10 +20,60 @@ class QuestionManager(models.Manager):
         return self.filter(pub_date__gte=timezone.now() - datetime.timedelta(days=7))
     
     def search(self, query):
+        backend = getattr(settings, 'POLLS_SEARCH_BACKEND', 'fts')
+        if backend == 'trigram':
+            from .trigrams import trigram_index
+
+            question_ids = trigram_index.search(query)
+            if question_ids is not None:
+                return self.filter(pk__in=question_ids).order_by('-pub_date')
+        if backend == 'bm25':
+            from . import bm25
+            
+            ranked = bm25.search(query)
+            if ranked or bm25.tokenize(query):
+                # Keep BM25 order: rank position becomes the sort key
+                return self.filter(pk__in=[question_id for question_id, _ in ranked]).annotate(
+                    search_rank=Case(
+                        *[When(pk=question_id, then=Value(position))
+                          for position, (question_id, _) in enumerate(ranked)],
+                        default=Value(len(ranked)),
+                    )
+                ).order_by('search_rank', '-pub_date')
+        match = build_match_query(query)
+        if backend == 'fts' and match and fts_available():
+            # Ranked full-text match (see polls.search); best matches first
+            table = self.model._meta.db_table
+            return self.filter(
+                pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,))
+            ).annotate(
+                search_rank=RawSQL(
+                    f'SELECT rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                    f'AND rowid = "{table}"."id"', (match,)
+                )
+            ).order_by('search_rank', '-pub_date')
         return self.filter(
             Q(question_text__icontains=query) | 
             Q(choices__choice_text__icontains=query)
         ).distinct()
+    
+    def faceted_search(self, query, facets=('category',), **filters):
+        """search() narrowed by ``filters``, plus per-facet hit counts from one grouped query"""
+        results = self.search(query).filter(**filters)
+        return FacetedResults(results, facet_counts(results, facets))
+    
+    def rebuild_total_votes(self, question_ids=None):
+        """Recompute the stored total_votes column from Choice rows in one UPDATE"""
+        choice_sums = Choice.objects.filter(question=OuterRef('pk')).order_by().values(
+            'question'
+        ).annotate(total=Sum('votes')).values('total')
+        questions = self.all()
+        if question_ids is not None:
+            questions = questions.filter(pk__in=question_ids)
+        touch_questions(question_ids)
+        return questions.update(
+            total_votes=Coalesce(Subquery(choice_sums), Value(0))
+        )
 
 
 class Question(models.Model):
@@ -25,6 +82,14 @@ class Question(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='questions', null=True, blank=True)
     is_active = models.BooleanField(default=True)
     category = models.ForeignKey('Category', on_delete=models.SET_NULL, null=True, blank=True)
+    # Denormalized sum of choices.votes, kept in step by the vote paths and
+    # Choice signals; rebuild with `manage.py rebuild_vote_totals`
+    total_votes = models.PositiveIntegerField(default=0, editable=False)
+    # Spread votes over this many ChoiceVoteShard rows per choice (1 = write
+    # Choice.votes directly). Raise it for polls expected to go viral.
+    vote_shards = models.PositiveSmallIntegerField(
+        default=1, help_text="Number of counter shards per choice (1 disables sharding)"
+    )
     
     # Custom manager
     objects = QuestionManager()
@@ -39,9 +104,6 @@ class Question(models.Model):
     def get_absolute_url(self):
         return reverse('polls:detail', kwargs={'pk': self.pk})
     
-    def total_votes(self):
-        return sum(choice.votes for choice in self.choices.all())
-    
     class Meta:
         ordering = ['-pub_date']
         verbose_name = "Poll Question"
@@ -62,7 +124,7 @@ class Choice(models.Model):
         return self.choice_text
     
     def vote_percentage(self):
-        total_votes = self.question.total_votes()
+        total_votes = self.question.total_votes
         if total_votes == 0:
             return 0
         return (self.votes / total_votes) * 100
@@ -72,6 +134,148 @@ class Choice(models.Model):
         unique_together = ['question', 'choice_text']
 
 
+class ChoiceVoteShard(models.Model):
+    """One of N counter rows holding not-yet-folded votes for a hot choice"""
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, related_name='shards')
+    shard = models.PositiveSmallIntegerField()
+    votes = models.IntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.choice} [shard {self.shard}]"
+    
+    class Meta:
+        unique_together = ['choice', 'shard']
+
+
+class VoteEvent(models.Model):
+    """Append-only record of a single vote; the id doubles as the log sequence"""
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='vote_events')
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, related_name='vote_events')
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"Vote #{self.pk} for {self.choice_id}"
+    
+    class Meta:
+        ordering = ['id']
+
+
+class VoteTallyCheckpoint(models.Model):
+    """High-water mark: VoteEvents up to last_event_id are folded into the counters"""
+    name = models.CharField(max_length=50, unique=True)
+    last_event_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} @ {self.last_event_id}"
+
+
+class VoteRollup(models.Model):
+    """Votes for one choice within one time bucket (minute, hour or day)"""
+    MINUTE = 'minute'
+    HOUR = 'hour'
+    DAY = 'day'
+    RESOLUTION_CHOICES = [(MINUTE, 'Minute'), (HOUR, 'Hour'), (DAY, 'Day')]
+    
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='vote_rollups')
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, related_name='vote_rollups')
+    resolution = models.CharField(max_length=6, choices=RESOLUTION_CHOICES)
+    bucket = models.DateTimeField(help_text="Start of the bucket (UTC)")
+    votes = models.IntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.choice_id} @ {self.bucket:%Y-%m-%d %H:%M} ({self.resolution}): {self.votes}"
+    
+    class Meta:
+        unique_together = ['choice', 'resolution', 'bucket']
+        indexes = [
+            models.Index(fields=['question', 'resolution', 'bucket']),
+            models.Index(fields=['resolution', 'bucket']),
+        ]
+
+
+class VoteSketch(models.Model):
+    """A serialized HyperLogLog or count-min sketch merged from every worker"""
+    name = models.CharField(max_length=100, unique=True)
+    data = models.BinaryField(default=bytes)
+    # Extra state kept with the sketch, e.g. heavy-hitter candidates
+    meta = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return self.name
+
+
+class VoterRecord(models.Model):
+    """Ledger entry: this voter has already voted on this question"""
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='voter_records')
+    # Hashed user/session identity, never the raw session key
+    voter_key = models.CharField(max_length=32)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.voter_key} voted on {self.question_id}"
+    
+    class Meta:
+        unique_together = ['question', 'voter_key']
+
+
+class SearchDocument(models.Model):
+    """BM25 statistics for one question: its length in tokens"""
+    question = models.OneToOneField(
+        Question, on_delete=models.CASCADE, primary_key=True, related_name='search_document'
+    )
+    length = models.PositiveIntegerField()
+
+
+class SearchTerm(models.Model):
+    """A token of question/choice text and how many questions contain it"""
+    term = models.CharField(max_length=100, unique=True)
+    document_count = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return self.term
+
+
+class SearchPosting(models.Model):
+    """Occurrences of a term in one question (text and choices)"""
+    term = models.ForeignKey(SearchTerm, on_delete=models.CASCADE, related_name='postings')
+    document = models.ForeignKey(SearchDocument, on_delete=models.CASCADE, related_name='postings')
+    frequency = models.PositiveIntegerField()
+    
+    class Meta:
+        unique_together = ['term', 'document']
+
+
+class SearchCorpus(models.Model):
+    """Corpus-wide BM25 totals, kept in a single row"""
+    document_count = models.PositiveIntegerField(default=0)
+    total_length = models.PositiveBigIntegerField(default=0)
+
+
+class PollStatistics(models.Model):
+    """Site-wide totals for the stats page, kept in a single row"""
+    question_count = models.IntegerField(default=0)  # active questions
+    category_count = models.IntegerField(default=0)  # active categories
+    total_votes = models.BigIntegerField(default=0)  # every vote, unfolded shards included
+    reconciled_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name_plural = "Poll statistics"
+
+
+class CategoryStatistics(models.Model):
+    """Active question count and their votes for one category"""
+    category = models.OneToOneField(
+        'Category', on_delete=models.CASCADE, primary_key=True, related_name='statistics'
+    )
+    question_count = models.IntegerField(default=0)
+    total_votes = models.BigIntegerField(default=0)
+    
+    class Meta:
+        verbose_name_plural = "Category statistics"
+
+
 class Person(models.Model):
     GENDER_CHOICES = [
         ('M', 'Male'),
@@ -157,6 +361,13 @@ class Tag(models.Model):
         ordering = ['name']
 
 
+class ArticleManager(models.Manager):
+    def faceted_listing(self, facets=('category', 'tags'), **filters):
+        """Articles matching ``filters`` plus per-category and per-tag counts in one query"""
+        results = self.filter(**filters)
+        return FacetedResults(results, facet_counts(results, facets))
+
+
 class Article(models.Model):
     STATUS_CHOICES = [
         ('draft', 'Draft'),
@@ -178,6 +389,8 @@ class Article(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     published_at = models.DateTimeField(null=True, blank=True)
     
+    objects = ArticleManager()
+    
     def __str__(self):
         return self.title
     
@@ -0,0 +1,164 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+# Keyset (seek) pagination
+#
+# Instead of OFFSET n, each page continues from the last row of the previous
+# one: WHERE (pub_date, id) < (last pub_date, last id) ORDER BY pub_date DESC,
+# id DESC LIMIT per_page + 1. The pub_date index serves the range and the
+# order directly (id is the SQLite rowid, so it is implied in every index),
+# so page 1000 costs the same as page 1 and no COUNT(*) is run.
+#
+# Cursors are opaque, URL-safe tokens carrying the direction and the sort key
+# of the boundary row. A cursor that fails to decode gives the first page,
+# like Paginator.get_page does for a bad page number.
+#
+# POLLS_PAGINATION = 'keyset' (default) or 'offset' for numbered pages.
+
+DEFAULT_ORDERING = ('-pub_date', '-id')
+CURSOR_PARAM = 'cursor'
+
+
+def keyset_enabled():
+    return getattr(settings, 'POLLS_PAGINATION', 'keyset') == 'keyset'
+
+
+def _jsonable(value):
+    # Full isoformat: DjangoJSONEncoder drops microseconds, which would break ties
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+class KeysetPage:
+    """One page of rows plus cursors for its neighbours"""
+
+    cursor_based = True
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """Paginate a queryset by seeking on a unique ordering instead of OFFSET"""
+
+    def __init__(self, queryset, per_page, ordering=DEFAULT_ORDERING):
+        self.queryset = queryset.order_by(*ordering)
+        self.per_page = int(per_page)
+        self.ordering = [
+            (name.lstrip('-'), name.startswith('-')) for name in ordering
+        ]
+
+    # Cursor tokens
+
+    def encode_cursor(self, obj, direction):
+        values = [_jsonable(getattr(obj, name)) for name, _ in self.ordering]
+        payload = json.dumps([direction, values], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Return (direction, values), or None if ``cursor`` is not a valid token"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, values = json.loads(base64.urlsafe_b64decode(padded))
+            if direction not in ('next', 'prev') or len(values) != len(self.ordering):
+                return None
+            model = self.queryset.model
+            return direction, [
+                model._meta.get_field(name).to_python(value)
+                for (name, _), value in zip(self.ordering, values)
+            ]
+        except (ValueError, TypeError, binascii.Error, FieldDoesNotExist, ValidationError):
+            return None
+
+    # Queries
+
+    def _seek_filter(self, values, forward):
+        """Rows strictly after ``values`` in the ordering (before them if not ``forward``)"""
+        condition = Q()
+        for i in reversed(range(len(self.ordering))):
+            name, descending = self.ordering[i]
+            lookup = 'lt' if descending == forward else 'gt'
+            equal = {self.ordering[j][0]: values[j] for j in range(i)}
+            condition = Q(**equal, **{f'{name}__{lookup}': values[i]}) | condition
+        # Lead with a plain range on the first column so the index bounds the scan
+        name, descending = self.ordering[0]
+        bound = 'lte' if descending == forward else 'gte'
+        return Q(**{f'{name}__{bound}': values[0]}) & condition
+
+    def get_page(self, cursor=None):
+        decoded = self.decode_cursor(cursor) if cursor else None
+        if decoded is None:
+            rows = list(self.queryset[:self.per_page + 1])
+            has_more, rows = len(rows) > self.per_page, rows[:self.per_page]
+            return self._page(rows, has_next=has_more, has_previous=False)
+
+        direction, values = decoded
+        if direction == 'next':
+            rows = list(self.queryset.filter(self._seek_filter(values, forward=True))[:self.per_page + 1])
+            has_more, rows = len(rows) > self.per_page, rows[:self.per_page]
+            return self._page(rows, has_next=has_more, has_previous=True)
+
+        reverse_ordering = [
+            name if descending else f'-{name}' for name, descending in self.ordering
+        ]
+        rows = list(
+            self.queryset.filter(self._seek_filter(values, forward=False))
+            .order_by(*reverse_ordering)[:self.per_page + 1]
+        )
+        has_more, rows = len(rows) > self.per_page, rows[:self.per_page][::-1]
+        return self._page(rows, has_next=True, has_previous=has_more)
+
+    def _page(self, rows, has_next, has_previous):
+        return KeysetPage(
+            rows,
+            self,
+            next_cursor=self.encode_cursor(rows[-1], 'next') if rows and has_next else None,
+            previous_cursor=self.encode_cursor(rows[0], 'prev') if rows and has_previous else None,
+        )
+
+
+def paginate(request, queryset, per_page, ordering=DEFAULT_ORDERING):
+    """Page of ``queryset`` for this request: keyset or numbered per POLLS_PAGINATION"""
+    if keyset_enabled():
+        return KeysetPaginator(queryset, per_page, ordering).get_page(request.GET.get(CURSOR_PARAM))
+    return Paginator(queryset, per_page).get_page(request.GET.get('page'))
+
+
+class KeysetPaginationMixin:
+    """ListView mixin: paginate by cursor instead of page number when keyset is enabled"""
+
+    keyset_ordering = DEFAULT_ORDERING
+
+    def paginate_queryset(self, queryset, page_size):
+        if not keyset_enabled():
+            return super().paginate_queryset(queryset, page_size)
+        page = KeysetPaginator(queryset, page_size, self.keyset_ordering).get_page(
+            self.request.GET.get(CURSOR_PARAM)
+        )
+        return page.paginator, page, page.object_list, page.has_other_pages()
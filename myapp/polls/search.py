@@ -0,0 +1,93 @@
+import re
+
+from django.db import connection
+
+# Full-text search
+#
+# On SQLite with FTS5 the polls_question_fts virtual table holds one row per
+# question (rowid = question id) with the question text and the text of all
+# its choices. Signals keep it in step with Question/Choice saves and deletes.
+# QuestionManager.search() matches against it and orders by FTS5's bm25 rank;
+# on other backends (or SQLite builds without FTS5) it falls back to the
+# icontains scan.
+
+FTS_TABLE = 'polls_question_fts'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_fts_available = None
+
+
+def fts_available():
+    """True when the FTS5 index table exists in the current database"""
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+    return _fts_available
+
+
+def reset_fts_cache():
+    global _fts_available
+    _fts_available = None
+
+
+def build_match_query(query):
+    """Turn free text into a safe FTS5 query: every word as a quoted prefix term"""
+    return ' '.join(f'"{token}"*' for token in TOKEN_RE.findall(query))
+
+
+def question_documents(question_ids):
+    """Return {question_id: (question_text, [choice_text, ...])} in two queries"""
+    from .models import Question, Choice
+
+    question_ids = list(question_ids)
+    texts = dict(Question.objects.filter(pk__in=question_ids).values_list('id', 'question_text'))
+    choices_text = {}
+    for question_id, choice_text in (
+        Choice.objects.filter(question_id__in=question_ids)
+        .order_by().values_list('question_id', 'choice_text')
+    ):
+        choices_text.setdefault(question_id, []).append(choice_text)
+    return {
+        question_id: (text, choices_text.get(question_id, []))
+        for question_id, text in texts.items()
+    }
+
+
+def index_questions(question_ids):
+    """(Re)write the index rows for ``question_ids`` from the current Question/Choice rows"""
+    if not fts_available() or not question_ids:
+        return
+    question_ids = list(question_ids)
+    documents = question_documents(question_ids)
+
+    with connection.cursor() as cursor:
+        placeholders = ', '.join(['%s'] * len(question_ids))
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', question_ids)
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, question_text, choices_text) VALUES (%s, %s, %s)',
+            [
+                (question_id, text, ' '.join(choices))
+                for question_id, (text, choices) in documents.items()
+            ],
+        )
+
+
+def unindex_question(question_id):
+    if fts_available():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [question_id])
+
+
+def rebuild_index(chunk_size=1000):
+    """Rebuild the whole index from the database in chunks"""
+    if not fts_available():
+        return 0
+    from .models import Question
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+    ids = list(Question.objects.order_by('pk').values_list('pk', flat=True))
+    for i in range(0, len(ids), chunk_size):
+        index_questions(ids[i:i + chunk_size])
+    return len(ids)
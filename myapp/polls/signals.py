@@ -0,0 +1,272 @@
+from django.contrib.auth.models import User
+from django.db.models import QuerySet, Sum
+from django.db.models.signals import post_migrate, post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .models import Question, Choice, Category, Tag, VoteSketch
+from .counts import VERSION_NAME as COUNTS_VERSION
+from .versions import bump_version
+from .categories import category_cache
+from .fragments import touch_questions
+from .typeahead import typeahead_index
+from .search import index_questions, reset_fts_cache, unindex_question
+from . import bm25, statistics
+from .trigrams import trigram_index
+from .sketches import hll_name
+from .trending import trending_board
+from .autocomplete import forget_label
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def sync_question_total_votes(sender, instance, **kwargs):
+    """Keep Question.total_votes in step with direct Choice edits (admin, imports)"""
+    if kwargs.get('raw'):
+        return
+    Question.objects.rebuild_total_votes([instance.question_id])
+
+
+@receiver(post_migrate)
+def forget_fts_availability(sender, **kwargs):
+    """Migrations may have created or dropped the FTS5 table"""
+    reset_fts_cache()
+
+
+def _text_saved(kwargs):
+    update_fields = kwargs.get('update_fields')
+    return update_fields is None or 'question_text' in update_fields
+
+
+@receiver(post_save, sender=Question)
+def index_saved_question(sender, instance, **kwargs):
+    """Keep the full-text index in step with question text changes"""
+    if kwargs.get('raw') or not _text_saved(kwargs):
+        return
+    index_questions([instance.pk])
+    if bm25.enabled():
+        bm25.index_questions([instance.pk])
+    if trigram_index.loaded:
+        trigram_index.update([instance.pk])
+
+
+@receiver(post_delete, sender=Question)
+def unindex_deleted_question(sender, instance, **kwargs):
+    unindex_question(instance.pk)
+    if trigram_index.loaded:
+        trigram_index.remove(instance.pk)
+
+
+@receiver(pre_delete, sender=Question)
+def unindex_question_statistics(sender, instance, **kwargs):
+    """Subtract the question's BM25 statistics before its rows cascade away"""
+    if bm25.enabled():
+        bm25.unindex_question(instance.pk)
+
+
+def _deleting_question(kwargs):
+    # Choices removed by a question's cascade must not re-index that question
+    origin = kwargs.get('origin')
+    return isinstance(origin, Question) or (isinstance(origin, QuerySet) and origin.model is Question)
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def index_question_choices(sender, instance, **kwargs):
+    """Re-index a question when one of its choices is added, edited or removed"""
+    if kwargs.get('raw'):
+        return
+    index_questions([instance.question_id])
+    if bm25.enabled() and not _deleting_question(kwargs):
+        bm25.index_questions([instance.question_id])
+    if trigram_index.loaded:
+        trigram_index.update([instance.question_id])
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_cached_counts(sender, **kwargs):
+    """Any change to the filtered tables makes cached result counts stale"""
+    bump_version(COUNTS_VERSION)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_cache(sender, **kwargs):
+    """Make every worker reload its category list on next use"""
+    category_cache.invalidate()
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def invalidate_question_fragments(sender, instance, **kwargs):
+    touch_questions([instance.pk])
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def invalidate_choice_fragments(sender, instance, **kwargs):
+    touch_questions([instance.question_id])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_fragments(sender, **kwargs):
+    """Question cards show their category's name and icon"""
+    touch_questions()
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Tag)
+def update_typeahead(sender, instance, **kwargs):
+    """Keep this worker's typeahead index current; other workers catch up on refresh"""
+    if kwargs.get('raw') or not typeahead_index.loaded:
+        return
+    if sender is Question:
+        typeahead_index.update_question(instance)
+    elif sender is Category:
+        typeahead_index.update_category(instance)
+    else:
+        typeahead_index.update_tag(instance)
+
+
+@receiver(post_delete, sender=Question)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Tag)
+def remove_from_typeahead(sender, instance, **kwargs):
+    if typeahead_index.loaded:
+        kind = {Question: 'questions', Category: 'categories', Tag: 'tags'}[sender]
+        typeahead_index.remove(kind, instance.pk)
+
+
+# Materialized statistics (polls.statistics): each handler applies the
+# difference between the row's state before and after the write
+
+def _question_state(question):
+    return (question.is_active, question.category_id)
+
+
+@receiver(pre_save, sender=Question)
+def remember_question_state(sender, instance, **kwargs):
+    if kwargs.get('raw') or instance.pk is None:
+        instance._statistics_before = None
+        return
+    instance._statistics_before = Question.objects.filter(pk=instance.pk).values_list(
+        'is_active', 'category_id'
+    ).first()
+
+
+@receiver(post_save, sender=Question)
+def update_question_statistics(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    before = getattr(instance, '_statistics_before', None)
+    after = _question_state(instance)
+    if before != after:
+        votes = statistics.question_votes(instance.pk) if before is not None else 0
+        statistics.question_changed(before, after, votes)
+
+
+@receiver(pre_delete, sender=Question)
+def remember_deleted_question(sender, instance, **kwargs):
+    """Read the question's votes while its choices and shards still exist"""
+    instance._statistics_votes = statistics.question_votes(instance.pk)
+
+
+@receiver(post_delete, sender=Question)
+def subtract_question_statistics(sender, instance, **kwargs):
+    statistics.question_changed(
+        _question_state(instance), None, getattr(instance, '_statistics_votes', 0)
+    )
+
+
+@receiver(pre_save, sender=Choice)
+def remember_choice_votes(sender, instance, **kwargs):
+    if kwargs.get('raw') or instance.pk is None:
+        instance._statistics_votes = 0
+        return
+    instance._statistics_votes = Choice.objects.filter(pk=instance.pk).values_list(
+        'votes', flat=True
+    ).first() or 0
+
+
+@receiver(post_save, sender=Choice)
+def update_choice_statistics(sender, instance, **kwargs):
+    """Direct edits of Choice.votes (admin, imports) change the vote totals"""
+    if kwargs.get('raw'):
+        return
+    delta = instance.votes - getattr(instance, '_statistics_votes', 0)
+    statistics.add_votes({instance.question_id: delta})
+
+
+def _deleting_choice_only(kwargs):
+    # Choices removed along with their question are subtracted by the question
+    origin = kwargs.get('origin')
+    return isinstance(origin, Choice) or (isinstance(origin, QuerySet) and origin.model is Choice)
+
+
+@receiver(pre_delete, sender=Choice)
+def remember_deleted_choice(sender, instance, **kwargs):
+    if _deleting_choice_only(kwargs):
+        shards = instance.shards.aggregate(total=Sum('votes'))['total'] or 0
+        instance._statistics_votes = (
+            Choice.objects.filter(pk=instance.pk).values_list('votes', flat=True).first() or 0
+        ) + shards
+
+
+@receiver(post_delete, sender=Choice)
+def subtract_choice_statistics(sender, instance, **kwargs):
+    if _deleting_choice_only(kwargs):
+        statistics.add_votes({instance.question_id: -getattr(instance, '_statistics_votes', 0)})
+
+
+@receiver(pre_save, sender=Category)
+def remember_category_state(sender, instance, **kwargs):
+    if kwargs.get('raw') or instance.pk is None:
+        instance._statistics_before = None
+        return
+    instance._statistics_before = Category.objects.filter(pk=instance.pk).values_list(
+        'is_active', flat=True
+    ).first()
+
+
+@receiver(post_save, sender=Category)
+def update_category_statistics(sender, instance, created, **kwargs):
+    if kwargs.get('raw'):
+        return
+    if created:
+        statistics.ensure_category_row(instance.pk)
+    statistics.category_changed(getattr(instance, '_statistics_before', None), instance.is_active)
+
+
+@receiver(post_delete, sender=Category)
+def subtract_category_statistics(sender, instance, **kwargs):
+    statistics.category_changed(instance.is_active, None)
+
+
+@receiver(post_delete, sender=Question)
+@receiver(post_delete, sender=Category)
+def delete_voter_sketch(sender, instance, **kwargs):
+    kind = 'question' if sender is Question else 'category'
+    VoteSketch.objects.filter(name=hll_name(kind, instance.pk)).delete()
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def update_trending(sender, instance, **kwargs):
+    """Drop deactivated and deleted questions from this worker's leaderboard"""
+    if trending_board.loaded and (kwargs.get('signal') is post_delete or not instance.is_active):
+        trending_board.remove(instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_admin_label(sender, instance, **kwargs):
+    """Drop the cached autocomplete label of a renamed or deleted user/category"""
+    forget_label(instance)
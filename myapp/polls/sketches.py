@@ -0,0 +1,371 @@
+import atexit
+import datetime
+import hashlib
+import heapq
+import math
+import sys
+import threading
+import time
+import zlib
+from array import array
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import VoteSketch
+
+# Probabilistic vote analytics
+#
+# HyperLogLog registers estimate unique voters per question and per category
+# (a few KB at most, far less once compressed) without storing who voted. A
+# count-min sketch per time window (POLLS_SKETCH_WINDOW seconds) estimates
+# votes per question, and a small top-k heap next to it tracks the heavy
+# hitters, i.e. the questions taking the most votes.
+#
+# The vote views feed the sketches of this worker (VoteSketches), which are
+# merged into the shared VoteSketch rows every POLLS_SKETCH_FLUSH_INTERVAL
+# seconds under a row lock: registers by maximum, counters by sum, top-k
+# candidates by re-estimating their union against the merged counters. Both
+# merges are exact, so any number of workers can flush in any order.
+#
+# Readers merge the stored rows with this worker's unflushed sketches.
+
+HLL_PREFIX = 'hll'
+CMS_PREFIX = 'cms'
+
+
+def _hash64(item):
+    return int.from_bytes(hashlib.blake2b(str(item).encode(), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """Cardinality estimate from 2**precision one-byte registers"""
+
+    def __init__(self, precision=None, registers=None):
+        self.precision = precision or getattr(settings, 'POLLS_HLL_PRECISION', 11)
+        if not 4 <= self.precision <= 16:
+            raise ValueError('HyperLogLog precision must be between 4 and 16')
+        self.size = 1 << self.precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+
+    def add(self, item):
+        value = _hash64(item)
+        index = value >> (64 - self.precision)
+        rest = value & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.size) if self.size >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[self.size]
+        estimate = alpha * self.size * self.size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            # Small cardinalities: linear counting over the empty registers
+            estimate = self.size * math.log(self.size / zeros)
+        return round(estimate)
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge HyperLogLogs of different precision')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def to_bytes(self):
+        return bytes([self.precision]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(data[0], zlib.decompress(data[1:]))
+
+
+class CountMinSketch:
+    """depth rows of width counters; estimates never undercount"""
+
+    def __init__(self, width=None, depth=None, counters=None):
+        self.width = width or getattr(settings, 'POLLS_CMS_WIDTH', 2048)
+        self.depth = depth or getattr(settings, 'POLLS_CMS_DEPTH', 4)
+        self.counters = array('Q', counters) if counters is not None else array('Q', bytes(8 * self.width * self.depth))
+
+    def _cells(self, key):
+        digest = hashlib.blake2b(str(key).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def add(self, key, count=1):
+        """Count ``key`` and return its new estimate"""
+        cells = self._cells(key)
+        for cell in cells:
+            self.counters[cell] += count
+        return min(self.counters[cell] for cell in cells)
+
+    def estimate(self, key):
+        return min(self.counters[cell] for cell in self._cells(key))
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('Cannot merge count-min sketches of different dimensions')
+        for cell, count in enumerate(other.counters):
+            if count:
+                self.counters[cell] += count
+        return self
+
+    def to_bytes(self):
+        counters = array('Q', self.counters)
+        if sys.byteorder == 'big':
+            counters.byteswap()  # stored little-endian
+        header = self.width.to_bytes(4, 'little') + self.depth.to_bytes(4, 'little')
+        return header + zlib.compress(counters.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        counters = array('Q')
+        counters.frombytes(zlib.decompress(data[8:]))
+        if sys.byteorder == 'big':
+            counters.byteswap()
+        return cls(int.from_bytes(data[:4], 'little'), int.from_bytes(data[4:8], 'little'), counters)
+
+
+class TopK:
+    """The k keys with the highest estimates offered so far (min-heap)"""
+
+    def __init__(self, k=None):
+        self.k = k or getattr(settings, 'POLLS_HEAVY_HITTERS', 20)
+        self.counts = {}
+        self._heap = []  # (estimate, key); entries for keys since re-offered are stale
+
+    def offer(self, key, estimate):
+        if key not in self.counts and len(self.counts) >= self.k:
+            self._drop_stale()
+            if estimate <= self._heap[0][0]:
+                return
+            _, evicted = heapq.heappop(self._heap)
+            del self.counts[evicted]
+        self.counts[key] = estimate
+        heapq.heappush(self._heap, (estimate, key))
+        if len(self._heap) > 4 * self.k:
+            self._heap = [(count, item) for item, count in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def _drop_stale(self):
+        while self.counts.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def items(self):
+        """(key, estimate) pairs, highest first"""
+        return sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+def current_window(now=None):
+    return int((now or time.time()) // getattr(settings, 'POLLS_SKETCH_WINDOW', 3600))
+
+
+def hll_name(kind, object_id):
+    return f'{HLL_PREFIX}:{kind}:{object_id}'
+
+
+def cms_name(window):
+    return f'{CMS_PREFIX}:{window}'
+
+
+def _load_hll(row):
+    return HyperLogLog.from_bytes(bytes(row.data)) if row.data else HyperLogLog()
+
+
+def _load_cms(row):
+    return CountMinSketch.from_bytes(bytes(row.data)) if row.data else CountMinSketch()
+
+
+def _merge_candidates(cms, *candidate_lists):
+    top = TopK()
+    for key in {key for candidates in candidate_lists for key in candidates}:
+        top.offer(key, cms.estimate(key))
+    return top
+
+
+class VoteSketches:
+    """This worker's unflushed sketches"""
+
+    def __init__(self, max_pending=None, flush_interval=None):
+        self.max_pending = max_pending or getattr(settings, 'POLLS_SKETCH_BUFFER_SIZE', 1000)
+        self.flush_interval = flush_interval or getattr(settings, 'POLLS_SKETCH_FLUSH_INTERVAL', 30.0)
+        self._lock = threading.Lock()
+        self._reset()
+        self._last_flush = time.monotonic()
+        self._timer = None
+
+    def _reset(self):
+        self._hlls = {}  # name -> HyperLogLog
+        self._windows = {}  # window -> (CountMinSketch, TopK)
+        self._pending = 0
+
+    def add(self, question_id, category_id, voter_key):
+        """Count one vote by ``voter_key`` on a question (in ``category_id``, may be None)"""
+        with self._lock:
+            names = [hll_name('question', question_id)]
+            if category_id is not None:
+                names.append(hll_name('category', category_id))
+            for name in names:
+                self._hlls.setdefault(name, HyperLogLog()).add(voter_key)
+            cms, top = self._windows.setdefault(current_window(), (CountMinSketch(), TopK()))
+            top.offer(question_id, cms.add(question_id))
+            self._pending += 1
+            due = (
+                self._pending >= self.max_pending
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+            if not due:
+                self._schedule()
+        if due:
+            # Never inside the caller's transaction (see VoteBuffer.add)
+            transaction.on_commit(self.flush, robust=True)
+
+    def flush(self):
+        """Merge everything into the shared rows; returns the number of votes flushed"""
+        with self._lock:
+            hlls, windows, pending = self._hlls, self._windows, self._pending
+            self._reset()
+            self._last_flush = time.monotonic()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+        try:
+            self._write(hlls, windows)
+        except Exception:
+            # Keep the sketches for the next flush; merging is order-independent
+            with self._lock:
+                for name, hll in hlls.items():
+                    self._hlls.setdefault(name, HyperLogLog()).merge(hll)
+                for window, (cms, top) in windows.items():
+                    local_cms, local_top = self._windows.setdefault(window, (CountMinSketch(), TopK()))
+                    local_cms.merge(cms)
+                    for key in top.counts:
+                        local_top.offer(key, local_cms.estimate(key))
+                self._pending += pending
+            raise
+        return pending
+
+    def _write(self, hlls, windows):
+        names = list(hlls) + [cms_name(window) for window in windows]
+        now = timezone.now()
+        with transaction.atomic():
+            VoteSketch.objects.bulk_create([VoteSketch(name=name) for name in names], ignore_conflicts=True)
+            rows = {row.name: row for row in VoteSketch.objects.select_for_update().filter(name__in=names)}
+            for name, hll in hlls.items():
+                row = rows[name]
+                row.data = _load_hll(row).merge(hll).to_bytes()
+            for window, (cms, top) in windows.items():
+                row = rows[cms_name(window)]
+                merged = _load_cms(row).merge(cms)
+                stored = [int(key) for key in row.meta.get('candidates', {})]
+                candidates = _merge_candidates(merged, stored, top.counts)
+                row.data = merged.to_bytes()
+                row.meta = {'candidates': {str(key): count for key, count in candidates.items()}}
+            for row in rows.values():
+                row.updated_at = now
+            VoteSketch.objects.bulk_update(rows.values(), ['data', 'meta', 'updated_at'], batch_size=100)
+            # Windows too old to be read again
+            keep = getattr(settings, 'POLLS_SKETCH_WINDOWS_KEPT', 48)
+            VoteSketch.objects.filter(
+                name__startswith=f'{CMS_PREFIX}:',
+                updated_at__lt=now - keep * datetime.timedelta(seconds=getattr(settings, 'POLLS_SKETCH_WINDOW', 3600)),
+            ).delete()
+
+    def local_hll(self, name):
+        with self._lock:
+            hll = self._hlls.get(name)
+            return HyperLogLog(hll.precision, hll.registers) if hll else None
+
+    def local_window(self, window):
+        with self._lock:
+            if window not in self._windows:
+                return None
+            cms, top = self._windows[window]
+            return CountMinSketch(cms.width, cms.depth, cms.counters), dict(top.counts)
+
+    def _schedule(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self._timed_flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_flush(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+
+vote_sketches = VoteSketches()
+atexit.register(vote_sketches.flush)
+
+
+def sketches_enabled():
+    return getattr(settings, 'POLLS_VOTE_SKETCHES', True)
+
+
+def observe_vote(request, question):
+    """Feed a counted vote on ``question`` into this worker's sketches"""
+    observe_votes(request, {question.pk: question.category_id})
+
+
+def observe_votes(request, categories):
+    """Feed counted votes into this worker's sketches
+
+    ``categories`` maps each question voted on to its category id (or None).
+    """
+    if not sketches_enabled():
+        return
+    from .voters import get_voter_key
+
+    voter_key = get_voter_key(request)
+    for question_id, category_id in categories.items():
+        vote_sketches.add(question_id, category_id, voter_key)
+
+
+def unique_voters(kind, object_ids):
+    """Estimated distinct voters for each id of ``kind`` ('question' or 'category')"""
+    object_ids = list(object_ids)
+    names = {hll_name(kind, object_id): object_id for object_id in object_ids}
+    stored = {row.name: _load_hll(row) for row in VoteSketch.objects.filter(name__in=names)}
+    counts = {}
+    for name, object_id in names.items():
+        hll = stored.get(name)
+        local = vote_sketches.local_hll(name)
+        if local is not None:
+            hll = hll.merge(local) if hll is not None else local
+        counts[object_id] = hll.count() if hll is not None else 0
+    return counts
+
+
+def heavy_hitters(n=10, windows=None):
+    """The ``n`` questions with the most votes in the last ``windows`` windows
+
+    Returns (question_id, estimated votes) pairs, highest first.
+    """
+    windows = windows or getattr(settings, 'POLLS_SKETCH_RECENT_WINDOWS', 2)
+    latest = current_window()
+    window_ids = range(latest - windows + 1, latest + 1)
+    rows = {row.name: row for row in VoteSketch.objects.filter(name__in=[cms_name(w) for w in window_ids])}
+    merged = None
+    candidates = []
+    for window in window_ids:
+        parts = []
+        row = rows.get(cms_name(window))
+        if row is not None and row.data:
+            parts.append((_load_cms(row), [int(key) for key in row.meta.get('candidates', {})]))
+        local = vote_sketches.local_window(window)
+        if local is not None:
+            parts.append((local[0], list(local[1])))
+        for cms, keys in parts:
+            merged = cms if merged is None else merged.merge(cms)
+            candidates.append(keys)
+    if merged is None:
+        return []
+    return _merge_candidates(merged, *candidates).items()[:n]
@@ -0,0 +1,16 @@
+'use strict';
+// Apply an AutocompleteListFilter selection: reload the changelist with the
+// chosen value added to the filter's "All" query string.
+{
+    const $ = django.jQuery;
+
+    $(document).on('change', '.polls-autocomplete-filter', function() {
+        const wrapper = this.closest('.polls-autocomplete-filter-wrapper');
+        const params = new URLSearchParams(wrapper.dataset.baseQuery);
+        if (this.value) {
+            params.set(wrapper.dataset.lookup, this.value);
+        }
+        const query = params.toString();
+        window.location.search = query ? '?' + query : '';
+    });
+}
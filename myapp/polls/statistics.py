@@ -0,0 +1,220 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+# Materialized statistics
+#
+# The stats page reads two tables instead of aggregating every vote:
+#
+#   PollStatistics      one row: active questions, active categories, all votes
+#   CategoryStatistics  category -> its active questions and their votes
+#
+# Writers apply deltas with F() updates right after their own write, in the
+# same transaction, except votes: every vote would lock the totals row, so
+# they are added in batches (see polls.voting) and the vote totals shown can
+# lag by up to POLLS_STATISTICS_BUFFER_INTERVAL seconds.
+#
+#   vote batches (every mode, sharded included)     -> add_votes()
+#   Question created / activated / moved / deleted  -> question_changed()
+#   Choice votes edited directly or choice deleted  -> add_votes()
+#   Category created / (de)activated / deleted      -> category_changed()
+#
+# Folding shards into Choice.votes moves votes without changing any total.
+# Rewrites that recompute counters wholesale (rebuild_total_votes,
+# rebuild_votes_from_log) and raw SQL are not tracked; run
+# `manage.py reconcile_poll_stats` after them, or periodically, to fix drift
+# (including strict votes still buffered by a worker that was killed, and the
+# category totals of a question deleted before its strict votes were counted).
+# A missing row is rebuilt by reconcile() on first write.
+
+TOTALS_PK = 1
+
+
+def _apply(totals=None, categories=None):
+    """Add ``totals`` {field: delta} and ``categories`` {category_id: (questions, votes)}
+
+    Called after the write being counted, so when a row is missing the
+    statistics are simply recomputed, this write included.
+    """
+    from .models import PollStatistics, CategoryStatistics
+
+    updates = {field: F(field) + delta for field, delta in (totals or {}).items() if delta}
+    if updates and not PollStatistics.objects.filter(pk=TOTALS_PK).update(**updates):
+        reconcile()
+        return
+
+    by_delta = defaultdict(list)
+    for category_id, delta in (categories or {}).items():
+        if category_id is not None and any(delta):
+            by_delta[delta].append(category_id)
+    for (questions, votes), category_ids in by_delta.items():
+        updated = CategoryStatistics.objects.filter(category_id__in=category_ids).update(
+            question_count=F('question_count') + questions, total_votes=F('total_votes') + votes
+        )
+        if updated < len(category_ids):
+            reconcile()
+            return
+
+
+def add_votes(votes_by_question, questions=None, written=False):
+    """Count {question_id: votes} in the totals
+
+    ``questions`` may map question ids to (is_active, category_id) when the
+    caller already has them; otherwise they are read in one query. Votes of
+    questions deleted in the meantime are left out, since they never reached
+    the deleted rows, unless ``written`` says they did: a deletion subtracts
+    every vote in its rows, counted yet or not.
+    """
+    from .models import Question
+
+    votes_by_question = {pk: votes for pk, votes in votes_by_question.items() if votes}
+    if not votes_by_question:
+        return
+    if questions is None:
+        questions = {
+            pk: (is_active, category_id)
+            for pk, is_active, category_id in Question.objects.filter(
+                pk__in=votes_by_question
+            ).order_by().values_list('pk', 'is_active', 'category_id')
+        }
+    if not written:
+        votes_by_question = {pk: votes for pk, votes in votes_by_question.items() if pk in questions}
+        if not votes_by_question:
+            return
+    category_votes = defaultdict(int)
+    for question_id, votes in votes_by_question.items():
+        is_active, category_id = questions.get(question_id, (False, None))
+        if is_active:
+            category_votes[category_id] += votes
+    with transaction.atomic(savepoint=False):
+        _apply(
+            {'total_votes': sum(votes_by_question.values())},
+            {category_id: (0, votes) for category_id, votes in category_votes.items()},
+        )
+
+
+def question_votes(question_id):
+    """Votes of one question, unfolded shard votes included, summed from its choices"""
+    from .models import Choice, ChoiceVoteShard
+
+    votes = Choice.objects.filter(question_id=question_id).aggregate(total=Sum('votes'))['total'] or 0
+    shards = ChoiceVoteShard.objects.filter(choice__question_id=question_id).aggregate(total=Sum('votes'))
+    return votes + (shards['total'] or 0)
+
+
+def question_changed(before, after, votes=0):
+    """Move a question's contribution from ``before`` to ``after``
+
+    Both are (is_active, category_id), or None when the question does not
+    exist (created / deleted); ``votes`` is the question's vote count.
+    """
+    if before == after:
+        return
+    category_deltas = defaultdict(lambda: (0, 0))
+    for state, sign in ((before, -1), (after, 1)):
+        if state and state[0]:
+            questions, total = category_deltas[state[1]]
+            category_deltas[state[1]] = (questions + sign, total + sign * votes)
+    active_delta = int(bool(after and after[0])) - int(bool(before and before[0]))
+    votes_delta = votes * ((after is not None) - (before is not None))
+    with transaction.atomic(savepoint=False):
+        _apply({'question_count': active_delta, 'total_votes': votes_delta}, category_deltas)
+
+
+def category_changed(before, after):
+    """Count a category going from ``before`` to ``after`` being active (None = missing)"""
+    delta = int(bool(after)) - int(bool(before))
+    if delta:
+        _apply({'category_count': delta})
+
+
+def ensure_category_row(category_id):
+    from .models import CategoryStatistics
+
+    CategoryStatistics.objects.get_or_create(category_id=category_id)
+
+
+def poll_totals():
+    """The PollStatistics row, rebuilt if it is missing"""
+    from .models import PollStatistics
+
+    totals = PollStatistics.objects.filter(pk=TOTALS_PK).first()
+    if totals is None:
+        reconcile()
+        totals = PollStatistics.objects.get(pk=TOTALS_PK)
+    return totals
+
+
+def category_statistics():
+    """Active categories annotated with question_count and total_votes"""
+    from .models import Category
+
+    return Category.objects.filter(is_active=True).annotate(
+        question_count=F('statistics__question_count'),
+        total_votes=F('statistics__total_votes'),
+    ).order_by(F('statistics__question_count').desc(nulls_last=True), 'name')
+
+
+def compute_statistics():
+    """Aggregate the statistics from scratch; returns (totals, {category_id: (questions, votes)})"""
+    from .models import Category, Choice, ChoiceVoteShard, Question
+
+    total_votes = (
+        (Choice.objects.aggregate(total=Sum('votes'))['total'] or 0)
+        + (ChoiceVoteShard.objects.aggregate(total=Sum('votes'))['total'] or 0)
+    )
+    totals = {
+        'question_count': Question.objects.filter(is_active=True).count(),
+        'category_count': Category.objects.filter(is_active=True).count(),
+        'total_votes': total_votes,
+    }
+    categories = {pk: [0, 0] for pk in Category.objects.values_list('pk', flat=True)}
+    active = Question.objects.filter(is_active=True, category__isnull=False).order_by()
+    for category_id, questions in active.values_list('category').annotate(n=Count('pk')):
+        categories[category_id][0] = questions
+    for category_id, votes in active.values_list('category').annotate(total=Sum('choices__votes')):
+        categories[category_id][1] += votes or 0
+    for category_id, votes in active.values_list('category').annotate(
+        total=Sum('choices__shards__votes')
+    ):
+        categories[category_id][1] += votes or 0
+    return totals, {pk: tuple(counts) for pk, counts in categories.items()}
+
+
+def reconcile():
+    """Overwrite the stored statistics with fresh aggregates
+
+    Returns [(label, stored, actual)] for every value that had drifted.
+    """
+    from .models import Category, CategoryStatistics, PollStatistics
+
+    drift = []
+    with transaction.atomic():
+        totals, categories = compute_statistics()
+
+        stored = PollStatistics.objects.select_for_update().filter(pk=TOTALS_PK).first()
+        for field, actual in totals.items():
+            value = getattr(stored, field, None)
+            if value != actual:
+                drift.append((field, value, actual))
+        PollStatistics.objects.update_or_create(
+            pk=TOTALS_PK, defaults=dict(totals, reconciled_at=timezone.now())
+        )
+
+        existing = {row.category_id: row for row in CategoryStatistics.objects.select_for_update()}
+        names = dict(Category.objects.values_list('pk', 'name'))
+        changed, created = [], []
+        for category_id, (questions, votes) in categories.items():
+            row = existing.get(category_id)
+            if row is None:
+                created.append(CategoryStatistics(category_id=category_id, question_count=questions, total_votes=votes))
+                drift.append((names[category_id], None, (questions, votes)))
+            elif (row.question_count, row.total_votes) != (questions, votes):
+                drift.append((names[category_id], (row.question_count, row.total_votes), (questions, votes)))
+                row.question_count, row.total_votes = questions, votes
+                changed.append(row)
+        CategoryStatistics.objects.bulk_create(created)
+        CategoryStatistics.objects.bulk_update(changed, ['question_count', 'total_votes'], batch_size=500)
+    return drift
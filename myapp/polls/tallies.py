@@ -0,0 +1,75 @@
+from collections import defaultdict
+
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Choice, ChoiceVoteShard
+from .voting import pending_votes
+
+# Tally snapshots
+#
+# One place to compute votes / total / percentage for questions. Every call
+# reads all the choices it needs in a single query, so callers stay at a
+# fixed number of queries no matter how many choices or questions are shown.
+# Live counts are Choice.votes plus any unfolded ChoiceVoteShard rows.
+
+
+def percentage(votes, total):
+    """Share of ``total`` held by ``votes`` as a 0-100 float"""
+    if not total:
+        return 0
+    return (votes / total) * 100
+
+
+def tally_questions(question_ids):
+    """Return {question_id: {'total_votes': int, 'choices': [...]}} for a batch of questions"""
+    question_ids = list(question_ids)
+    rows = list(
+        Choice.objects.filter(question_id__in=question_ids)
+        .values('id', 'question_id', 'choice_text', 'votes')
+        .annotate(shard_votes=Coalesce(Sum('shards__votes'), Value(0)))
+        .order_by('-votes', 'id')
+    )
+    # Include votes still waiting in the write-behind buffer
+    pending = pending_votes({row['id'] for row in rows})
+
+    choices_by_question = defaultdict(list)
+    for row in rows:
+        choices_by_question[row['question_id']].append({
+            'id': row['id'],
+            'text': row['choice_text'],
+            'votes': row['votes'] + row['shard_votes'] + pending.get(row['id'], 0),
+        })
+
+    tallies = {}
+    for question_id in question_ids:
+        choices = choices_by_question.get(question_id, [])
+        total_votes = sum(choice['votes'] for choice in choices)
+        for choice in choices:
+            choice['percentage'] = percentage(choice['votes'], total_votes)
+        tallies[question_id] = {
+            'total_votes': total_votes,
+            'choices': choices,
+        }
+    return tallies
+
+
+def with_live_totals(questions):
+    """Annotate ``live_total_votes``: total_votes plus unfolded shard votes, in the same query"""
+    shard_votes = ChoiceVoteShard.objects.filter(choice__question=OuterRef('pk')).order_by().values(
+        'choice__question'
+    ).annotate(total=Sum('votes')).values('total')
+    return questions.annotate(live_total_votes=F('total_votes') + Coalesce(Subquery(shard_votes), Value(0)))
+
+
+def with_live_votes(choices):
+    """Annotate ``live_votes``: Choice.votes plus unfolded shard votes, in the same query"""
+    shard_votes = ChoiceVoteShard.objects.filter(choice=OuterRef('pk')).order_by().values(
+        'choice'
+    ).annotate(total=Sum('votes')).values('total')
+    return choices.annotate(live_votes=F('votes') + Coalesce(Subquery(shard_votes), Value(0)))
+
+
+def tally_question(question_id):
+    """Return the tally snapshot for a single question"""
+    return tally_questions([question_id])[question_id]
@@ -0,0 +1,58 @@
+from django import template
+
+from polls.fragments import fragment_key, get_fragment, record_lookup, set_fragment
+
+register = template.Library()
+
+
+class FragmentCacheNode(template.Node):
+    def __init__(self, nodelist, fragment_name, dependencies, vary_on):
+        self.nodelist = nodelist
+        self.fragment_name = fragment_name
+        self.dependencies = dependencies
+        self.vary_on = vary_on
+
+    def render(self, context):
+        key = fragment_key(
+            self.fragment_name,
+            [dependency.resolve(context) for dependency in self.dependencies],
+            [value.resolve(context) for value in self.vary_on],
+        )
+        content = get_fragment(key)
+        record_lookup(self.fragment_name, content is not None)
+        if content is None:
+            content = self.nodelist.render(context)
+            set_fragment(key, content)
+        return content
+
+
+@register.tag('cachefragment')
+def do_cachefragment(parser, token):
+    """
+    Cache a block until any of its dependencies change::
+
+        {% cachefragment question_card question %} ... {% endcachefragment %}
+        {% cachefragment category_options "categories" vary category_filter %}
+
+    Dependencies are model instances (or lists of them) and version stamp
+    names; values after ``vary`` are added to the key as they are.
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' tag requires a fragment name and at least one dependency."
+        )
+    nodelist = parser.parse(('endcachefragment',))
+    parser.delete_first_token()
+
+    arguments = bits[2:]
+    vary_on = []
+    if 'vary' in arguments:
+        split = arguments.index('vary')
+        arguments, vary_on = arguments[:split], arguments[split + 1:]
+    return FragmentCacheNode(
+        nodelist,
+        bits[1],
+        [parser.compile_filter(argument) for argument in arguments],
+        [parser.compile_filter(value) for value in vary_on],
+    )
@@ -1,3 +1,1567 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Question, Choice, ChoiceVoteShard, Category, Tag, Article, VoteEvent, VoterRecord, VoteRollup
+from .live import TallyBroadcaster
+from .pagination import KeysetPaginator
+from .counts import ResultCount, cached_count
+from .categories import active_categories
+from .forms import QuestionForm, SearchForm
+from .fragments import fragment_stats
+from .typeahead import PrefixIndex, TypeaheadIndex
+from .facets import facet_counts
+from . import bm25
+from .trigrams import TrigramIndex
+from .voters import BloomFilter, VoterGuard, voter_guard
+from .voting import (
+    record_vote, vote_rollups, VoteBuffer, VoteEventBuffer, materialize_vote_events, rebuild_votes_from_log,
+    statistics_buffer,
+)
+from . import timeseries
+from .trending import TrendingBoard, trending_board
+from .sketches import CountMinSketch, HyperLogLog, TopK, VoteSketches, heavy_hitters, unique_voters, vote_sketches
+from .autocomplete import cached_labels
+from .middleware import CacheBuckets, LocalBuckets, SharedMemoryBuckets
+
+# Vote time series and sketches are buffered per process; keep every other
+# test's votes out of those buffers (their own tests turn them back on).
+# Rate limit buckets and the 'shared' cache stay in process too, rather than
+# in files shared with other runs.
+_buffers_off = override_settings(
+    POLLS_VOTE_ROLLUPS=False, POLLS_VOTE_SKETCHES=False, POLLS_RATE_LIMIT_BACKEND='local',
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'},
+    },
+)
+
+
+def setUpModule():
+    _buffers_off.enable()
+    # Build the vote guard's filter up front: a background build could not
+    # read the test database while a test holds its transaction open
+    voter_guard.rebuild()
+
+
+def tearDownModule():
+    _buffers_off.disable()
+
+
+def clear_caches():
+    for cache in caches.all():
+        cache.clear()
+
+
+def create_question_with_choices(question_text="Favourite colour?", choices=("Red", "Blue")):
+    question = Question.objects.create(question_text=question_text)
+    for choice_text in choices:
+        Choice.objects.create(question=question, choice_text=choice_text)
+    return question
+
+
+class VoteBufferTests(TestCase):
+    def setUp(self):
+        self.question = create_question_with_choices()
+        self.red, self.blue = self.question.choices.order_by('id')
+
+    def test_votes_are_held_until_flush(self):
+        buffer = VoteBuffer(max_pending=100, flush_interval=3600)
+        buffer.add(self.question.id, self.red.id)
+        buffer.add(self.question.id, self.red.id)
+        self.red.refresh_from_db()
+        self.assertEqual(self.red.votes, 0)
+        self.assertEqual(buffer.pending(), {self.red.id: 2})
+
+        self.assertEqual(buffer.flush(), 2)
+        self.red.refresh_from_db()
+        self.assertEqual(self.red.votes, 2)
+        self.assertEqual(buffer.pending(), {})
+
+    def test_size_threshold_triggers_flush(self):
+        buffer = VoteBuffer(max_pending=3, flush_interval=3600)
+        with self.captureOnCommitCallbacks(execute=True):
+            for choice in (self.red, self.blue, self.red):
+                buffer.add(self.question.id, choice.id)
+        self.red.refresh_from_db()
+        self.blue.refresh_from_db()
+        self.assertEqual((self.red.votes, self.blue.votes), (2, 1))
+
+    def test_flush_waits_for_the_callers_transaction(self):
+        buffer = VoteBuffer(max_pending=2, flush_interval=3600)
+        try:
+            with transaction.atomic():
+                buffer.add(self.question.id, self.red.id)
+                buffer.add(self.question.id, self.red.id)
+                raise DatabaseError('request failed')
+        except DatabaseError:
+            pass
+        # Nothing was flushed into the rolled-back transaction, so nothing was lost
+        self.assertEqual(buffer.pending(), {self.red.id: 2})
+        self.assertEqual(buffer.flush(), 2)
+        self.red.refresh_from_db()
+        self.assertEqual(self.red.votes, 2)
+
+
+class VoteViewTests(TestCase):
+    def setUp(self):
+        self.question = create_question_with_choices()
+        self.red = self.question.choices.get(choice_text="Red")
+
+    def test_strict_vote_is_written_immediately(self):
+        response = self.client.post(
+            reverse('polls:vote', args=(self.question.id,)), {'choice': self.red.id}
+        )
+        self.assertRedirects(response, reverse('polls:results', args=(self.question.id,)))
+        self.red.refresh_from_db()
+        self.assertEqual(self.red.votes, 1)
+
+    @override_settings(POLLS_VOTE_MODE='buffered')
+    def test_buffered_vote_ajax_reports_pending_votes(self):
+        from .voting import vote_buffer
+
+        self.addCleanup(vote_buffer.flush)
+        response = self.client.post(
+            reverse('polls:vote_ajax', args=(self.question.id,)),
+            json.dumps({'choice_id': self.red.id}),
+            content_type='application/json',
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        data = response.json()
+        self.assertEqual(data['total_votes'], 1)
+        red = next(c for c in data['choices'] if c['id'] == self.red.id)
+        self.assertEqual(red['percentage'], 100)
+
+
+class QuestionTotalVotesTests(TestCase):
+    def setUp(self):
+        self.question = create_question_with_choices()
+        self.red, self.blue = self.question.choices.order_by('id')
+
+    def test_vote_updates_total_votes(self):
+        self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.red.id})
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.total_votes, 1)
+
+    def test_buffer_flush_updates_total_votes(self):
+        buffer = VoteBuffer(max_pending=100, flush_interval=3600)
+        buffer.add(self.question.id, self.red.id)
+        buffer.add(self.question.id, self.blue.id)
+        buffer.flush()
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.total_votes, 2)
+
+    def test_direct_choice_edit_updates_total_votes(self):
+        self.red.votes = 7
+        self.red.save()
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.total_votes, 7)
+        self.red.delete()
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.total_votes, 0)
+
+    def test_rebuild_vote_totals_command(self):
+        Choice.objects.filter(pk=self.blue.pk).update(votes=4)
+        Question.objects.filter(pk=self.question.pk).update(total_votes=99)
+        call_command('rebuild_vote_totals', stdout=StringIO())
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.total_votes, 4)
+
+
+class TallyTests(TestCase):
+    def setUp(self):
+        self.question = create_question_with_choices(choices=("Red", "Blue", "Green", "Black"))
+        Choice.objects.filter(question=self.question, choice_text="Red").update(votes=3)
+        Choice.objects.filter(question=self.question, choice_text="Blue").update(votes=1)
+
+    def test_tally_question(self):
+        from .tallies import tally_question
+
+        with self.assertNumQueries(1):
+            tally = tally_question(self.question.id)
+        self.assertEqual(tally['total_votes'], 4)
+        red = next(c for c in tally['choices'] if c['text'] == "Red")
+        self.assertEqual(red['percentage'], 75)
+
+    def test_results_query_count_does_not_grow_with_choices(self):
+        url = reverse('polls:results', args=(self.question.id,))
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertContains(response, "75.0%")
+        for i in range(10):
+            Choice.objects.create(question=self.question, choice_text=f"Extra {i}")
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+    def test_api_questions_query_count(self):
+        create_question_with_choices("Second?")
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('polls:api_questions'))
+        self.assertEqual(len(response.json()['questions']), 2)
+
+
+@override_settings(POLLS_ONE_VOTE_PER_VOTER=False)
+class VoteShardTests(TestCase):
+    def setUp(self):
+        self.question = create_question_with_choices()
+        self.question.vote_shards = 4
+        self.question.save()
+        self.red = self.question.choices.get(choice_text="Red")
+
+    def test_sharded_votes_are_counted_and_folded(self):
+        for _ in range(10):
+            self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.red.id})
+
+        self.red.refresh_from_db()
+        self.assertEqual(self.red.votes, 0)
+        self.assertEqual(sum(self.red.shards.values_list('votes', flat=True)), 10)
+        self.assertLessEqual(self.red.shards.count(), 4)
+
+        from .tallies import tally_question
+        with self.assertNumQueries(1):
+            self.assertEqual(tally_question(self.question.id)['total_votes'], 10)
+
+        call_command('fold_vote_shards', stdout=StringIO())
+        self.red.refresh_from_db()
+        self.question.refresh_from_db()
+        self.assertEqual(self.red.votes, 10)
+        self.assertEqual(self.question.total_votes, 10)
+        self.assertEqual(tally_question(self.question.id)['total_votes'], 10)
+
+    def test_pages_include_unfolded_shard_votes(self):
+        for _ in range(3):
+            self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.red.id})
+        response = self.client.get(reverse('polls:detail', args=(self.question.id,)))
+        self.assertEqual(response.context['total_votes'], 3)
+        self.assertContains(response, '3 votes')
+        response = self.client.get(reverse('polls:index'))
+        self.assertEqual(response.context['page_obj'][0].live_total_votes, 3)
+
+    def test_stats_include_shard_votes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.red.id})
+        statistics_buffer.flush()
+        response = self.client.get(reverse('polls:stats'))
+        self.assertEqual(response.context['total_votes'], 1)
+
+
+class VoteEventLogTests(TestCase):
+    def setUp(self):
+        self.question = create_question_with_choices()
+        self.red, self.blue = self.question.choices.order_by('id')
+
+    def test_flush_appends_events_and_materializes(self):
+        buffer = VoteEventBuffer(max_pending=100, flush_interval=3600)
+        buffer.add(self.question.id, self.red.id, count=3)
+        buffer.add(self.question.id, self.blue.id)
+        self.assertEqual(buffer.pending(), {self.red.id: 3, self.blue.id: 1})
+        self.assertEqual(VoteEvent.objects.count(), 0)
+
+        buffer.flush()
+        self.assertEqual(VoteEvent.objects.count(), 4)
+        self.red.refresh_from_db()
+        self.question.refresh_from_db()
+        self.assertEqual(self.red.votes, 3)
+        self.assertEqual(self.question.total_votes, 4)
+
+    def test_materialize_only_folds_new_events(self):
+        VoteEvent.objects.bulk_create([
+            VoteEvent(question=self.question, choice=self.red) for _ in range(5)
+        ])
+        self.assertEqual(materialize_vote_events(chunk_size=2), 5)
+        self.assertEqual(materialize_vote_events(chunk_size=2), 0)
+        VoteEvent.objects.create(question=self.question, choice=self.blue)
+        self.assertEqual(materialize_vote_events(), 1)
+        self.red.refresh_from_db()
+        self.blue.refresh_from_db()
+        self.assertEqual((self.red.votes, self.blue.votes), (5, 1))
+
+    @override_settings(POLLS_VOTE_MODE='event_log')
+    def test_rebuild_repairs_corrupted_counter(self):
+        VoteEvent.objects.bulk_create([
+            VoteEvent(question=self.question, choice=choice)
+            for choice in (self.red, self.red, self.blue)
+        ])
+        materialize_vote_events()
+        Choice.objects.filter(pk=self.red.pk).update(votes=1000)
+
+        self.assertEqual(rebuild_votes_from_log(chunk_size=1), 2)
+        self.red.refresh_from_db()
+        self.question.refresh_from_db()
+        self.assertEqual(self.red.votes, 2)
+        self.assertEqual(self.question.total_votes, 3)
+
+    def test_rebuild_refuses_outside_event_log_mode(self):
+        Choice.objects.filter(pk=self.red.pk).update(votes=5)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_votes_from_log', stdout=StringIO())
+        self.red.refresh_from_db()
+        self.assertEqual(self.red.votes, 5)
+
+
+class VoteBallotTests(TestCase):
+    def setUp(self):
+        self.questions = [create_question_with_choices(f"Question {i}?") for i in range(12)]
+        self.url = reverse('polls:vote_ballot')
+
+    def post_ballot(self, votes):
+        return self.client.post(
+            self.url,
+            json.dumps({'votes': votes}),
+            content_type='application/json',
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+
+    @override_settings(POLLS_ONE_VOTE_PER_VOTER=False)
+    def test_ballot_applies_all_votes_in_constant_queries(self):
+        votes = [
+            {'question_id': q.id, 'choice_id': q.choices.get(choice_text="Red").id}
+            for q in self.questions
+        ]
+        # validate + 2 savepoints + choice UPDATE + question UPDATE
+        # + 2 releases + tally (statistics are written later, in a batch)
+        with self.assertNumQueries(8):
+            response = self.post_ballot(votes)
+        data = response.json()
+        self.assertEqual(len(data['questions']), 12)
+        self.assertTrue(all(q['total_votes'] == 1 for q in data['questions']))
+        self.assertEqual(Choice.objects.filter(choice_text="Red", votes=1).count(), 12)
+
+    def test_ballot_rejects_mismatched_choice(self):
+        first, second = self.questions[:2]
+        response = self.post_ballot([
+            {'question_id': first.id, 'choice_id': second.choices.first().id},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Choice.objects.filter(votes__gt=0).count(), 0)
+
+    def test_ballot_rejects_duplicate_question(self):
+        question = self.questions[0]
+        choice_id = question.choices.first().id
+        response = self.post_ballot([
+            {'question_id': question.id, 'choice_id': choice_id},
+            {'question_id': question.id, 'choice_id': choice_id},
+        ])
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(POLLS_LIVE_MAX_UPDATES_PER_SECOND=50, POLLS_LIVE_POLL_INTERVAL=60)
+class LiveTallyTests(TestCase):
+    async def test_stream_pushes_snapshot_then_coalesced_updates(self):
+        question = await sync_to_async(create_question_with_choices)()
+        red = await Choice.objects.select_related('question').aget(question=question, choice_text="Red")
+        broadcaster = TallyBroadcaster()
+
+        first_client = broadcaster.stream(question.id)
+        second_client = broadcaster.stream(question.id)
+        self.assertIn('"total_votes": 0', await first_client.__anext__())
+        self.assertIn('"total_votes": 0', await second_client.__anext__())
+        self.assertEqual(len(broadcaster._producers), 1)
+
+        for _ in range(3):
+            await sync_to_async(record_vote)(red)
+        broadcaster.notify(question.id)
+        event = await asyncio.wait_for(first_client.__anext__(), 5)
+        self.assertTrue(event.startswith('event: tally'))
+        self.assertIn('"total_votes": 3', event)
+
+        await first_client.aclose()
+        await second_client.aclose()
+        self.assertEqual(broadcaster._producers, {})
+
+    async def test_producer_retries_after_a_failed_tally(self):
+        question = await sync_to_async(create_question_with_choices)()
+        broadcaster = TallyBroadcaster()
+        broadcaster.retry_delay = 0.01
+        snapshots = [DatabaseError('gone'), {'total_votes': 0, 'choices': []}]
+        with mock.patch('polls.live.tally_question', side_effect=snapshots):
+            client = broadcaster.stream(question.id)
+            with self.assertLogs('polls.live', 'ERROR'):
+                event = await asyncio.wait_for(client.__anext__(), 5)
+        self.assertIn('"total_votes": 0', event)
+        self.assertFalse(broadcaster._producers[question.id].done())
+        await client.aclose()
+
+    async def test_stream_view_returns_404_for_unknown_question(self):
+        response = await self.async_client.get(reverse('polls:results_stream', args=(999,)))
+        self.assertEqual(response.status_code, 404)
+
+    def test_stream_view_answers_wsgi_with_one_snapshot(self):
+        question = create_question_with_choices()
+        response = self.client.get(reverse('polls:results_stream', args=(question.id,)))
+        self.assertFalse(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertTrue(response.content.startswith(b'event: tally'))
+        self.assertIn(b'"total_votes": 0', response.content)
+
+    async def test_results_page_opens_the_stream_only_under_asgi(self):
+        question = await sync_to_async(create_question_with_choices)()
+        url = reverse('polls:results', args=(question.id,))
+        response = await self.async_client.get(url)
+        self.assertContains(response, 'new EventSource')
+        response = await sync_to_async(self.client.get)(url)
+        self.assertNotContains(response, 'new EventSource')
+        with self.settings(POLLS_LIVE_STREAM=False):
+            response = await self.async_client.get(url)
+        self.assertNotContains(response, 'new EventSource')
+
+
+class DuplicateVoteGuardTests(TestCase):
+    def setUp(self):
+        self.question = create_question_with_choices()
+        self.red = self.question.choices.get(choice_text="Red")
+        self.url = reverse('polls:vote', args=(self.question.id,))
+
+    def test_bloom_filter_membership(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f'member-{i}')
+        self.assertTrue(all(f'member-{i}' in bloom for i in range(1000)))
+        false_positives = sum(f'other-{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    @override_settings(POLLS_ONE_VOTE_PER_VOTER=True)
+    def test_repeat_vote_is_rejected(self):
+        self.client.post(self.url, {'choice': self.red.id})
+        response = self.client.post(self.url, {'choice': self.red.id})
+        self.assertContains(response, "You have already voted on this question.")
+        self.red.refresh_from_db()
+        self.assertEqual(self.red.votes, 1)
+        self.assertEqual(VoterRecord.objects.count(), 1)
+
+        # A different session is a different voter
+        self.client.logout()
+        self.client.post(self.url, {'choice': self.red.id})
+        self.red.refresh_from_db()
+        self.assertEqual(self.red.votes, 2)
+
+    def test_guard_rebuilds_from_ledger(self):
+        VoterRecord.objects.create(question=self.question, voter_key='abc')
+        guard = VoterGuard(capacity=1000)
+        guard.rebuild()
+        self.assertIn(guard._member(self.question.id, 'abc'), guard._bloom)
+        self.assertEqual(guard.claim('abc', [self.question.id]), {self.question.id})
+        self.assertEqual(guard.claim('def', [self.question.id]), set())
+        self.assertEqual(guard.claim('def', [self.question.id]), {self.question.id})
+
+    def test_guard_checks_the_ledger_until_built_in_the_background(self):
+        VoterRecord.objects.create(question=self.question, voter_key='abc')
+        guard = VoterGuard(capacity=1000)
+        building = threading.Event()
+        with mock.patch.object(VoterGuard, 'rebuild', side_effect=building.wait) as rebuild:
+            self.assertEqual(guard.claim('abc', [self.question.id]), {self.question.id})
+            self.assertEqual(guard.claim('def', [self.question.id]), set())
+            building.set()
+            guard._builder.join()
+        rebuild.assert_called_once_with()  # one build, however many claims wait for it
+        self.assertIsNone(guard._bloom)
+
+    def test_claims_during_a_build_are_replayed(self):
+        guard = VoterGuard(capacity=1000)
+        records = VoterRecord.objects.order_by
+
+        def claim_while_reading(*args, **kwargs):
+            if guard._changes == []:
+                guard.claim('def', [self.question.id])  # a claim in this worker mid-build
+            return records(*args, **kwargs)
+
+        with mock.patch.object(VoterRecord.objects, 'order_by', claim_while_reading):
+            guard.rebuild()
+        self.assertIn(guard._member(self.question.id, 'def'), guard._bloom)
+        self.assertIsNone(guard._changes)
+
+
+@override_settings(
+    POLLS_ONE_VOTE_PER_VOTER=False,
+    POLLS_RATE_LIMITS={
+        'polls:vote': {'client': {'rate': 0.001, 'burst': 2}},
+        'polls:vote_ajax': {'question': {'rate': 0.001, 'burst': 1}},
+    },
+)
+class RateLimitMiddlewareTests(TestCase):
+    def setUp(self):
+        self.question = create_question_with_choices()
+        self.red = self.question.choices.get(choice_text="Red")
+
+    def test_client_over_limit_gets_429_without_queries(self):
+        url = reverse('polls:vote', args=(self.question.id,))
+        for _ in range(2):
+            self.assertEqual(self.client.post(url, {'choice': self.red.id}).status_code, 302)
+        with self.assertNumQueries(0):
+            response = self.client.post(url, {'choice': self.red.id})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+        # Other clients still get through
+        response = self.client.post(url, {'choice': self.red.id}, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 302)
+
+    def test_question_bucket_is_shared_by_clients(self):
+        url = reverse('polls:vote_ajax', args=(self.question.id,))
+        kwargs = {'content_type': 'application/json', 'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        body = json.dumps({'choice_id': self.red.id})
+        self.assertEqual(self.client.post(url, body, **kwargs).status_code, 200)
+        response = self.client.post(url, body, REMOTE_ADDR='10.0.0.2', **kwargs)
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(POLLS_RATE_LIMITS={
+        'polls:vote_ajax': {'client': {'rate': 0.001, 'burst': 2}, 'question': {'rate': 0.001, 'burst': 1}},
+    })
+    def test_rejected_request_gives_back_its_client_token(self):
+        other = create_question_with_choices("Other?")
+        kwargs = {'content_type': 'application/json', 'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+        def vote(question):
+            url = reverse('polls:vote_ajax', args=(question.id,))
+            body = json.dumps({'choice_id': question.choices.get(choice_text="Red").id})
+            return self.client.post(url, body, **kwargs).status_code
+
+        self.assertEqual(vote(self.question), 200)
+        self.assertEqual(vote(self.question), 429)  # question bucket empty
+        self.assertEqual(vote(other), 200)  # the client token was refunded
+        self.assertEqual(vote(other), 429)  # now the client bucket is empty
+
+    def test_refunds_never_exceed_the_burst(self):
+        buckets = LocalBuckets()
+        buckets.take('ratelimit:test', 0.001, 2, cost=-1)
+        self.assertEqual([buckets.take('ratelimit:test', 0.001, 2) == 0 for _ in range(3)], [True, True, False])
+
+    def test_reads_are_not_limited(self):
+        url = reverse('polls:results', args=(self.question.id,))
+        for _ in range(5):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def take_concurrently(self, buckets, attempts):
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(buckets.take('ratelimit:test', 0.001, 10)))
+            for _ in range(attempts)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results.count(0)
+
+    def test_shared_buckets_are_shared_by_processes_and_atomic(self):
+        path = os.path.join(tempfile.mkdtemp(), 'buckets')
+        first, second = SharedMemoryBuckets(path, slots=64), SharedMemoryBuckets(path, slots=64)
+        self.assertEqual(self.take_concurrently(first, 6) + self.take_concurrently(second, 6), 10)
+        self.assertGreater(first.take('ratelimit:test', 0.001, 10), 0)
+        self.assertEqual(first.take('ratelimit:other', 0.001, 10), 0)
+
+    def test_cache_buckets_never_spend_a_token_twice(self):
+        buckets = CacheBuckets('default')
+        taken = self.take_concurrently(buckets, 30)
+        # Requests that lost the lock race were shed without spending a token
+        while buckets.take('ratelimit:test', 0.001, 10) == 0:
+            taken += 1
+        self.assertEqual(taken, 10)
+
+
+class QuestionSearchTests(TestCase):
+    def setUp(self):
+        self.python = create_question_with_choices("Which Python web framework?", ("Django", "Flask"))
+        self.food = create_question_with_choices("Best breakfast food?", ("Pancakes", "Python eggs"))
+        self.other = create_question_with_choices("Favourite sport?", ("Football", "Tennis"))
+
+    def test_search_matches_question_and_choice_text(self):
+        self.assertEqual(set(Question.objects.search("python")), {self.python, self.food})
+        self.assertEqual(list(Question.objects.search("flask")), [self.python])
+        self.assertEqual(list(Question.objects.search("pancake")), [self.food])
+
+    def test_search_index_follows_saves_and_deletes(self):
+        self.other.question_text = "Favourite racket sport?"
+        self.other.save()
+        self.assertEqual(list(Question.objects.search("racket")), [self.other])
+
+        Choice.objects.create(question=self.other, choice_text="Badminton")
+        self.assertEqual(list(Question.objects.search("badminton")), [self.other])
+
+        self.other.delete()
+        self.assertEqual(list(Question.objects.search("racket")), [])
+
+    def test_search_ignores_query_syntax(self):
+        self.assertEqual(
+            list(Question.objects.search('"python* (^')), list(Question.objects.search("python"))
+        )
+
+    def test_index_view_uses_search(self):
+        response = self.client.get(reverse('polls:index'), {'q': 'flask'})
+        self.assertEqual(list(response.context['page_obj']), [self.python])
+
+    def test_fallback_without_fts(self):
+        from unittest import mock
+
+        with mock.patch('polls.models.fts_available', return_value=False):
+            self.assertEqual(set(Question.objects.search("ython")), {self.python, self.food})
+
+
+class TrigramIndexTests(TestCase):
+    def setUp(self):
+        self.python = create_question_with_choices("Which Python web framework?", ("Django", "Flask"))
+        self.food = create_question_with_choices("Best breakfast food?", ("Pancakes", "Python eggs"))
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.index = TrigramIndex(path=os.path.join(self.tmpdir.name, 'trigram.idx'))
+        self.index.rebuild()  # as manage.py rebuild_trigram_index does at deploy
+
+    def test_substring_matches_like_icontains(self):
+        self.assertEqual(self.index.search("YTHO"), [self.python.pk, self.food.pk])
+        self.assertEqual(self.index.search("st foo"), [self.food.pk])
+        self.assertEqual(self.index.search("ango"), [self.python.pk])
+        self.assertEqual(self.index.search("zzz"), [])
+        self.assertIsNone(self.index.search("py"))
+
+    def test_no_match_across_fields(self):
+        # "Django" and "Flask" are separate fields, so "goFl" must not match
+        self.assertEqual(self.index.search("goFl"), [])
+
+    def test_overlay_tracks_updates_and_removals(self):
+        self.index.search("python")
+        self.python.question_text = "Which Ruby web framework?"
+        self.python.save()
+        self.index.update([self.python.pk])
+        self.assertEqual(self.index.search("ruby"), [self.python.pk])
+        self.assertEqual(self.index.search("python"), [self.food.pk])
+
+        self.index.remove(self.food.pk)
+        self.assertEqual(self.index.search("python"), [])
+
+    def test_remaps_file_rebuilt_elsewhere(self):
+        self.index.search("python")
+        other = TrigramIndex(path=self.index.path)
+        Choice.objects.create(question=self.food, choice_text="Waffles")
+        other.rebuild()
+        os.utime(self.index.path, ns=(1, 1))  # make the change visible even on coarse mtimes
+        self.assertEqual(self.index.search("waffle"), [self.food.pk])
+
+    def test_missing_file_is_built_in_the_background(self):
+        index = TrigramIndex(path=os.path.join(self.tmpdir.name, 'missing.idx'))
+        with mock.patch.object(TrigramIndex, 'rebuild') as rebuild:
+            # The request falls back instead of waiting for the build
+            self.assertIsNone(index.search("python"))
+            index._builder.join()
+        rebuild.assert_called_once_with()
+
+    def test_question_ids_beyond_32_bits(self):
+        big = Question.objects.create(question_text="Python at scale?", pub_date=timezone.now(), id=2 ** 40)
+        self.index.rebuild()
+        self.assertEqual(self.index.search("at scale"), [big.pk])
+        self.assertEqual(self.index.search("python"), [self.python.pk, self.food.pk, big.pk])
+
+    @override_settings(POLLS_SEARCH_BACKEND='trigram')
+    def test_manager_search_uses_trigram_backend(self):
+        from unittest import mock
+
+        with mock.patch('polls.trigrams.trigram_index', self.index):
+            self.assertEqual(list(Question.objects.search("eggs")), [self.food])
+            # Too short to index: falls back to icontains
+            self.assertEqual(list(Question.objects.search("fl")), [self.python])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        # Pairs of questions share a pub_date, so the id tie-break matters
+        for i in range(7):
+            for j in range(2):
+                Question.objects.create(
+                    question_text=f"Question {i}.{j}", pub_date=now - datetime.timedelta(hours=i)
+                )
+        self.expected = list(Question.objects.order_by('-pub_date', '-id'))
+
+    def walk(self, paginator):
+        seen, page = [], paginator.get_page()
+        seen += page
+        while page.has_next():
+            page = paginator.get_page(page.next_cursor)
+            seen += page
+        return seen, page
+
+    def test_forward_walk_visits_every_row_once_in_order(self):
+        seen, _ = self.walk(KeysetPaginator(Question.objects.all(), 4))
+        self.assertEqual(seen, self.expected)
+
+    def test_backward_walk_returns_to_first_page(self):
+        paginator = KeysetPaginator(Question.objects.all(), 4)
+        _, page = self.walk(paginator)
+        pages = [list(page)]
+        while page.has_previous():
+            page = paginator.get_page(page.previous_cursor)
+            pages.insert(0, list(page))
+        self.assertEqual(sum(pages, []), self.expected)
+        self.assertEqual(pages[0], self.expected[:4])
+
+    def test_deep_page_is_one_query(self):
+        paginator = KeysetPaginator(Question.objects.all(), 4)
+        cursor = paginator.get_page().next_cursor
+        with self.assertNumQueries(1):
+            page = paginator.get_page(cursor)
+        self.assertEqual(list(page), self.expected[4:8])
+
+    def test_invalid_cursor_gives_first_page(self):
+        paginator = KeysetPaginator(Question.objects.all(), 4)
+        for cursor in ("garbage", "W10", "WyJuZXh0IiwgWyJ4IiwgMV1d"):
+            page = paginator.get_page(cursor)
+            self.assertEqual(list(page), self.expected[:4])
+            self.assertFalse(page.has_previous())
+
+    def test_index_view_links_by_cursor(self):
+        response = self.client.get(reverse('polls:index'))
+        page = response.context['page_obj']
+        self.assertEqual(list(page), self.expected[:5])
+        self.assertContains(response, f'?cursor={page.next_cursor}')
+
+        response = self.client.get(reverse('polls:index'), {'cursor': page.next_cursor})
+        self.assertEqual(list(response.context['page_obj']), self.expected[5:10])
+
+
+class CachedCountTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.python = create_question_with_choices("Which Python web framework?", ("Django", "Flask"))
+        create_question_with_choices("Best breakfast food?", ("Pancakes", "Eggs"))
+
+    def test_count_is_cached_per_filter(self):
+        active = Question.objects.filter(is_active=True)
+        self.assertEqual(cached_count(active), ResultCount(2))
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_count(active.order_by('question_text')), ResultCount(2))
+        with self.assertNumQueries(1):
+            self.assertEqual(cached_count(active.filter(question_text__icontains="python")), ResultCount(1))
+
+    def test_saves_and_deletes_invalidate(self):
+        active = Question.objects.filter(is_active=True)
+        cached_count(active)
+        create_question_with_choices("Favourite sport?")
+        self.assertEqual(cached_count(active), ResultCount(3))
+        self.python.delete()
+        self.assertEqual(cached_count(active), ResultCount(2))
+
+    @override_settings(POLLS_COUNT_ESTIMATE_THRESHOLD=2)
+    def test_large_counts_served_as_estimates(self):
+        active = Question.objects.filter(is_active=True)
+        cached_count(active)
+        create_question_with_choices("Favourite sport?")
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_count(active), ResultCount(2, approximate=True))
+
+        with override_settings(POLLS_COUNT_ESTIMATE_MAX_AGE=0):
+            self.assertEqual(cached_count(active), ResultCount(3))
+
+    @override_settings(POLLS_COUNT_ESTIMATE_THRESHOLD=2)
+    def test_index_shows_about_for_estimates(self):
+        self.client.get(reverse('polls:index'))
+        create_question_with_choices("Favourite sport?")
+        response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, "About 2 total questions")
+
+
+class CategoryCacheTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.science = Category.objects.create(name="Science")
+        self.sport = Category.objects.create(name="Sport")
+        Category.objects.create(name="Archived", is_active=False)
+        active_categories()  # warm this process's cache
+
+    def test_reads_are_query_free_once_warm(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(active_categories(), [self.science, self.sport])
+            form = SearchForm()
+            self.assertEqual(
+                form.fields['category'].choices,
+                [('', 'All Categories'), ('science', 'Science'), ('sport', 'Sport')],
+            )
+            self.assertEqual(len(QuestionForm().fields['category'].choices), 4)
+
+    def test_category_writes_invalidate(self):
+        self.sport.is_active = False
+        self.sport.save()
+        self.assertEqual(active_categories(), [self.science])
+
+        music = Category.objects.create(name="Music")
+        self.assertEqual(active_categories(), [music, self.science])
+
+        self.science.delete()
+        self.assertEqual(active_categories(), [music])
+
+    def test_reloads_after_max_age_even_without_a_bump(self):
+        Category.objects.filter(pk=self.sport.pk).update(name="Sports")  # no signal, no bump
+        self.assertEqual(active_categories()[1].name, "Sport")
+        with override_settings(POLLS_CATEGORY_CACHE_MAX_AGE=0), self.assertNumQueries(1):
+            self.assertEqual(active_categories()[1].name, "Sports")
+
+    def test_question_form_still_validates_category(self):
+        form = QuestionForm(data={'question_text': "What is a quark?", 'category': self.science.pk})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['category'], self.science)
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.question = create_question_with_choices("Favourite colour?", ("Red", "Blue"))
+        self.red = self.question.choices.get(choice_text="Red")
+
+    def get_detail(self):
+        return self.client.get(reverse('polls:detail', args=(self.question.id,)))
+
+    @override_settings(POLLS_FRAGMENT_CACHE_STATS=True)
+    def test_fragments_are_reused_between_requests(self):
+        self.get_detail()
+        with self.assertNumQueries(2):  # the question, and the sidebar's choice count
+            self.get_detail()
+        self.assertEqual(fragment_stats()['question_choices'], (1, 1))
+
+    def test_vote_error_replies_cache_complete_fragments(self):
+        # The error reply is the first render, so it fills the fragment cache
+        response = self.client.post(reverse('polls:vote', args=(self.question.id,)), {})
+        self.assertContains(response, "select a choice.")
+        response = self.get_detail()
+        self.assertContains(response, 'id="choice', count=2)
+        self.assertContains(response, "2 choices")
+
+    def test_choice_edit_invalidates(self):
+        self.get_detail()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.red.choice_text = "Crimson"
+            self.red.save()
+        self.assertContains(self.get_detail(), "Crimson")
+
+    def test_votes_invalidate(self):
+        self.addCleanup(statistics_buffer.flush)  # write the queued vote before the rollback
+        self.get_detail()
+        with self.captureOnCommitCallbacks(execute=True):
+            record_vote(self.red)
+        self.assertContains(self.get_detail(), "1 vote")
+
+    def test_category_change_invalidates_question_cards(self):
+        category = Category.objects.create(name="Art")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.question.category = category
+            self.question.save()
+        self.client.get(reverse('polls:index'))
+        with self.captureOnCommitCallbacks(execute=True):
+            category.name = "Fine Art"
+            category.save()
+        self.assertContains(self.client.get(reverse('polls:index')), "Fine Art")
+
+
+class TypeaheadTests(TestCase):
+    def test_prefix_index_matches_word_starts(self):
+        index = PrefixIndex()
+        index.load([(1, "Best breakfast food?", None), (2, "Favourite  BREAD", None), (3, "Sport", None)])
+        self.assertEqual([pk for pk, _, _ in index.search("bre", 10)], [2, 1])  # "bread" < "breakfast"
+        self.assertEqual([pk for pk, _, _ in index.search("best bre", 10)], [1])
+        self.assertEqual([pk for pk, _, _ in index.search("reak", 10)], [])
+        self.assertEqual(len(index.search("b", 1)), 1)
+
+    def test_incremental_add_and_remove(self):
+        index = PrefixIndex()
+        index.load([(1, "Best breakfast food?", None)])
+        index.add(2, "Breaking news")
+        index.add(1, "Lunch options")
+        self.assertEqual([pk for pk, _, _ in index.search("brea", 10)], [2])
+        index.remove(2)
+        self.assertEqual(index.search("brea", 10), [])
+        self.assertEqual(index.entries, sorted(index.entries))
+
+    def test_endpoint_answers_from_index(self):
+        from unittest import mock
+
+        index = TypeaheadIndex()
+        question = create_question_with_choices("Which Python web framework?")
+        Question.objects.create(question_text="Python hidden", is_active=False)
+        category = Category.objects.create(name="Programming")
+        Tag.objects.create(name="python")
+        index.rebuild()
+
+        with mock.patch('polls.views.typeahead_index', index), \
+                mock.patch('polls.signals.typeahead_index', index):
+            data = self.client.get(reverse('polls:typeahead'), {'q': 'pyth'}).json()
+            self.assertEqual([item['id'] for item in data['questions']], [question.id])
+            self.assertEqual([item['name'] for item in data['tags']], ["python"])
+
+            # Later writes in this worker are visible straight away
+            category.name = "Python programming"
+            category.save()
+            with self.assertNumQueries(0):
+                data = self.client.get(reverse('polls:typeahead'), {'q': 'pyth', 'limit': 1}).json()
+            self.assertEqual(data['categories'][0]['url'], reverse('polls:category_detail', args=(category.slug,)))
+
+    def test_loads_in_the_background_while_serving_the_old_lists(self):
+        index = TypeaheadIndex()
+        with mock.patch.object(TypeaheadIndex, 'rebuild') as rebuild:
+            # Nothing loaded yet: answer empty rather than wait
+            self.assertEqual(index.search("pyth", 5)['questions'], [])
+            index._builder.join()
+        rebuild.assert_called_once_with()
+
+        question = create_question_with_choices("Which Python web framework?")
+        index.rebuild()
+        with override_settings(POLLS_TYPEAHEAD_REBUILD_INTERVAL=0), \
+                mock.patch.object(TypeaheadIndex, '_start_rebuild') as start_rebuild:
+            # Due for a reload: it is started, the current lists still answer
+            self.assertEqual([pk for pk, _, _ in index.search("pyth", 5)['questions']], [question.pk])
+        start_rebuild.assert_called_once_with()
+
+    def test_writes_during_a_load_are_replayed(self):
+        index = TypeaheadIndex()
+        question = create_question_with_choices("Which Python web framework?")
+        load = PrefixIndex.load
+        written = []
+
+        def load_then_write(prefix_index, rows):
+            load(prefix_index, rows)
+            if not written:  # a question saved in this worker while loading
+                written.append(Question.objects.create(question_text="Python or Ruby?"))
+                index.update_question(written[0])
+
+        with mock.patch.object(PrefixIndex, 'load', load_then_write):
+            index.rebuild()
+        self.assertCountEqual([pk for pk, _, _ in index.search("pyth", 5)['questions']], [question.pk, written[0].pk])
+
+    def test_short_queries_return_nothing(self):
+        data = self.client.get(reverse('polls:typeahead'), {'q': 'p'}).json()
+        self.assertEqual(data['questions'], [])
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.science = Category.objects.create(name="Science")
+        self.sport = Category.objects.create(name="Sport")
+        for text, category in (
+            ("Best python library?", self.science),
+            ("Python or rust?", self.science),
+            ("Monty Python sketch?", self.sport),
+            ("Favourite sport?", self.sport),
+        ):
+            Question.objects.create(question_text=text, category=category)
+
+    def test_question_facets_in_one_query(self):
+        with self.assertNumQueries(1):
+            results, facets = Question.objects.faceted_search("python", is_active=True)
+        self.assertEqual(results.count(), 3)
+        self.assertEqual(facets, {'category': {self.science.id: 2, self.sport.id: 1}})
+
+    def test_article_category_and_tag_facets_in_one_query(self):
+        from django.contrib.auth.models import User
+
+        author = User.objects.create_user("writer")
+        news, howto = Tag.objects.create(name="news"), Tag.objects.create(name="howto")
+        first = Article.objects.create(title="A", slug="a", content="...", author=author, category=self.science)
+        first.tags.set([news, howto])
+        second = Article.objects.create(title="B", slug="b", content="...", author=author, category=self.science)
+        second.tags.set([news])
+        Article.objects.create(title="C", slug="c", content="...", author=author, category=self.sport)
+
+        with self.assertNumQueries(1):
+            _, facets = Article.objects.faceted_listing()
+        self.assertEqual(facets['category'], {self.science.id: 2, self.sport.id: 1})
+        self.assertEqual(facets['tags'], {news.id: 2, howto.id: 1, None: 1})
+        self.assertEqual(facet_counts(Article.objects.none(), ['category']), {'category': {}})
+
+    def test_index_facets_ignore_category_filter(self):
+        response = self.client.get(reverse('polls:index'), {'q': 'python', 'category': 'sport'})
+        self.assertEqual(response.context['category_facets'], [(self.science, 2), (self.sport, 1)])
+        self.assertEqual(len(response.context['page_obj']), 1)
+
+
+@override_settings(POLLS_SEARCH_BACKEND='bm25')
+class BM25SearchTests(TestCase):
+    def setUp(self):
+        self.tutorial = create_question_with_choices("Python tutorial or Python book?", ("Tutorial", "Book"))
+        self.snake = create_question_with_choices("Largest snake?", ("Python", "Anaconda"))
+        self.framework = create_question_with_choices("Which web framework?", ("Django", "Flask"))
+
+    def statistics(self):
+        from .models import SearchCorpus, SearchTerm
+
+        corpus = SearchCorpus.objects.get(pk=1)
+        terms = dict(SearchTerm.objects.values_list('term', 'document_count'))
+        return corpus.document_count, corpus.total_length, terms
+
+    def test_ranks_by_term_frequency(self):
+        ranked = bm25.search("python")
+        self.assertEqual([question_id for question_id, _ in ranked], [self.tutorial.id, self.snake.id])
+        self.assertGreater(ranked[0][1], ranked[1][1])
+        self.assertEqual(len(bm25.search("python", k=1)), 1)
+
+    def test_statistics_follow_writes(self):
+        before = self.statistics()
+        question = create_question_with_choices("Python or what?", ("Python", "Ruby"))
+        self.assertEqual(self.statistics()[2]['python'], 3)
+        choice = question.choices.get(choice_text="Ruby")
+        choice.choice_text = "Perl"
+        choice.save()
+        self.assertNotIn('ruby', self.statistics()[2])
+        question.delete()
+        self.assertEqual(self.statistics(), before)
+
+    def test_only_maintained_for_the_bm25_backend(self):
+        with override_settings(POLLS_SEARCH_BACKEND='fts'), CaptureQueriesContext(connection) as queries:
+            question = Question.objects.create(question_text="Quantum python?")
+            question.delete()
+        writes = [query['sql'] for query in queries if not query['sql'].startswith('SELECT')]
+        self.assertFalse([sql for sql in writes if 'polls_search' in sql])
+        self.assertNotIn('quantum', self.statistics()[2])
+
+    def test_posting_budget_bounds_the_work(self):
+        for i in range(3):
+            create_question_with_choices(f"Python {i}?", ("Yes", "No"))
+        with override_settings(POLLS_BM25_MAX_POSTINGS=2):
+            # The rarest term ("tutorial") is read whole, "python" only partly
+            ranked = bm25.search("python tutorial")
+        self.assertEqual([question_id for question_id, _ in ranked], [self.tutorial.id])
+
+    def test_incremental_matches_rebuild(self):
+        self.snake.question_text = "Longest snake alive?"
+        self.snake.save()
+        self.framework.choices.first().delete()
+        incremental = self.statistics()
+        bm25.rebuild_index()
+        self.assertEqual(self.statistics(), incremental)
+
+    @override_settings(POLLS_SEARCH_BACKEND='bm25')
+    def test_manager_search_orders_by_score(self):
+        self.assertEqual(list(Question.objects.search("python")), [self.tutorial, self.snake])
+        self.assertEqual(set(Question.objects.search("pyth")), {self.tutorial, self.snake})
+        self.assertEqual(list(Question.objects.search("quantum")), [])
+
+
+class PollStatisticsTests(TestCase):
+    def setUp(self):
+        self.science = Category.objects.create(name="Science")
+        self.sports = Category.objects.create(name="Sports")
+        self.question = create_question_with_choices()
+        self.question.category = self.science
+        self.question.save()
+        self.red = self.question.choices.get(choice_text="Red")
+        self.addCleanup(statistics_buffer.flush)
+
+    def vote(self, choice):
+        with self.captureOnCommitCallbacks(execute=True):
+            record_vote(choice)
+        statistics_buffer.flush()
+
+    def stored(self):
+        from .models import CategoryStatistics, PollStatistics
+
+        totals = PollStatistics.objects.values('question_count', 'category_count', 'total_votes').get()
+        categories = {
+            row.category_id: (row.question_count, row.total_votes) for row in CategoryStatistics.objects.all()
+        }
+        return totals, categories
+
+    def assertInStep(self):
+        from .statistics import compute_statistics
+
+        self.assertEqual(self.stored(), compute_statistics())
+
+    def test_votes_update_totals_in_every_mode(self):
+        self.vote(self.red)
+        self.question.vote_shards = 4
+        self.question.save()
+        self.vote(self.red)
+        with override_settings(POLLS_VOTE_MODE='buffered'):
+            buffer = VoteBuffer(max_pending=1000, flush_interval=60)
+            buffer.add(self.question.id, self.red.id, 3)
+            buffer.flush()
+        totals, categories = self.stored()
+        self.assertEqual(totals['total_votes'], 5)
+        self.assertEqual(categories[self.science.id], (1, 5))
+        self.assertInStep()
+
+    def test_strict_votes_reach_the_totals_in_batches(self):
+        from .models import PollStatistics
+
+        with self.captureOnCommitCallbacks(execute=True):
+            record_vote(self.red)
+            record_vote(self.red)
+        self.assertEqual(self.stored()[0]['total_votes'], 0)
+        with self.assertNumQueries(5):  # savepoint pair, question states, one UPDATE per table
+            self.assertEqual(statistics_buffer.flush(), 2)
+        self.assertEqual(PollStatistics.objects.get().total_votes, 2)
+        self.assertInStep()
+
+    def test_votes_buffered_for_deleted_questions_are_dropped(self):
+        self.vote(self.red)
+        with override_settings(POLLS_VOTE_MODE='buffered'):
+            buffer = VoteBuffer(max_pending=1000, flush_interval=60)
+            buffer.add(self.question.id, self.red.id, 3)  # not written yet
+        self.question.delete()
+        buffer.flush()
+        self.assertEqual(self.stored()[0]['total_votes'], 0)
+        self.assertInStep()
+
+    def test_written_votes_of_deleted_questions_are_still_counted(self):
+        self.vote(self.red)
+        with self.captureOnCommitCallbacks(execute=True):
+            record_vote(self.red)  # written, not counted yet: the deletion subtracts it
+        self.question.delete()
+        statistics_buffer.flush()
+        self.assertEqual(self.stored()[0]['total_votes'], 0)
+
+    def test_question_and_category_changes(self):
+        self.vote(self.red)
+        self.question.category = self.sports
+        self.question.save()
+        self.assertEqual(self.stored()[1][self.sports.id], (1, 1))
+        self.question.is_active = False
+        self.question.save()
+        self.assertInStep()
+        self.question.is_active = True
+        self.question.save()
+        self.sports.is_active = False
+        self.sports.save()
+        self.assertEqual(self.stored()[0]['category_count'], 1)
+        self.red.delete()
+        self.assertInStep()
+        self.question.delete()
+        self.sports.delete()
+        self.assertInStep()
+        self.assertEqual(self.stored()[0], {'question_count': 0, 'category_count': 1, 'total_votes': 0})
+
+    def test_admin_bulk_actions_keep_everything_in_step(self):
+        from django.contrib.auth.models import User
+
+        self.vote(self.red)
+        other = create_question_with_choices("Favourite sport?")
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        count = cached_count(Question.objects.filter(is_active=True))
+        board = TrendingBoard()
+        board.add(self.question.pk)
+        board._built_at = time.monotonic()
+
+        with mock.patch('polls.signals.trending_board', board), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:polls_question_changelist'), {
+                'action': 'make_inactive', '_selected_action': [self.question.pk, other.pk],
+            })
+        self.assertInStep()
+        self.assertEqual(self.stored()[0]['question_count'], 0)
+        self.assertEqual(cached_count(Question.objects.filter(is_active=True)), count.value - 2)
+        self.assertNotIn(self.question.pk, dict(board.top(10)))
+
+        self.client.post(reverse('admin:polls_question_changelist'), {
+            'action': 'make_active', '_selected_action': [self.question.pk],
+        })
+        self.assertInStep()
+
+    def test_direct_choice_edits(self):
+        self.red.votes = 7
+        self.red.save()
+        Choice.objects.create(question=self.question, choice_text="Green", votes=2)
+        self.assertEqual(self.stored()[0]['total_votes'], 9)
+        self.assertInStep()
+
+    def test_reconcile_fixes_drift(self):
+        from .models import PollStatistics
+
+        Choice.objects.filter(pk=self.red.pk).update(votes=4)
+        out = StringIO()
+        call_command('reconcile_poll_stats', stdout=out)
+        self.assertIn('total_votes: 0 -> 4', out.getvalue())
+        self.assertInStep()
+        PollStatistics.objects.all().delete()
+        self.vote(self.red)
+        self.assertEqual(self.stored()[0]['total_votes'], 5)
+
+    def test_stats_page_reads_materialized_rows(self):
+        self.vote(self.red)
+        clear_caches()
+        # totals row, recent questions, category rows
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('polls:stats'))
+        self.assertEqual(response.context['total_votes'], 1)
+        self.assertEqual(response.context['total_categories'], 2)
+        self.assertEqual(
+            [(c.name, c.question_count, c.total_votes) for c in response.context['category_stats']],
+            [("Science", 1, 1), ("Sports", 0, 0)],
+        )
+
+
+@override_settings(POLLS_VOTE_ROLLUPS=True)
+class VoteRollupTests(TestCase):
+    def setUp(self):
+        self.question = create_question_with_choices()
+        self.red, self.blue = self.question.choices.order_by('id')
+
+    def tearDown(self):
+        vote_rollups.flush()
+
+    def minute(self, *args):
+        return datetime.datetime(2026, 3, 1, *args, tzinfo=datetime.timezone.utc)
+
+    def test_votes_are_buffered_then_rolled_up(self):
+        record_vote(self.red)
+        record_vote(self.red)
+        record_vote(self.blue)
+        self.assertFalse(VoteRollup.objects.exists())
+        self.assertEqual(vote_rollups.pending(), {self.red.id: 2, self.blue.id: 1})
+
+        self.assertEqual(vote_rollups.flush(), 3)
+        rows = VoteRollup.objects.filter(choice=self.red)
+        self.assertEqual(
+            sorted(rows.values_list('resolution', 'votes')), [('day', 2), ('hour', 2), ('minute', 2)]
+        )
+
+    def test_flushes_add_to_existing_buckets(self):
+        q, red, blue = self.question.id, self.red.id, self.blue.id
+        timeseries.write_rollups({(q, red, self.minute(10, 0)): 2, (q, blue, self.minute(10, 0)): 2})
+        timeseries.write_rollups({(q, red, self.minute(10, 0)): 1, (q, red, self.minute(11, 5)): 4})
+        resolution, buckets, series = timeseries.vote_series(
+            q, self.minute(9, 30), self.minute(11, 59), 'hour'
+        )
+        self.assertEqual(buckets, [self.minute(9), self.minute(10), self.minute(11)])
+        self.assertEqual(series, {red: [0, 3, 4], blue: [0, 2, 0]})
+        day = VoteRollup.objects.get(choice=self.red, resolution='day')
+        self.assertEqual(day.votes, 7)
+
+    def test_resolution_follows_range_and_retention(self):
+        now = timezone.now()
+        hour = datetime.timedelta(hours=1)
+        self.assertEqual(timeseries.pick_resolution(now - hour, now, now), 'minute')
+        self.assertEqual(timeseries.pick_resolution(now - 24 * hour, now, now), 'hour')
+        self.assertEqual(timeseries.pick_resolution(now - 30 * 24 * hour, now, now), 'hour')
+        self.assertEqual(timeseries.pick_resolution(now - 120 * 24 * hour, now, now), 'day')
+        # Minute buckets older than their retention are gone: use hours
+        self.assertEqual(timeseries.pick_resolution(now - 72 * hour, now - 71 * hour, now), 'hour')
+
+    def test_prune_drops_expired_buckets(self):
+        old = timezone.now() - datetime.timedelta(days=3)
+        timeseries.write_rollups({(self.question.id, self.red.id, timeseries.bucket_start(old, 'minute')): 1})
+        self.assertEqual(timeseries.prune_rollups(), 1)
+        self.assertEqual(
+            sorted(VoteRollup.objects.values_list('resolution', flat=True)), ['day', 'hour']
+        )
+
+    def test_series_endpoint(self):
+        minute = timeseries.bucket_start(timezone.now(), 'minute')
+        timeseries.write_rollups({(self.question.id, self.blue.id, minute): 5})
+        url = reverse('polls:results_series', args=(self.question.id,))
+        with self.assertNumQueries(3):
+            data = self.client.get(url).json()
+        self.assertEqual(data['resolution'], 'minute')
+        self.assertEqual(len(data['buckets']), 61)
+        votes = {choice['text']: choice['votes'] for choice in data['choices']}
+        self.assertEqual(sum(votes['Red']), 0)
+        self.assertEqual(sum(votes['Blue']), 5)
+
+        response = self.client.get(url, {'start': '2026-03-02T00:00:00Z', 'end': '2026-03-01T00:00:00Z'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url, {'resolution': 'week'}).status_code, 400)
+
+
+class SketchTests(TestCase):
+    def test_hyperloglog_estimates_and_merges(self):
+        first, second = HyperLogLog(11), HyperLogLog(11)
+        for i in range(6000):
+            first.add(f'voter-{i}')
+        for i in range(4000, 10000):
+            second.add(f'voter-{i}')
+        self.assertAlmostEqual(first.count(), 6000, delta=6000 * 0.05)
+        restored = HyperLogLog.from_bytes(first.to_bytes())
+        self.assertEqual(restored.registers, first.registers)
+        self.assertAlmostEqual(restored.merge(second).count(), 10000, delta=10000 * 0.05)
+
+        small = HyperLogLog(11)
+        for voter in ('a', 'b', 'c', 'a'):
+            small.add(voter)
+        self.assertEqual(small.count(), 3)
+        self.assertLess(len(small.to_bytes()), 100)
+
+    def test_count_min_never_undercounts(self):
+        sketch = CountMinSketch(width=64, depth=4)
+        for key in range(200):
+            sketch.add(key, key % 7 + 1)
+        self.assertTrue(all(sketch.estimate(key) >= key % 7 + 1 for key in range(200)))
+        other = CountMinSketch(width=64, depth=4)
+        other.add(5, 10)
+        merged = CountMinSketch.from_bytes(sketch.to_bytes()).merge(other)
+        self.assertGreaterEqual(merged.estimate(5), 16)
+
+    def test_top_k_keeps_heaviest(self):
+        top = TopK(3)
+        for key, estimate in [(1, 5), (2, 1), (3, 7), (4, 2), (2, 9), (5, 3), (1, 6)]:
+            top.offer(key, estimate)
+        self.assertEqual(top.items(), [(2, 9), (3, 7), (1, 6)])
+
+
+@override_settings(POLLS_VOTE_SKETCHES=True)
+class VoteSketchTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Science")
+        self.hot = create_question_with_choices("Hot?")
+        self.hot.category = self.category
+        self.hot.save()
+        self.cold = create_question_with_choices("Cold?")
+
+    def tearDown(self):
+        vote_sketches.flush()
+
+    def test_workers_merge_into_shared_sketches(self):
+        workers = [VoteSketches(flush_interval=3600), VoteSketches(flush_interval=3600)]
+        for i in range(30):
+            workers[i % 2].add(self.hot.id, self.category.id, f'voter-{i % 10}')
+        workers[0].add(self.cold.id, None, 'voter-0')
+        for worker in workers:
+            worker.flush()
+
+        self.assertEqual(unique_voters('question', [self.hot.id, self.cold.id]), {self.hot.id: 10, self.cold.id: 1})
+        self.assertEqual(unique_voters('category', [self.category.id]), {self.category.id: 10})
+        self.assertEqual(heavy_hitters(), [(self.hot.id, 30), (self.cold.id, 1)])
+
+    def test_vote_views_feed_sketches(self):
+        red = self.hot.choices.get(choice_text="Red")
+        self.client.post(reverse('polls:vote', args=(self.hot.id,)), {'choice': red.id})
+        # Unflushed votes of this worker are already visible
+        data = self.client.get(reverse('polls:api_analytics')).json()
+        self.assertEqual(data['heavy_hitters'][0]['id'], self.hot.id)
+        self.assertEqual(data['heavy_hitters'][0]['unique_voters'], 1)
+        self.assertEqual(data['categories'], [{'id': self.category.id, 'name': "Science", 'unique_voters': 1}])
+
+        vote_sketches.flush()
+        self.hot.delete()
+        self.assertEqual(unique_voters('question', [self.hot.id]), {self.hot.id: 0})
+
+    def test_ballot_feeds_sketches(self):
+        votes = [
+            {'question_id': question.id, 'choice_id': question.choices.get(choice_text="Red").id}
+            for question in (self.hot, self.cold)
+        ]
+        response = self.client.post(
+            reverse('polls:vote_ballot'),
+            json.dumps({'votes': votes}),
+            content_type='application/json',
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(unique_voters('question', [self.hot.id, self.cold.id]), {self.hot.id: 1, self.cold.id: 1})
+        self.assertEqual(unique_voters('category', [self.category.id]), {self.category.id: 1})
+        self.assertCountEqual(heavy_hitters(), [(self.hot.id, 1), (self.cold.id, 1)])
+
+
+@override_settings(POLLS_TRENDING_HALF_LIFE=3600)
+class TrendingTests(TestCase):
+    def setUp(self):
+        self.old = create_question_with_choices("Old favourite?")
+        self.new = create_question_with_choices("New hotness?")
+        self.now = time.time()
+
+    def test_votes_decay_with_half_life(self):
+        board = TrendingBoard()
+        board.add(self.old.id, votes=8, at=self.now - 3 * 3600)
+        board.add(self.new.id, votes=2, at=self.now)
+        board._built_at = time.monotonic()  # keep top() from rebuilding from the database
+        ranked = board.top(10, now=self.now)
+        self.assertEqual([question_id for question_id, _ in ranked], [self.new.id, self.old.id])
+        self.assertAlmostEqual(ranked[0][1], 2)
+        self.assertAlmostEqual(ranked[1][1], 1)
+
+        board.add(self.old.id, votes=2, at=self.now)
+        self.assertEqual([question_id for question_id, _ in board.top(1, now=self.now)], [self.old.id])
+        self.assertEqual(len(board), 2)
+
+    def test_rebase_keeps_scores(self):
+        board = TrendingBoard()
+        board._built_at = time.monotonic()
+        board.add(self.old.id, at=self.now)
+        later = self.now + 600 * 3600
+        board.add(self.new.id, at=later)
+        self.assertEqual(board._epoch, later)
+        self.assertEqual(board.top(1, now=later), [(self.new.id, 1.0)])
+
+    def test_rebuild_from_rollups_and_choices(self):
+        hour = timeseries.bucket_start(timezone.now(), 'hour')
+        red = self.new.choices.get(choice_text="Red")
+        timeseries.write_rollups({(self.new.id, red.id, hour): 4})
+        Choice.objects.filter(pk=red.pk).update(votes=4)
+        # Old votes without rollups count from the question's publication
+        self.old.pub_date = timezone.now() - datetime.timedelta(hours=2)
+        self.old.save()
+        Choice.objects.filter(question=self.old).update(votes=10)
+
+        board = TrendingBoard()
+        board.rebuild()
+        ranked = dict(board.top(10))
+        self.assertAlmostEqual(ranked[self.old.id], 5, delta=0.1)
+        self.assertGreater(ranked[self.new.id], 2.8)
+
+    def test_rebuilds_in_the_background_while_serving_the_old_board(self):
+        board = TrendingBoard()
+        with mock.patch.object(TrendingBoard, 'rebuild') as rebuild:
+            self.assertEqual(board.top(5), [])  # nothing built yet: empty, not blocked
+            board._builder.join()
+        rebuild.assert_called_once_with()
+
+        board.add(self.old.id, at=self.now)
+        board._built_at = time.monotonic()
+        with override_settings(POLLS_TRENDING_REBUILD_INTERVAL=0), \
+                mock.patch.object(TrendingBoard, '_start_rebuild') as start_rebuild:
+            self.assertEqual(board.top(5, now=self.now), [(self.old.id, 1.0)])
+        start_rebuild.assert_called_once_with()
+
+    def test_votes_during_a_rebuild_are_replayed(self):
+        board = TrendingBoard()
+        choices = Choice.objects.filter  # the rebuild reads Choice totals last
+
+        def vote_while_reading(*args, **kwargs):
+            if board._changes == []:
+                board.add(self.new.id, votes=3)  # a vote in this worker mid-rebuild
+            return choices(*args, **kwargs)
+
+        with mock.patch.object(Choice.objects, 'filter', vote_while_reading):
+            board.rebuild()
+        self.assertEqual([question_id for question_id, _ in board.top(5)], [self.new.id])
+
+    def test_votes_update_loaded_board_and_views(self):
+        trending_board.rebuild()
+        red = self.old.choices.get(choice_text="Red")
+        record_vote(red)
+        self.assertEqual(trending_board.top(1)[0][0], self.old.id)
+
+        response = self.client.get(reverse('polls:trending'))
+        self.assertContains(response, "Old favourite?")
+        data = self.client.get(reverse('polls:api_trending'), {'limit': 5}).json()
+        self.assertEqual([question['id'] for question in data['questions']], [self.old.id])
+
+        self.old.is_active = False
+        self.old.save()
+        self.assertEqual(trending_board.top(5), [])
+
+
+class AdminChangelistQueryTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+        self.batch = 0
+
+    def add_rows(self, n):
+        for _ in range(n):
+            self.batch += 1
+            category = Category.objects.create(name=f"Category {self.batch}")
+            tag = Tag.objects.create(name=f"tag-{self.batch}")
+            question = create_question_with_choices(f"Question {self.batch}?")
+            question.category = category
+            question.author = self.admin
+            question.save()
+            Choice.objects.filter(question=question, choice_text="Red").update(votes=self.batch)
+            article = Article.objects.create(
+                title=f"Article {self.batch}", slug=f"article-{self.batch}", content="...",
+                author=self.admin, category=category,
+            )
+            article.tags.add(tag)
+            article.likes.add(self.admin)
+        Question.objects.rebuild_total_votes()
+
+    def changelist(self, model_name, **params):
+        clear_caches()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f'admin:polls_{model_name}_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_changelists_run_a_constant_number_of_queries(self):
+        self.add_rows(2)
+        few = {name: self.changelist(name)[1] for name in ('question', 'choice', 'category', 'tag', 'article')}
+        self.add_rows(10)
+        many = {name: self.changelist(name)[1] for name in few}
+        self.assertEqual(many, few)
+        # session + user, then the changelist itself (counts, filters, rows)
+        self.assertEqual(many, {'question': 6, 'choice': 7, 'category': 5, 'tag': 5, 'article': 7})
+
+    def test_derived_columns_are_annotated_and_sortable(self):
+        self.add_rows(3)
+        Category.objects.create(name="Empty")
+        response, _ = self.changelist('category', o='-6')
+        rows = list(response.context['cl'].result_list)
+        self.assertEqual(rows[-1].name, "Empty")
+        self.assertEqual([row.active_questions for row in rows], [1, 1, 1, 0])
+
+        response, _ = self.changelist('choice', o='-4')
+        top = response.context['cl'].result_list[0]
+        self.assertEqual((top.choice_text, top.vote_share), ("Red", 1.0))
+
+        # Unfolded shard votes count on both sides of the share
+        blue = Choice.objects.filter(choice_text="Blue").first()
+        ChoiceVoteShard.objects.create(choice=blue, shard=0, votes=blue.question.total_votes)
+        response, _ = self.changelist('choice', o='-4')
+        shares = {
+            row.choice_text: row.vote_share
+            for row in response.context['cl'].result_list if row.question_id == blue.question_id
+        }
+        self.assertEqual(shares, {"Red": 0.5, "Blue": 0.5})
+
+        response, _ = self.changelist('tag', o='2')
+        self.assertEqual({row.article_total for row in response.context['cl'].result_list}, {1})
+
+
+class AdminAutocompleteTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+        self.authors = [User.objects.create_user(f'author{n}') for n in range(30)]
+        self.category = Category.objects.create(name="Science")
+        self.question = create_question_with_choices("Who wrote this?")
+        self.question.author = self.authors[3]
+        self.question.category = self.category
+        self.question.save()
+        create_question_with_choices("Anonymous?")
+
+    def test_filters_render_only_the_selected_value(self):
+        url = reverse('admin:polls_question_changelist')
+        response = self.client.get(url)
+        self.assertNotContains(response, 'author29')
+        self.assertContains(response, 'data-field-name="author"')
+        self.assertContains(response, 'polls/admin/autocomplete_filter.js')
+
+        response = self.client.get(url, {'author__id__exact': self.authors[3].pk})
+        self.assertEqual(list(response.context['cl'].result_list), [self.question])
+        self.assertContains(response, f'<option value="{self.authors[3].pk}" selected>author3</option>', html=True)
+        self.assertNotContains(response, 'author4')
+
+    def test_autocomplete_view_pages_matches(self):
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'polls', 'model_name': 'question', 'field_name': 'author', 'term': 'author',
+        })
+        data = response.json()
+        self.assertEqual(len(data['results']), 20)
+        self.assertTrue(data['pagination']['more'])
+
+    def test_change_form_labels_come_from_the_cache(self):
+        url = reverse('admin:polls_question_change', args=[self.question.pk])
+        response = self.client.get(url)
+        self.assertNotContains(response, 'author29')
+        self.assertContains(response, 'Science')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse([q for q in queries if 'FROM "polls_category"' in q['sql']])
+
+    def test_labels_are_forgotten_on_rename(self):
+        self.assertEqual(cached_labels(Category, [self.category.pk]), {str(self.category.pk): "Science"})
+        self.category.name = "Physics"
+        self.category.save()
+        self.assertEqual(cached_labels(Category, [self.category.pk]), {str(self.category.pk): "Physics"})
+        self.assertEqual(cached_labels(Category, ['nope']), {})
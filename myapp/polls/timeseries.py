@@ -0,0 +1,135 @@
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Choice, VoteRollup
+
+# Vote time series
+#
+# Votes are counted per choice in minute, hour and day buckets (VoteRollup,
+# bucket = start of the period in UTC). The vote paths add each vote to a
+# per-worker buffer keyed by (question, choice, minute) (polls.voting
+# RollupBuffer); a flush adds the gathered counts to all three resolutions
+# at once with one UPDATE per (resolution, bucket, increment), so rollups
+# never need a second pass over the minute rows.
+#
+# Fine buckets are kept only as long as POLLS_VOTE_ROLLUP_RETENTION says (in
+# days, None = forever); prune_rollups() runs from the flush at most every
+# POLLS_VOTE_ROLLUP_PRUNE_INTERVAL seconds per worker, or via
+# `manage.py prune_vote_rollups`. vote_series() downsamples by picking the
+# finest resolution that still covers the range within retention and
+# POLLS_VOTE_SERIES_MAX_POINTS buckets.
+
+RESOLUTIONS = (VoteRollup.MINUTE, VoteRollup.HOUR, VoteRollup.DAY)
+STEPS = {
+    VoteRollup.MINUTE: datetime.timedelta(minutes=1),
+    VoteRollup.HOUR: datetime.timedelta(hours=1),
+    VoteRollup.DAY: datetime.timedelta(days=1),
+}
+DEFAULT_RETENTION = {VoteRollup.MINUTE: 2, VoteRollup.HOUR: 90, VoteRollup.DAY: None}
+
+
+def get_retention(resolution):
+    """How long ``resolution`` buckets are kept, as a timedelta (None = forever)"""
+    days = getattr(settings, 'POLLS_VOTE_ROLLUP_RETENTION', DEFAULT_RETENTION).get(resolution)
+    return None if days is None else datetime.timedelta(days=days)
+
+
+def bucket_start(moment, resolution):
+    moment = moment.astimezone(datetime.timezone.utc)
+    if resolution == VoteRollup.MINUTE:
+        return moment.replace(second=0, microsecond=0)
+    if resolution == VoteRollup.HOUR:
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def write_rollups(counts):
+    """Add {(question_id, choice_id, minute): votes} to every resolution; returns votes written"""
+    live_choices = set(
+        Choice.objects.filter(pk__in={choice_id for _, choice_id, _ in counts}).values_list('pk', flat=True)
+    )
+    rows = defaultdict(int)  # (question_id, choice_id, resolution, bucket) -> votes
+    for (question_id, choice_id, minute), votes in counts.items():
+        if choice_id not in live_choices:
+            continue  # deleted since the vote
+        for resolution in RESOLUTIONS:
+            rows[(question_id, choice_id, resolution, bucket_start(minute, resolution))] += votes
+
+    by_increment = defaultdict(list)
+    for (question_id, choice_id, resolution, bucket), votes in rows.items():
+        by_increment[(resolution, bucket, votes)].append(choice_id)
+
+    with transaction.atomic():
+        # Make sure every row exists, then add to it; concurrent flushes from
+        # other workers only ever meet in the UPDATEs
+        VoteRollup.objects.bulk_create(
+            [
+                VoteRollup(question_id=question_id, choice_id=choice_id, resolution=resolution, bucket=bucket)
+                for question_id, choice_id, resolution, bucket in rows
+            ],
+            ignore_conflicts=True,
+            batch_size=500,
+        )
+        for (resolution, bucket, votes), choice_ids in by_increment.items():
+            VoteRollup.objects.filter(
+                resolution=resolution, bucket=bucket, choice_id__in=choice_ids
+            ).update(votes=F('votes') + votes)
+    return sum(counts.values())
+
+
+def prune_rollups(now=None):
+    """Delete buckets older than their resolution's retention; returns rows deleted"""
+    now = now or timezone.now()
+    deleted = 0
+    for resolution in RESOLUTIONS:
+        retention = get_retention(resolution)
+        if retention is not None:
+            cutoff = bucket_start(now - retention, resolution)
+            deleted += VoteRollup.objects.filter(resolution=resolution, bucket__lt=cutoff).delete()[0]
+    return deleted
+
+
+def pick_resolution(start, end, now=None):
+    """The finest resolution whose buckets cover [start, end] within the limits"""
+    now = now or timezone.now()
+    max_points = getattr(settings, 'POLLS_VOTE_SERIES_MAX_POINTS', 720)
+    for resolution in RESOLUTIONS:
+        retention = get_retention(resolution)
+        if retention is not None and start < now - retention:
+            continue
+        if (end - start) / STEPS[resolution] <= max_points:
+            return resolution
+    return VoteRollup.DAY
+
+
+def vote_series(question_id, start, end, resolution=None):
+    """Votes per choice per bucket between ``start`` and ``end``
+
+    Returns (resolution, buckets, {choice_id: [votes per bucket]}); buckets
+    without votes are zero-filled.
+    """
+    resolution = resolution or pick_resolution(start, end)
+    step = STEPS[resolution]
+    first = bucket_start(start, resolution)
+    max_points = getattr(settings, 'POLLS_VOTE_SERIES_MAX_POINTS', 720)
+    buckets = []
+    bucket = first
+    while bucket <= end and len(buckets) < max_points:
+        buckets.append(bucket)
+        bucket += step
+    if not buckets:
+        return resolution, [], {}
+
+    positions = {bucket: index for index, bucket in enumerate(buckets)}
+    series = defaultdict(lambda: [0] * len(buckets))
+    rows = VoteRollup.objects.filter(
+        question_id=question_id, resolution=resolution, bucket__gte=buckets[0], bucket__lte=buckets[-1]
+    ).values_list('choice_id', 'bucket', 'votes')
+    for choice_id, bucket, votes in rows:
+        series[choice_id][positions[bucket]] += votes
+    return resolution, buckets, dict(series)
@@ -0,0 +1,217 @@
+import bisect
+import datetime
+import logging
+import threading
+import time
+from collections import defaultdict
+from functools import partial
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Sum
+
+# Trending leaderboard
+#
+# A question's trending score is its votes with exponential time decay: a
+# vote counts 1 when cast and half as much every POLLS_TRENDING_HALF_LIFE
+# seconds after. Decaying every score on every read would touch all
+# questions, so votes are stored with forward decay instead: a vote at time t
+# adds 2 ** ((t - epoch) / half_life) to its question's weight. Weights never
+# shrink and all share the same factor 2 ** ((epoch - now) / half_life), so
+# their order only changes when a question receives a vote.
+#
+# Each worker keeps the weights in a list sorted by (-weight, id): a vote
+# re-positions one entry with bisect, and the top N is a slice. When weights
+# grow large the epoch moves forward and every weight is rescaled once.
+#
+# The board is built on first use, and again every
+# POLLS_TRENDING_REBUILD_INTERVAL seconds so votes taken by other workers
+# show up. Builds run in one background thread at a time while readers keep
+# the current board (empty until the first build is done); votes and
+# removals this worker sees meanwhile are replayed onto the new board.
+# Votes are read from the hourly VoteRollup buckets (polls.timeseries)
+# within POLLS_TRENDING_HORIZON half-lives. Choice votes with no rollup
+# (cast before rollups were enabled or past retention) count as if cast when
+# the question was published.
+
+REBASE_AFTER = 512  # half-lives between epoch and the latest vote
+MIN_SCORE = 0.01
+
+logger = logging.getLogger(__name__)
+
+
+def get_half_life():
+    return getattr(settings, 'POLLS_TRENDING_HALF_LIFE', 6 * 3600)
+
+
+class TrendingBoard:
+    """Questions ranked by time-decayed votes in this worker"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._epoch = None
+        self._weights = {}  # question_id -> forward-decayed weight
+        self._ranking = []  # sorted (-weight, question_id)
+        self._built_at = None
+        self._builder = None  # background rebuild thread
+        self._changes = None  # adds/removals to replay onto a build in progress
+
+    @property
+    def loaded(self):
+        return self._built_at is not None
+
+    def _weight(self, at):
+        return 2 ** ((at - self._epoch) / get_half_life())
+
+    def _rebase(self, at):
+        factor = 2 ** ((self._epoch - at) / get_half_life())
+        self._weights = {question_id: weight * factor for question_id, weight in self._weights.items()}
+        self._ranking = [(weight * factor, question_id) for weight, question_id in self._ranking]
+        self._epoch = at
+
+    def _set(self, question_id, weight):
+        old = self._weights.get(question_id)
+        if old is not None:
+            index = bisect.bisect_left(self._ranking, (-old, question_id))
+            del self._ranking[index]
+        if weight is None:
+            self._weights.pop(question_id, None)
+        else:
+            self._weights[question_id] = weight
+            bisect.insort(self._ranking, (-weight, question_id))
+
+    def add(self, question_id, votes=1, at=None):
+        """Count ``votes`` for a question cast at ``at`` (a timestamp; default now)"""
+        at = at or time.time()
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append(partial(self.add, question_id, votes, at))
+            if self._epoch is None:
+                self._epoch = at
+            elif (at - self._epoch) / get_half_life() > REBASE_AFTER:
+                self._rebase(at)
+            self._set(question_id, self._weights.get(question_id, 0.0) + votes * self._weight(at))
+
+    def remove(self, question_id):
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append(partial(self.remove, question_id))
+            self._set(question_id, None)
+
+    def top(self, n, now=None):
+        """Up to ``n`` (question_id, score) pairs, score being decayed votes as of ``now``"""
+        self._ensure_fresh()
+        now = now or time.time()
+        with self._lock:
+            if self._epoch is None:
+                return []
+            factor = 2 ** ((self._epoch - now) / get_half_life())
+            return [(question_id, -weight * factor) for weight, question_id in self._ranking[:n]]
+
+    def __len__(self):
+        return len(self._weights)
+
+    # Loading
+
+    def rebuild(self, now=None):
+        """Reload the board from vote rollups and Choice totals"""
+        from .models import Choice, ChoiceVoteShard, VoteRollup
+
+        now = now or time.time()
+        with self._lock:
+            self._changes = []
+        half_life = get_half_life()
+        horizon = now - getattr(settings, 'POLLS_TRENDING_HORIZON', 10) * half_life
+        horizon_dt = datetime.datetime.fromtimestamp(horizon, datetime.timezone.utc)
+
+        def weight(at, votes):
+            return votes * 2 ** ((min(at, now) - now) / half_life)
+
+        weights = defaultdict(float)
+        covered = defaultdict(int)
+        if getattr(settings, 'POLLS_VOTE_ROLLUPS', True):
+            # Votes with a rollup, by hour; credited mid-bucket
+            hourly = (
+                VoteRollup.objects.filter(resolution=VoteRollup.HOUR, bucket__gte=horizon_dt, question__is_active=True)
+                .order_by().values_list('question_id', 'bucket').annotate(total=Sum('votes'))
+            )
+            for question_id, bucket, votes in hourly:
+                weights[question_id] += weight(bucket.timestamp() + 1800, votes)
+            daily = (
+                VoteRollup.objects.filter(resolution=VoteRollup.DAY, question__is_active=True)
+                .order_by().values_list('question_id').annotate(total=Sum('votes'))
+            )
+            covered.update(dict(daily))
+
+        totals = defaultdict(int)
+        published = {}
+        choices = (
+            Choice.objects.filter(question__is_active=True, question__pub_date__gte=horizon_dt)
+            .order_by().values_list('question_id', 'question__pub_date').annotate(total=Sum('votes'))
+        )
+        for question_id, pub_date, votes in choices:
+            totals[question_id] += votes or 0
+            published[question_id] = pub_date
+        shards = (
+            ChoiceVoteShard.objects.filter(choice__question_id__in=list(published))
+            .order_by().values_list('choice__question_id').annotate(total=Sum('votes'))
+        )
+        for question_id, votes in shards:
+            totals[question_id] += votes or 0
+        for question_id, votes in totals.items():
+            uncovered = votes - covered.get(question_id, 0)
+            if uncovered > 0:
+                weights[question_id] += weight(published[question_id].timestamp(), uncovered)
+
+        ranking = sorted((-score, question_id) for question_id, score in weights.items() if score >= MIN_SCORE)
+        with self._lock:
+            changes, self._changes = self._changes or [], None
+            self._epoch = now
+            self._weights = {question_id: -weight for weight, question_id in ranking}
+            self._ranking = ranking
+            self._built_at = time.monotonic()
+            for change in changes:
+                change()
+
+    def _ensure_fresh(self):
+        if not self.loaded or time.monotonic() - self._built_at > getattr(
+            settings, 'POLLS_TRENDING_REBUILD_INTERVAL', 300
+        ):
+            self._start_rebuild()
+
+    def _start_rebuild(self):
+        with self._lock:
+            if self._builder is None or not self._builder.is_alive():
+                self._builder = threading.Thread(target=self._background_rebuild, daemon=True)
+                self._builder.start()
+
+    def _background_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Rebuilding the trending board failed')
+            with self._lock:
+                self._changes = None
+        finally:
+            connection.close()
+
+
+trending_board = TrendingBoard()
+
+
+def trending_questions(limit):
+    """The ``limit`` top trending active questions, each with a ``trending_score``"""
+    from .models import Question
+    from .tallies import with_live_totals
+
+    ranked = trending_board.top(limit)
+    questions = with_live_totals(Question.objects.filter(
+        pk__in=[question_id for question_id, _ in ranked], is_active=True
+    ).select_related('category')).in_bulk()
+    result = []
+    for question_id, score in ranked:
+        question = questions.get(question_id)
+        if question is not None:
+            question.trending_score = score
+            result.append(question)
+    return result
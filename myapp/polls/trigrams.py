@@ -0,0 +1,302 @@
+import array
+import bisect
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+
+from .search import question_documents
+
+# Trigram substring search
+#
+# A pure-Python inverted index from every 3-character sequence of a question's
+# text (question + choices, casefolded) to the ids of the questions containing
+# it. A substring query intersects the postings of its trigrams, smallest
+# first, then confirms each candidate against the stored text, so results are
+# exactly what `icontains` would return.
+#
+# The index is written to POLLS_TRIGRAM_INDEX_PATH in a compact binary layout
+# and memory-mapped, so every worker on a host shares one copy through the
+# page cache:
+#
+#   header   magic, term count, posting count, document count
+#   terms    sorted (trigram as UTF-32, first posting, posting count)
+#   postings question ids (64-bit, as BigAutoField), sorted within each term
+#   docs     sorted (question id, text offset, text length)
+#   texts    UTF-8 document texts
+#
+# Writes in this worker go to an in-memory overlay through model signals.
+# Writes made by other workers show up once the file is rebuilt
+# (`manage.py rebuild_trigram_index`, e.g. at deploy); workers re-map the
+# file when it changes on disk. A worker that finds no usable file starts a
+# rebuild in a background thread and answers None (fall back to icontains)
+# until it is ready, so no request ever waits for a full build.
+
+MAGIC = b'PTRI2' + (b'L' if sys.byteorder == 'little' else b'B') + b'\0\0'
+HEADER = struct.Struct('<8sIII')
+TERM = struct.Struct('<12sII')
+DOC = struct.Struct('<QQI')
+POSTING = 'Q'
+
+logger = logging.getLogger(__name__)
+FIELD_SEPARATOR = '\x00'  # never part of a query, so no trigram spans two fields
+
+
+def normalize(text):
+    return text.casefold()
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def document_text(question_text, choice_texts):
+    return normalize(FIELD_SEPARATOR.join([question_text, *choice_texts]))
+
+
+def encode_term(term):
+    return term.encode('utf-32-le')
+
+
+def write_index_file(path, documents):
+    """Write {question_id: text} to ``path`` atomically"""
+    postings = defaultdict(list)
+    for question_id in sorted(documents):
+        for term in trigrams(documents[question_id]):
+            postings[encode_term(term)].append(question_id)
+
+    terms = sorted(postings)
+    posting_ids = array.array(POSTING)
+    term_table = bytearray()
+    for term in terms:
+        term_table += TERM.pack(term, len(posting_ids), len(postings[term]))
+        posting_ids.extend(postings[term])
+
+    doc_table = bytearray()
+    texts = bytearray()
+    for question_id in sorted(documents):
+        encoded = documents[question_id].encode()
+        doc_table += DOC.pack(question_id, len(texts), len(encoded))
+        texts += encoded
+
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(terms), len(posting_ids), len(documents)))
+        f.write(term_table)
+        f.write(posting_ids.tobytes())
+        f.write(doc_table)
+        f.write(texts)
+    os.replace(tmp_path, path)  # readers keep their old mapping until they re-map
+
+
+class MappedTrigramFile:
+    """Read-only view over an index file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mtime = os.fstat(f.fileno()).st_mtime_ns
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_terms, self.n_postings, self.n_docs = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a trigram index for this platform')
+        self.terms_offset = HEADER.size
+        self.postings_offset = self.terms_offset + self.n_terms * TERM.size
+        self.docs_offset = self.postings_offset + self.n_postings * array.array(POSTING).itemsize
+        self.texts_offset = self.docs_offset + self.n_docs * DOC.size
+        self.postings_view = memoryview(self.mm)[
+            self.postings_offset:self.docs_offset
+        ].cast(POSTING)
+
+    def postings(self, term):
+        """Sorted question ids containing ``term`` (a memoryview, no copy)"""
+        key = encode_term(term)
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = self.terms_offset + mid * TERM.size
+            if self.mm[offset:offset + 12] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_terms:
+            found, start, count = TERM.unpack_from(self.mm, self.terms_offset + lo * TERM.size)
+            if found == key:
+                return self.postings_view[start:start + count]
+        return self.postings_view[0:0]
+
+    def text(self, question_id):
+        lo, hi = 0, self.n_docs
+        while lo < hi:
+            mid = (lo + hi) // 2
+            doc_id, start, length = DOC.unpack_from(self.mm, self.docs_offset + mid * DOC.size)
+            if doc_id < question_id:
+                lo = mid + 1
+            elif doc_id > question_id:
+                hi = mid
+            else:
+                start += self.texts_offset
+                return bytes(self.mm[start:start + length]).decode()
+        return None
+
+    def close(self):
+        try:
+            self.postings_view.release()
+            self.mm.close()
+        except BufferError:
+            pass  # a caller still holds a postings slice; the map closes when it is freed
+
+
+def _contains(sorted_ids, value):
+    index = bisect.bisect_left(sorted_ids, value)
+    return index < len(sorted_ids) and sorted_ids[index] == value
+
+
+class TrigramIndex:
+    """Memory-mapped trigram index plus this worker's pending changes"""
+
+    def __init__(self, path=None):
+        self.path = str(path or getattr(
+            settings, 'POLLS_TRIGRAM_INDEX_PATH', settings.BASE_DIR / 'polls_trigram.idx'
+        ))
+        self._lock = threading.RLock()
+        self._base = None
+        self._builder = None  # background rebuild thread
+        self._reset_overlay()
+
+    def _reset_overlay(self):
+        self._texts = {}  # question_id -> text, for documents changed in this worker
+        self._postings = defaultdict(set)  # trigram -> ids, for those documents only
+        self._shadowed = set()  # ids whose entry in the file is out of date
+
+    # Building and loading
+
+    def rebuild(self, chunk_size=1000):
+        """Scan all questions in chunks, write the index file and map it"""
+        from .models import Question
+
+        documents = {}
+        ids = Question.objects.order_by('pk').values_list('pk', flat=True)
+        chunk = []
+        for question_id in ids.iterator(chunk_size=chunk_size):
+            chunk.append(question_id)
+            if len(chunk) == chunk_size:
+                documents.update(self._load_documents(chunk))
+                chunk = []
+        documents.update(self._load_documents(chunk))
+        write_index_file(self.path, documents)
+        with self._lock:
+            self._map()
+        return len(documents)
+
+    @staticmethod
+    def _load_documents(question_ids):
+        if not question_ids:
+            return {}
+        return {
+            question_id: document_text(text, choices)
+            for question_id, (text, choices) in question_documents(question_ids).items()
+        }
+
+    def _map(self):
+        if self._base is not None:
+            self._base.close()
+        self._base = MappedTrigramFile(self.path)
+        self._reset_overlay()
+
+    def _ensure_loaded(self):
+        """Map the file if it changed; returns False while there is none to map"""
+        with self._lock:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime is not None and (self._base is None or self._base.mtime != mtime):
+                try:
+                    self._map()  # first use, or rebuilt by another process
+                except ValueError:
+                    mtime = None  # written by an older version
+            if mtime is None:
+                self._start_rebuild()
+            return self._base is not None and mtime is not None
+
+    def _start_rebuild(self):
+        if self._builder is None or not self._builder.is_alive():
+            self._builder = threading.Thread(target=self._background_rebuild, daemon=True)
+            self._builder.start()
+
+    def _background_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Building the trigram index at %s failed', self.path)
+        finally:
+            connection.close()
+
+    @property
+    def loaded(self):
+        return self._base is not None
+
+    # Incremental updates
+
+    def update(self, question_ids):
+        """Re-read ``question_ids`` from the database into the overlay"""
+        documents = self._load_documents(list(question_ids))
+        with self._lock:
+            for question_id in question_ids:
+                self._remove_from_overlay(question_id)
+                self._shadowed.add(question_id)
+                text = documents.get(question_id)
+                if text is not None:
+                    self._texts[question_id] = text
+                    for term in trigrams(text):
+                        self._postings[term].add(question_id)
+
+    def remove(self, question_id):
+        with self._lock:
+            self._remove_from_overlay(question_id)
+            self._shadowed.add(question_id)
+
+    def _remove_from_overlay(self, question_id):
+        text = self._texts.pop(question_id, None)
+        if text is not None:
+            for term in trigrams(text):
+                self._postings[term].discard(question_id)
+
+    # Queries
+
+    def search(self, query):
+        """Sorted ids of questions whose text or a choice contains ``query``
+
+        Returns None for queries too short to index (under 3 characters) and
+        while the index file is still being built.
+        """
+        needle = normalize(query)
+        terms = trigrams(needle)
+        if not terms or not self._ensure_loaded():
+            return None
+        with self._lock:
+            matches = set()
+
+            base_lists = sorted((self._base.postings(term) for term in terms), key=len)
+            candidates = base_lists[0] if base_lists else ()
+            for question_id in candidates:
+                if question_id in self._shadowed:
+                    continue
+                if all(_contains(other, question_id) for other in base_lists[1:]):
+                    if needle in self._base.text(question_id):
+                        matches.add(question_id)
+
+            overlay_sets = sorted((self._postings.get(term, set()) for term in terms), key=len)
+            for question_id in set.intersection(*overlay_sets):
+                if needle in self._texts[question_id]:
+                    matches.add(question_id)
+        return sorted(matches)
+
+
+trigram_index = TrigramIndex()
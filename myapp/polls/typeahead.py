@@ -0,0 +1,241 @@
+import bisect
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection
+
+# Typeahead prefix index
+#
+# Each worker keeps, per kind (questions, categories, tags), one sorted list
+# of (key, id) pairs where the keys are the casefolded text starting at every
+# word, cut to KEY_LENGTH characters. A prefix lookup is a bisect to the
+# first key >= prefix followed by a scan that stops after ``limit`` distinct
+# ids, so its cost depends on the limit, not on the number of questions.
+#
+# Freshness:
+#   - writes in this worker update the lists directly (polls.signals)
+#   - every POLLS_TYPEAHEAD_REFRESH_INTERVAL seconds, questions created by
+#     other workers (id above the highest one seen) are added
+#   - every POLLS_TYPEAHEAD_REBUILD_INTERVAL seconds everything is reloaded,
+#     which picks up edits and deletions made elsewhere
+#
+# Loads run in one background thread at a time while requests keep using
+# the previous lists (empty ones until the first load is done); writes made
+# in this worker meanwhile are replayed onto the new lists.
+#
+# Responses are kept in a small per-prefix LRU that any change clears.
+
+KEY_LENGTH = 24
+WORD_START_RE = re.compile(r'\b\w', re.UNICODE)
+WHITESPACE_RE = re.compile(r'\s+')
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text):
+    return WHITESPACE_RE.sub(' ', text).strip().casefold()
+
+
+def prefix_keys(text):
+    """The normalized text from each word start on, cut to KEY_LENGTH"""
+    text = normalize(text)
+    return {text[match.start():match.start() + KEY_LENGTH] for match in WORD_START_RE.finditer(text)}
+
+
+class PrefixIndex:
+    """Sorted word-start keys over one text per id"""
+
+    def __init__(self):
+        self.entries = []  # sorted (key, id)
+        self.items = {}  # id -> (text, payload)
+
+    def load(self, rows):
+        """Replace the contents with ``rows`` of (id, text, payload)"""
+        entries = []
+        items = {}
+        for item_id, text, payload in rows:
+            items[item_id] = (text, payload)
+            entries.extend((key, item_id) for key in prefix_keys(text))
+        entries.sort()
+        self.entries, self.items = entries, items
+
+    def add(self, item_id, text, payload=None):
+        self.remove(item_id)
+        self.items[item_id] = (text, payload)
+        for key in prefix_keys(text):
+            bisect.insort(self.entries, (key, item_id))
+
+    def remove(self, item_id):
+        item = self.items.pop(item_id, None)
+        if item is None:
+            return
+        for key in prefix_keys(item[0]):
+            index = bisect.bisect_left(self.entries, (key, item_id))
+            if index < len(self.entries) and self.entries[index] == (key, item_id):
+                del self.entries[index]
+
+    def search(self, prefix, limit):
+        """Up to ``limit`` (id, text, payload) whose text has a word starting with ``prefix``"""
+        needle = normalize(prefix)
+        prefix = needle[:KEY_LENGTH]
+        found = {}
+        index = bisect.bisect_left(self.entries, (prefix,))
+        while index < len(self.entries) and len(found) < limit:
+            key, item_id = self.entries[index]
+            if not key.startswith(prefix):
+                break
+            if item_id not in found:
+                text, payload = self.items[item_id]
+                # Keys are cut short, so check long prefixes against the text
+                if len(needle) <= KEY_LENGTH or needle in normalize(text):
+                    found[item_id] = (text, payload)
+            index += 1
+        return [(item_id, text, payload) for item_id, (text, payload) in found.items()]
+
+    def __len__(self):
+        return len(self.items)
+
+
+class TypeaheadIndex:
+    """Question, category and tag prefix indexes for this worker"""
+
+    KINDS = ('questions', 'categories', 'tags')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.indexes = {kind: PrefixIndex() for kind in self.KINDS}
+        self._responses = OrderedDict()
+        self._max_question_id = 0
+        self._built_at = None
+        self._refreshed_at = None
+        self._builder = None  # background rebuild thread
+        self._changes = None  # writes to replay onto a load in progress
+
+    @property
+    def loaded(self):
+        return self._built_at is not None
+
+    # Loading
+
+    def rebuild(self, chunk_size=5000):
+        from .models import Question, Category, Tag
+
+        with self._lock:
+            self._changes = []
+        questions = PrefixIndex()
+        question_rows = Question.objects.filter(is_active=True).order_by().values_list('id', 'question_text')
+        questions.load((pk, text, None) for pk, text in question_rows.iterator(chunk_size=chunk_size))
+        categories = PrefixIndex()
+        categories.load(
+            (pk, name, slug)
+            for pk, name, slug in Category.objects.filter(is_active=True).values_list('id', 'name', 'slug')
+        )
+        tags = PrefixIndex()
+        tags.load((pk, name, None) for pk, name in Tag.objects.values_list('id', 'name'))
+
+        now = time.monotonic()
+        with self._lock:
+            indexes = {'questions': questions, 'categories': categories, 'tags': tags}
+            for change in self._changes or ():
+                change(indexes)
+            self.indexes, self._changes = indexes, None
+            self._max_question_id = max(self._max_question_id, max(questions.items, default=0))
+            self._built_at = self._refreshed_at = now
+            self._responses.clear()
+
+    def refresh_new_questions(self):
+        """Add active questions created since the last load (by any worker)"""
+        from .models import Question
+
+        new_rows = list(
+            Question.objects.filter(is_active=True, pk__gt=self._max_question_id)
+            .order_by('pk').values_list('id', 'question_text')
+        )
+        with self._lock:
+            for pk, text in new_rows:
+                self.indexes['questions'].add(pk, text)
+                self._max_question_id = max(self._max_question_id, pk)
+            self._refreshed_at = time.monotonic()
+            if new_rows:
+                self._responses.clear()
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if not self.loaded:
+            self._start_rebuild()
+        elif now - self._built_at > getattr(settings, 'POLLS_TYPEAHEAD_REBUILD_INTERVAL', 3600):
+            self._start_rebuild()
+        elif now - self._refreshed_at > getattr(settings, 'POLLS_TYPEAHEAD_REFRESH_INTERVAL', 30):
+            self.refresh_new_questions()
+
+    def _start_rebuild(self):
+        with self._lock:
+            if self._builder is None or not self._builder.is_alive():
+                self._builder = threading.Thread(target=self._background_rebuild, daemon=True)
+                self._builder.start()
+
+    def _background_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Loading the typeahead index failed')
+            with self._lock:
+                self._changes = None
+        finally:
+            connection.close()
+
+    # Incremental updates (from signals)
+
+    def _apply(self, change):
+        with self._lock:
+            change(self.indexes)
+            if self._changes is not None:
+                self._changes.append(change)
+            self._responses.clear()
+
+    def update_question(self, question):
+        pk, text = question.pk, question.question_text
+        if question.is_active:
+            with self._lock:
+                self._max_question_id = max(self._max_question_id, pk)
+            self._apply(lambda indexes: indexes['questions'].add(pk, text))
+        else:
+            self._apply(lambda indexes: indexes['questions'].remove(pk))
+
+    def update_category(self, category):
+        pk, name, slug = category.pk, category.name, category.slug
+        if category.is_active:
+            self._apply(lambda indexes: indexes['categories'].add(pk, name, slug))
+        else:
+            self._apply(lambda indexes: indexes['categories'].remove(pk))
+
+    def update_tag(self, tag):
+        pk, name = tag.pk, tag.name
+        self._apply(lambda indexes: indexes['tags'].add(pk, name))
+
+    def remove(self, kind, item_id):
+        self._apply(lambda indexes: indexes[kind].remove(item_id))
+
+    # Queries
+
+    def search(self, prefix, limit):
+        """Return {kind: [(id, text, payload), ...]} with up to ``limit`` per kind"""
+        self._ensure_fresh()
+        cache_key = (normalize(prefix), limit)
+        with self._lock:
+            cached = self._responses.get(cache_key)
+            if cached is not None:
+                self._responses.move_to_end(cache_key)
+                return cached
+            results = {kind: self.indexes[kind].search(prefix, limit) for kind in self.KINDS}
+            self._responses[cache_key] = results
+            if len(self._responses) > getattr(settings, 'POLLS_TYPEAHEAD_CACHE_SIZE', 1024):
+                self._responses.popitem(last=False)
+        return results
+
+
+typeahead_index = TypeaheadIndex()
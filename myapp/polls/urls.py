@@ -8,8 +8,11 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('<int:question_id>/', views.detail, name='detail'),
     path('<int:question_id>/results/', views.results, name='results'),
+    path('<int:question_id>/results/stream/', views.results_stream, name='results_stream'),
+    path('<int:question_id>/results/series/', views.results_series, name='results_series'),
     path('<int:question_id>/vote/', views.vote, name='vote'),
     path('<int:question_id>/vote-ajax/', views.vote_ajax, name='vote_ajax'),
+    path('ballot/', views.vote_ballot, name='vote_ballot'),
     
     # Class-based views
     path('questions/', views.QuestionListView.as_view(), name='question_list'),
@@ -24,5 +27,9 @@ urlpatterns = [
     
     # Statistics and API
     path('stats/', views.stats, name='stats'),
+    path('trending/', views.trending, name='trending'),
+    path('api/trending/', views.api_trending, name='api_trending'),
     path('api/questions/', views.api_questions, name='api_questions'),
+    path('api/typeahead/', views.typeahead, name='typeahead'),
+    path('api/analytics/', views.api_analytics, name='api_analytics'),
 ]
@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Version stamps
+#
+# Named counters in a Django cache that writers bump and readers compare
+# against whatever they cached locally. Reading one is a single cache get (no
+# database query), so per-process caches can check freshness on every use.
+# They live in POLLS_VERSION_CACHE; use a shared backend when running several
+# workers, or each worker only sees its own bumps. A bump stores a new clock
+# reading rather than incrementing, because incr is a read-modify-write on
+# backends such as the file cache, and two racing bumps could both store the
+# same successor.
+
+
+def _cache():
+    return caches[getattr(settings, 'POLLS_VERSION_CACHE', 'default')]
+
+
+def _key(name):
+    return f'polls:version:{name}'
+
+
+def get_version(name):
+    cache = _cache()
+    version = cache.get(_key(name))
+    if version is None:
+        # Start from the clock so a lost key can never reissue an old version
+        cache.add(_key(name), time.time_ns(), None)
+        version = cache.get(_key(name))
+    return version
+
+
+def get_versions(names):
+    """Return {name: version} for several stamps in one cache round trip"""
+    names = list(dict.fromkeys(names))
+    found = _cache().get_many([_key(name) for name in names])
+    return {
+        name: found[_key(name)] if _key(name) in found else get_version(name)
+        for name in names
+    }
+
+
+def bump_version(name):
+    """Make everything cached against ``name`` stale"""
+    _cache().set(_key(name), time.time_ns(), None)
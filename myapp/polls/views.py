@@ -1,5 +1,5 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.urls import reverse, reverse_lazy
 from django.views import generic
 from django.views.decorators.http import require_POST
@@ -7,13 +7,30 @@ from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
-from django.db.models import F, Q, Count, Sum
-from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import F, Q, Count
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.http import Http404
+from django.conf import settings
+import datetime
 import json
 
+from asgiref.sync import sync_to_async
+
 from .models import Question, Choice, Category, Article, Tag, Person
+from .voting import record_vote, record_votes
+from .tallies import tally_question, tally_questions, with_live_totals, with_live_votes
+from .live import live_tallies, stream_enabled, tally_event
+from .voters import claim_votes
+from .pagination import KeysetPaginationMixin, paginate
+from .counts import CachedCountPaginator, cached_count
+from .categories import active_categories
+from .typeahead import typeahead_index
+from .statistics import category_statistics, poll_totals
+from .timeseries import RESOLUTIONS, vote_series
+from .sketches import heavy_hitters, observe_vote, observe_votes, unique_voters
+from .trending import trending_questions
 
 # Create your views here.
 
@@ -23,79 +40,154 @@ def index(request):
     search_query = request.GET.get('q', '')
     category_filter = request.GET.get('category', '')
     
-    # Base queryset
-    questions = Question.objects.filter(is_active=True).select_related('author', 'category')
-    
-    # Apply search filter
+    # Base queryset, ranked by relevance when searching, with hits per
+    # category counted before the category filter narrows them down
+    category_facets = []
     if search_query:
-        questions = questions.filter(
-            Q(question_text__icontains=search_query) |
-            Q(choices__choice_text__icontains=search_query)
-        ).distinct()
+        questions, facets = Question.objects.faceted_search(search_query, is_active=True)
+        category_facets = sorted(
+            (
+                (category, facets['category'][category.id])
+                for category in active_categories() if category.id in facets['category']
+            ),
+            key=lambda facet: -facet[1],
+        )
+    else:
+        questions = Question.objects.order_by('-pub_date').filter(is_active=True)
+    questions = with_live_totals(questions.select_related('author', 'category'))
     
     # Apply category filter
     if category_filter:
         questions = questions.filter(category__slug=category_filter)
     
-    # Order by publication date
-    questions = questions.order_by('-pub_date')
-    
-    # Pagination
-    paginator = Paginator(questions, 5)  # Show 5 questions per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Pagination: relevance-ranked search results are numbered pages,
+    # the newest-first listing seeks by cursor (see polls.pagination)
+    if search_query:
+        page_obj = CachedCountPaginator(questions, 5).get_page(request.GET.get('page'))
+    else:
+        page_obj = paginate(request, questions, 5)  # Show 5 questions per page
     
     # Get categories for filter dropdown
-    categories = Category.objects.filter(is_active=True)
+    categories = active_categories()
     
     context = {
         'page_obj': page_obj,
         'categories': categories,
         'search_query': search_query,
         'category_filter': category_filter,
-        'total_questions': paginator.count,
+        'category_facets': category_facets,
+        'total_questions': cached_count(questions),
     }
     return render(request, 'polls/index.html', context)
 
 
+def detail_context(question, **extra):
+    """Context for detail.html
+
+    Its fragments are cached under the question's stamps whichever view
+    renders it, so every render (error replies from ``vote`` included) must
+    pass the full data.
+    """
+    # Counts include votes still held in shard rows (see polls.voting)
+    if not hasattr(question, 'live_total_votes'):
+        question = with_live_totals(Question.objects).get(pk=question.pk)
+    return {
+        'question': question,
+        'choices': with_live_votes(question.choices.all()),
+        'total_votes': question.live_total_votes,
+        **extra,
+    }
+
+
 def detail(request, question_id):
     """Display a specific question and its choices"""
-    question = get_object_or_404(Question, pk=question_id, is_active=True)
+    question = get_object_or_404(with_live_totals(Question.objects), pk=question_id, is_active=True)
     
     # Increment views count (if you add a views field)
     # Question.objects.filter(pk=question_id).update(views=F('views') + 1)
     
-    context = {
-        'question': question,
-        'choices': question.choices.all(),
-        'total_votes': question.total_votes(),
-    }
-    return render(request, 'polls/detail.html', context)
+    return render(request, 'polls/detail.html', detail_context(question))
 
 
 def results(request, question_id):
     """Display voting results for a question"""
-    question = get_object_or_404(Question, pk=question_id)
-    
-    # Get choices with vote percentages
-    choices_with_percentages = []
-    total_votes = question.total_votes()
+    question = get_object_or_404(
+        Question.objects.select_related('author', 'category'), pk=question_id
+    )
     
-    for choice in question.choices.all():
-        percentage = choice.vote_percentage()
-        choices_with_percentages.append({
-            'choice': choice,
-            'percentage': percentage,
-        })
+    # Votes and percentages for every choice in a single query
+    tally = tally_question(question.id)
     
     context = {
         'question': question,
-        'choices_with_percentages': choices_with_percentages,
-        'total_votes': total_votes,
+        'choices_with_percentages': tally['choices'],
+        'total_votes': tally['total_votes'],
+        'live_stream': stream_enabled(request),
     }
     return render(request, 'polls/results.html', context)
 
 
+def results_series(request, question_id):
+    """Votes per choice over time as JSON for the results chart
+
+    ``start`` / ``end`` are ISO 8601 datetimes (default: the last hour);
+    ``resolution`` (minute, hour, day) is picked from the range when omitted.
+    """
+    question = get_object_or_404(Question, pk=question_id)
+    end = request.GET.get('end')
+    start = request.GET.get('start')
+    resolution = request.GET.get('resolution') or None
+    try:
+        end = parse_datetime(end) if end else timezone.now()
+        start = parse_datetime(start) if start else end and end - datetime.timedelta(hours=1)
+    except ValueError:
+        start = end = None
+    if start is None or end is None:
+        return JsonResponse({'error': 'Invalid time range'}, status=400)
+    if timezone.is_naive(start):
+        start = timezone.make_aware(start)
+    if timezone.is_naive(end):
+        end = timezone.make_aware(end)
+    if start > end:
+        return JsonResponse({'error': 'Invalid time range'}, status=400)
+    if resolution is not None and resolution not in RESOLUTIONS:
+        return JsonResponse({'error': 'Invalid resolution'}, status=400)
+    
+    resolution, buckets, series = vote_series(question.id, start, end, resolution)
+    return JsonResponse({
+        'question_id': question.id,
+        'resolution': resolution,
+        'buckets': [bucket.isoformat() for bucket in buckets],
+        'choices': [
+            {'id': pk, 'text': text, 'votes': series.get(pk, [0] * len(buckets))}
+            for pk, text in question.choices.order_by('id').values_list('id', 'choice_text')
+        ],
+    })
+
+
+async def results_stream(request, question_id):
+    """Stream live tally updates for a question as server-sent events
+
+    Outside ASGI (see polls.live) the reply is one snapshot event and the
+    connection closes, so no worker is held by an open page.
+    """
+    if not await Question.objects.filter(pk=question_id).aexists():
+        raise Http404("Question does not exist")
+    
+    if not stream_enabled(request):
+        snapshot = await sync_to_async(tally_question)(question_id)
+        response = HttpResponse(tally_event(snapshot), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        return response
+    
+    response = StreamingHttpResponse(
+        live_tallies.stream(question_id), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+    return response
+
+
 @require_POST
 def vote(request, question_id):
     """Handle voting for a question"""
@@ -105,16 +197,19 @@ def vote(request, question_id):
         selected_choice = question.choices.get(pk=request.POST['choice'])
     except (KeyError, Choice.DoesNotExist):
         # Redisplay the question voting form with error message
-        context = {
-            'question': question,
-            'error_message': "You didn't select a choice.",
-        }
+        context = detail_context(question, error_message="You didn't select a choice.")
         return render(request, 'polls/detail.html', context)
     else:
-        # Increment vote count using F() to avoid race conditions
-        selected_choice.votes = F('votes') + 1
-        selected_choice.save()
-        selected_choice.refresh_from_db()  # Get updated value
+        with transaction.atomic():
+            # Reject repeat voters before counting anything
+            if claim_votes(request, [question.id]):
+                context = detail_context(question, error_message="You have already voted on this question.")
+                return render(request, 'polls/detail.html', context)
+            
+            # Increment vote count (strict UPDATE or write-behind buffer)
+            record_vote(selected_choice)
+        observe_vote(request, question)
+        live_tallies.notify(question.id)
         
         messages.success(request, f'Your vote for "{selected_choice.choice_text}" has been recorded!')
         
@@ -135,38 +230,103 @@ def vote_ajax(request, question_id):
         choice_id = data.get('choice_id')
         
         question = get_object_or_404(Question, pk=question_id)
-        choice = get_object_or_404(Choice, pk=choice_id, question=question)
+        choice = get_object_or_404(question.choices, pk=choice_id)
         
-        # Update vote count
-        choice.votes = F('votes') + 1
-        choice.save()
-        choice.refresh_from_db()
+        with transaction.atomic():
+            if claim_votes(request, [question.id]):
+                return JsonResponse({'error': 'You have already voted on this question.'}, status=409)
+            
+            # Update vote count
+            record_vote(choice)
+        observe_vote(request, question)
+        live_tallies.notify(question.id)
         
         # Return updated vote counts
-        choices_data = []
-        total_votes = question.total_votes()
-        
-        for c in question.choices.all():
-            choices_data.append({
-                'id': c.id,
-                'text': c.choice_text,
-                'votes': c.votes,
-                'percentage': c.vote_percentage(),
-            })
+        tally = tally_question(question.id)
         
         return JsonResponse({
             'success': True,
             'message': f'Vote recorded for "{choice.choice_text}"',
-            'choices': choices_data,
-            'total_votes': total_votes,
+            'choices': tally['choices'],
+            'total_votes': tally['total_votes'],
         })
         
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=400)
 
 
+@csrf_exempt
+@require_POST
+def vote_ballot(request):
+    """Handle a batch of AJAX votes for many questions at once"""
+    if not request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    
+    try:
+        data = json.loads(request.body)
+        ballot = [
+            (int(item['question_id']), int(item['choice_id']))
+            for item in data.get('votes', [])
+        ]
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return JsonResponse({'error': 'Invalid ballot'}, status=400)
+    
+    max_votes = getattr(settings, 'POLLS_BALLOT_MAX_VOTES', 50)
+    if not ballot:
+        return JsonResponse({'error': 'Ballot is empty'}, status=400)
+    if len(ballot) > max_votes:
+        return JsonResponse({'error': f'A ballot may contain at most {max_votes} votes'}, status=400)
+    question_ids = [question_id for question_id, choice_id in ballot]
+    if len(set(question_ids)) != len(question_ids):
+        return JsonResponse({'error': 'Only one vote per question is allowed'}, status=400)
+    
+    # Check every (question, choice) pair with a single query
+    choices = {
+        choice_id: (question_id, vote_shards, category_id)
+        for choice_id, question_id, vote_shards, category_id in Choice.objects.filter(
+            pk__in=[choice_id for question_id, choice_id in ballot]
+        ).order_by().values_list('id', 'question_id', 'question__vote_shards', 'question__category_id')
+    }
+    invalid = [
+        {'question_id': question_id, 'choice_id': choice_id}
+        for question_id, choice_id in ballot
+        if choices.get(choice_id, (None,))[0] != question_id
+    ]
+    if invalid:
+        return JsonResponse({'error': 'Invalid choice', 'invalid': invalid}, status=400)
+    
+    # Apply all increments in one transaction with grouped UPDATEs
+    with transaction.atomic():
+        already_voted = claim_votes(request, question_ids)
+        if already_voted:
+            return JsonResponse({
+                'error': 'You have already voted on some of these questions.',
+                'already_voted': sorted(already_voted),
+            }, status=409)
+        record_votes([
+            (question_id, choice_id, choices[choice_id][1])
+            for question_id, choice_id in ballot
+        ])
+    for question_id in question_ids:
+        live_tallies.notify(question_id)
+    observe_votes(request, {question_id: choices[choice_id][2] for question_id, choice_id in ballot})
+    
+    # Return updated tallies for every affected question
+    tallies = tally_questions(question_ids)
+    return JsonResponse({
+        'success': True,
+        'questions': [
+            {
+                'id': question_id,
+                'choices': tallies[question_id]['choices'],
+                'total_votes': tallies[question_id]['total_votes'],
+            } for question_id in question_ids
+        ],
+    })
+
+
 # Class-based Views
-class QuestionListView(generic.ListView):
+class QuestionListView(KeysetPaginationMixin, generic.ListView):
     """Class-based view for listing questions"""
     model = Question
     template_name = 'polls/question_list.html'
@@ -178,7 +338,7 @@ class QuestionListView(generic.ListView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.filter(is_active=True)
+        context['categories'] = active_categories()
         return context
 
 
@@ -221,11 +381,7 @@ class CategoryDetailView(generic.DetailView):
         ).select_related('author').order_by('-pub_date')
         
         # Pagination
-        paginator = Paginator(questions, 10)
-        page_number = self.request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
-        
-        context['page_obj'] = page_obj
+        context['page_obj'] = paginate(self.request, questions, 10)
         return context
 
 
@@ -277,51 +433,133 @@ class QuestionDeleteView(LoginRequiredMixin, generic.DeleteView):
 # API-like Views
 def api_questions(request):
     """Return questions as JSON"""
-    questions = Question.objects.filter(is_active=True).select_related('author', 'category')
+    questions = list(
+        Question.objects.filter(is_active=True).select_related('author', 'category')[:20]  # Limit to 20 questions
+    )
+    tallies = tally_questions(question.id for question in questions)
     
     data = []
-    for question in questions[:20]:  # Limit to 20 questions
+    for question in questions:
+        tally = tallies[question.id]
         data.append({
             'id': question.id,
             'text': question.question_text,
             'pub_date': question.pub_date.isoformat(),
             'author': question.author.username if question.author else None,
             'category': question.category.name if question.category else None,
-            'total_votes': question.total_votes(),
+            'total_votes': tally['total_votes'],
             'choices': [
                 {
-                    'id': choice.id,
-                    'text': choice.choice_text,
-                    'votes': choice.votes,
-                } for choice in question.choices.all()
+                    'id': choice['id'],
+                    'text': choice['text'],
+                    'votes': choice['votes'],
+                } for choice in tally['choices']
             ]
         })
     
     return JsonResponse({'questions': data})
 
 
+def api_analytics(request):
+    """Approximate vote analytics from the shared sketches (polls.sketches)"""
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), getattr(settings, 'POLLS_HEAVY_HITTERS', 20))
+    except ValueError:
+        limit = 10
+    hitters = heavy_hitters(limit)
+    question_ids = [question_id for question_id, _ in hitters]
+    texts = dict(Question.objects.filter(pk__in=question_ids).values_list('id', 'question_text'))
+    question_voters = unique_voters('question', question_ids)
+    categories = active_categories()
+    category_voters = unique_voters('category', [category.id for category in categories])
+    
+    return JsonResponse({
+        'heavy_hitters': [
+            {
+                'id': question_id,
+                'text': texts[question_id],
+                'votes': votes,
+                'unique_voters': question_voters[question_id],
+            }
+            for question_id, votes in hitters if question_id in texts
+        ],
+        'categories': [
+            {'id': category.id, 'name': category.name, 'unique_voters': category_voters[category.id]}
+            for category in categories
+        ],
+    })
+
+
+def typeahead(request):
+    """Prefix suggestions for the search box from the in-memory typeahead index"""
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(int(request.GET.get('limit', 8)), getattr(settings, 'POLLS_TYPEAHEAD_MAX_LIMIT', 20))
+    except ValueError:
+        limit = 8
+    if len(query) < getattr(settings, 'POLLS_TYPEAHEAD_MIN_LENGTH', 2) or limit < 1:
+        return JsonResponse({'query': query, 'questions': [], 'categories': [], 'tags': []})
+    
+    results = typeahead_index.search(query, limit)
+    return JsonResponse({
+        'query': query,
+        'questions': [
+            {'id': pk, 'text': text, 'url': reverse('polls:detail', args=(pk,))}
+            for pk, text, _ in results['questions']
+        ],
+        'categories': [
+            {'id': pk, 'name': name, 'url': reverse('polls:category_detail', args=(slug,))}
+            for pk, name, slug in results['categories']
+        ],
+        'tags': [{'id': pk, 'name': name} for pk, name, _ in results['tags']],
+    })
+
+
+def trending(request):
+    """Questions ranked by time-decayed votes"""
+    questions = trending_questions(getattr(settings, 'POLLS_TRENDING_PAGE_SIZE', 20))
+    return render(request, 'polls/trending.html', {
+        'questions': questions,
+        'half_life_hours': getattr(settings, 'POLLS_TRENDING_HALF_LIFE', 6 * 3600) / 3600,
+    })
+
+
+def api_trending(request):
+    """Top trending questions as JSON"""
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), getattr(settings, 'POLLS_TRENDING_MAX_LIMIT', 50))
+    except ValueError:
+        limit = 10
+    return JsonResponse({
+        'questions': [
+            {
+                'id': question.id,
+                'text': question.question_text,
+                'category': question.category.name if question.category else None,
+                'score': round(question.trending_score, 3),
+                'total_votes': question.live_total_votes,
+                'url': reverse('polls:detail', args=(question.id,)),
+            }
+            for question in trending_questions(limit)
+        ],
+    })
+
+
 # Statistics View
 def stats(request):
     """Display polling statistics"""
-    total_questions = Question.objects.filter(is_active=True).count()
-    total_votes = Choice.objects.aggregate(total=Sum('votes'))['total'] or 0
-    total_categories = Category.objects.filter(is_active=True).count()
+    # Totals and per-category counts are materialized (polls.statistics)
+    totals = poll_totals()
     
     # Recent activity
-    recent_questions = Question.objects.filter(is_active=True).order_by('-pub_date')[:5]
-    
-    # Category statistics
-    category_stats = Category.objects.filter(is_active=True).annotate(
-        question_count=Count('question', filter=Q(question__is_active=True)),
-        total_votes=Sum('question__choices__votes', filter=Q(question__is_active=True))
-    ).order_by('-question_count')
+    recent_questions = list(with_live_totals(Question.objects.filter(is_active=True)).order_by('-pub_date')[:5])
     
     context = {
-        'total_questions': total_questions,
-        'total_votes': total_votes,
-        'total_categories': total_categories,
+        'total_questions': totals.question_count,
+        'total_votes': totals.total_votes,
+        'total_categories': totals.category_count,
         'recent_questions': recent_questions,
-        'category_stats': category_stats,
+        'category_stats': category_statistics(),
     }
     
     return render(request, 'polls/stats.html', context)
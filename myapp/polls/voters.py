@@ -0,0 +1,175 @@
+import hashlib
+import logging
+import math
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+
+from .models import VoterRecord
+
+# Duplicate-vote guard
+#
+# VoterRecord (unique on question + voter) is the source of truth. In front of
+# it every worker keeps a Bloom filter of (question, voter) pairs it knows
+# about, so the common "first vote" case costs only the INSERT that records
+# it. A Bloom hit is confirmed against the ledger, since it may be a false
+# positive; a vote recorded by another worker is caught by the unique
+# constraint. The filter is built from the ledger in chunks by a background
+# thread started on first use (one build at a time); until it is ready every
+# claim checks the ledger directly, and claims made during the build are
+# replayed onto the new filter.
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings"""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing: k positions derived from one 128-bit digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+
+def get_voter_key(request):
+    """Stable, hashed identity for the user (or anonymous session) behind a request"""
+    if request.user.is_authenticated:
+        identity = f'user:{request.user.pk}'
+    else:
+        if not request.session.session_key:
+            request.session.save()
+        identity = f'session:{request.session.session_key}'
+    return hashlib.sha256(identity.encode()).hexdigest()[:32]
+
+
+def one_vote_per_voter():
+    return getattr(settings, 'POLLS_ONE_VOTE_PER_VOTER', False)
+
+
+class VoterGuard:
+    """Per-process membership index in front of the VoterRecord ledger"""
+
+    def __init__(self, capacity=None, error_rate=None):
+        self.capacity = capacity or getattr(settings, 'POLLS_VOTER_BLOOM_CAPACITY', 1000000)
+        self.error_rate = error_rate or getattr(settings, 'POLLS_VOTER_BLOOM_ERROR_RATE', 0.01)
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._builder = None  # background rebuild thread
+        self._changes = None  # members claimed while a rebuild is in progress
+
+    @staticmethod
+    def _member(question_id, voter_key):
+        return f'{question_id}:{voter_key}'
+
+    def rebuild(self, chunk_size=10000):
+        """Reload the filter from the ledger, streaming it in chunks"""
+        with self._lock:
+            self._changes = []
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        records = VoterRecord.objects.order_by().values_list('question_id', 'voter_key')
+        for question_id, voter_key in records.iterator(chunk_size=chunk_size):
+            bloom.add(self._member(question_id, voter_key))
+        with self._lock:
+            for member in self._changes or ():
+                bloom.add(member)
+            self._bloom, self._changes = bloom, None
+
+    def _get_bloom(self):
+        """The filter, or None (and a build started) while it is not built yet"""
+        if self._bloom is None:
+            self._start_rebuild()
+        return self._bloom
+
+    def _start_rebuild(self):
+        with self._lock:
+            building = self._changes is not None or (self._builder is not None and self._builder.is_alive())
+            if not building:
+                self._builder = threading.Thread(target=self._background_rebuild, daemon=True)
+                self._builder.start()
+
+    def _background_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Building the voter Bloom filter failed')
+            with self._lock:
+                self._changes = None
+        finally:
+            connection.close()
+
+    def claim(self, voter_key, question_ids):
+        """Record ``voter_key`` on each question, or return the ids already voted on
+
+        Nothing is recorded when the returned set is non-empty.
+        """
+        question_ids = list(question_ids)
+        bloom = self._get_bloom()
+
+        # Without a filter yet, every question is a "maybe"
+        maybe_voted = [
+            question_id for question_id in question_ids
+            if bloom is None or self._member(question_id, voter_key) in bloom
+        ]
+        if maybe_voted:
+            already_voted = set(
+                VoterRecord.objects.filter(
+                    voter_key=voter_key, question_id__in=maybe_voted
+                ).values_list('question_id', flat=True)
+            )
+            if already_voted:
+                return already_voted
+
+        try:
+            with transaction.atomic():
+                VoterRecord.objects.bulk_create([
+                    VoterRecord(question_id=question_id, voter_key=voter_key)
+                    for question_id in question_ids
+                ])
+        except IntegrityError:
+            # Recorded by another worker since our filter was built
+            return set(
+                VoterRecord.objects.filter(
+                    voter_key=voter_key, question_id__in=question_ids
+                ).values_list('question_id', flat=True)
+            )
+
+        with self._lock:
+            for question_id in question_ids:
+                member = self._member(question_id, voter_key)
+                if self._changes is not None:
+                    self._changes.append(member)
+                if self._bloom is not None:
+                    self._bloom.add(member)
+        return set()
+
+
+voter_guard = VoterGuard()
+
+
+def claim_votes(request, question_ids):
+    """Return the question ids this request's voter has already voted on
+
+    Records the voter on every question when none were voted on yet. Always
+    empty when POLLS_ONE_VOTE_PER_VOTER is off.
+    """
+    if not one_vote_per_voter():
+        return set()
+    return voter_guard.claim(get_voter_key(request), question_ids)
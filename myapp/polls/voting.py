@@ -0,0 +1,509 @@
+import atexit
+import random
+import threading
+import time
+from collections import defaultdict
+from functools import partial
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models import F, Count, Max
+from django.utils import timezone
+
+from .models import Question, Choice, ChoiceVoteShard, VoteEvent, VoteTallyCheckpoint
+from .fragments import touch_questions
+from . import statistics
+from .timeseries import bucket_start, prune_rollups, write_rollups
+from .trending import trending_board
+
+# Vote recording
+#
+# POLLS_VOTE_MODE = 'strict'    -> every vote is a single UPDATE ... SET votes = votes + 1
+# POLLS_VOTE_MODE = 'buffered'  -> votes are gathered in memory per worker and
+#                                  flushed in batched UPDATEs on a size/time threshold
+# POLLS_VOTE_MODE = 'event_log' -> every vote is appended to the VoteEvent log
+#                                  (batched inserts, same thresholds) and the
+#                                  counters are materialized from the log
+#
+# All modes keep Question.total_votes in step with Choice.votes.
+#
+# In strict mode a question with vote_shards > 1 writes each vote to one of N
+# ChoiceVoteShard rows picked at random instead of the single Choice row, so
+# concurrent voters on a hot poll don't queue on one row lock. Live counts are
+# Choice.votes + SUM(shards); fold_vote_shards() moves shard counts back into
+# Choice.votes and Question.total_votes. Sharded votes leave Question.total_votes
+# alone too (it would be another hot row), so readers add the shard sums
+# (polls.tallies with_live_totals / with_live_votes); fragments are touched
+# either way.
+#
+# Every path also adds its votes to the materialized totals (polls.statistics).
+# Those are a few rows that every vote would lock, so votes only reach them
+# in batches: buffered and event_log flushes apply their batch's totals in
+# the flush transaction, and strict votes are queued in statistics_buffer
+# once their transaction commits and written every
+# POLLS_STATISTICS_BUFFER_INTERVAL seconds (or BUFFER_SIZE votes). When
+# POLLS_VOTE_ROLLUPS is on, votes also go to the per-minute time series
+# buffer (polls.timeseries), and to this worker's trending leaderboard
+# (polls.trending) once that is loaded.
+
+STRICT = 'strict'
+BUFFERED = 'buffered'
+EVENT_LOG = 'event_log'
+
+
+def get_vote_mode():
+    return getattr(settings, 'POLLS_VOTE_MODE', STRICT)
+
+
+def apply_vote_increments(increments):
+    """Add {(question_id, choice_id): n} to Choice.votes and Question.total_votes
+
+    Returns {question_id: votes added} for the caller to count in the
+    materialized statistics.
+    """
+    # Group rows sharing the same increment so a storm on a few hot choices
+    # collapses into a handful of UPDATE statements
+    choices_by_count = defaultdict(list)
+    question_totals = defaultdict(int)
+    for (question_id, choice_id), count in increments.items():
+        choices_by_count[count].append(choice_id)
+        question_totals[question_id] += count
+    questions_by_count = defaultdict(list)
+    for question_id, count in question_totals.items():
+        questions_by_count[count].append(question_id)
+
+    for count, choice_ids in choices_by_count.items():
+        Choice.objects.filter(pk__in=choice_ids).update(votes=F('votes') + count)
+    for count, question_ids in questions_by_count.items():
+        Question.objects.filter(pk__in=question_ids).update(total_votes=F('total_votes') + count)
+    touch_questions(question_totals)
+    return question_totals
+
+
+class VoteBuffer:
+    """Per-process write-behind buffer for Choice.votes increments"""
+
+    def __init__(self, max_pending=None, flush_interval=None):
+        self.max_pending = max_pending or getattr(settings, 'POLLS_VOTE_BUFFER_SIZE', 100)
+        self.flush_interval = flush_interval or getattr(settings, 'POLLS_VOTE_BUFFER_INTERVAL', 2.0)
+        self._lock = threading.Lock()
+        self._pending = self._new_batch()
+        self._pending_total = 0
+        self._last_flush = time.monotonic()
+        self._timer = None
+
+    def add(self, question_id, choice_id, count=1):
+        """Queue an increment and flush if a threshold has been reached
+
+        The flush waits for the caller's transaction (if any) to commit: run
+        inside it, a rollback would undo the write of a batch that has
+        already left the buffer.
+        """
+        with self._lock:
+            self._collect(self._pending, question_id, choice_id, count)
+            self._pending_total += count
+            due = (
+                self._pending_total >= self.max_pending
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+            if not due:
+                self._schedule()
+        if due:
+            transaction.on_commit(self.flush, robust=True)
+
+    def pending(self, choice_ids=None):
+        """Return {choice_id: increment} for votes not yet written"""
+        with self._lock:
+            return {
+                choice_id: count
+                for (question_id, choice_id), count in self._pending.items()
+                if choice_ids is None or choice_id in choice_ids
+            }
+
+    def flush(self):
+        """Write all pending votes; returns the number of votes written"""
+        with self._lock:
+            batch, self._pending = self._pending, self._new_batch()
+            self._pending_total = 0
+            self._last_flush = time.monotonic()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not batch:
+            return 0
+
+        try:
+            written = self._write(batch)
+        except Exception:
+            # Put the votes back so they are retried on the next flush
+            with self._lock:
+                self._pending_total += self._restore(self._pending, batch)
+            raise
+        self._after_write(batch)
+        return written
+
+    def _new_batch(self):
+        return defaultdict(int)  # (question_id, choice_id) -> increment
+
+    def _collect(self, batch, question_id, choice_id, count):
+        batch[(question_id, choice_id)] += count
+
+    def _restore(self, pending, batch):
+        for key, count in batch.items():
+            pending[key] += count
+        return sum(batch.values())
+
+    def _write(self, batch):
+        with transaction.atomic():
+            statistics.add_votes(apply_vote_increments(batch))
+        return sum(batch.values())
+
+    def _after_write(self, batch):
+        pass
+
+    def _schedule(self):
+        # Make sure an idle buffer still gets written within flush_interval
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self._timed_flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_flush(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+
+class VoteEventBuffer(VoteBuffer):
+    """Write-behind buffer that appends VoteEvent rows with batched inserts"""
+
+    def pending(self, choice_ids=None):
+        with self._lock:
+            counts = defaultdict(int)
+            for question_id, choice_id, created_at in self._pending:
+                if choice_ids is None or choice_id in choice_ids:
+                    counts[choice_id] += 1
+            return dict(counts)
+
+    def _new_batch(self):
+        return []  # (question_id, choice_id, created_at)
+
+    def _collect(self, batch, question_id, choice_id, count):
+        now = timezone.now()
+        batch.extend([(question_id, choice_id, now)] * count)
+
+    def _restore(self, pending, batch):
+        pending[:0] = batch
+        return len(batch)
+
+    def _write(self, batch):
+        return append_vote_events(batch)
+
+    def _after_write(self, batch):
+        # The events are safely stored; fold them into the counters now. If
+        # this fails, the next flush or `manage.py materialize_vote_events`
+        # picks them up from the high-water mark.
+        materialize_vote_events()
+
+
+class RollupBuffer(VoteBuffer):
+    """Per-process buffer of per-minute vote counts for the time series (polls.timeseries)"""
+
+    def __init__(self, max_pending=None, flush_interval=None):
+        super().__init__(
+            max_pending or getattr(settings, 'POLLS_VOTE_ROLLUP_BUFFER_SIZE', 1000),
+            flush_interval or getattr(settings, 'POLLS_VOTE_ROLLUP_INTERVAL', 10.0),
+        )
+        self._last_prune = None
+
+    def pending(self, choice_ids=None):
+        with self._lock:
+            counts = defaultdict(int)
+            for (question_id, choice_id, minute), count in self._pending.items():
+                if choice_ids is None or choice_id in choice_ids:
+                    counts[choice_id] += count
+            return dict(counts)
+
+    def _collect(self, batch, question_id, choice_id, count):
+        batch[(question_id, choice_id, bucket_start(timezone.now(), 'minute'))] += count
+
+    def _write(self, batch):
+        return write_rollups(batch)
+
+    def _after_write(self, batch):
+        now = time.monotonic()
+        interval = getattr(settings, 'POLLS_VOTE_ROLLUP_PRUNE_INTERVAL', 3600)
+        if self._last_prune is None or now - self._last_prune >= interval:
+            self._last_prune = now
+            prune_rollups()
+
+
+class StatisticsBuffer(VoteBuffer):
+    """Per-process buffer of committed strict-mode votes for the materialized statistics"""
+
+    def __init__(self, max_pending=None, flush_interval=None):
+        super().__init__(
+            max_pending or getattr(settings, 'POLLS_STATISTICS_BUFFER_SIZE', 1000),
+            flush_interval or getattr(settings, 'POLLS_STATISTICS_BUFFER_INTERVAL', 5.0),
+        )
+
+    def pending(self, choice_ids=None):
+        return {}  # the counters themselves are already written
+
+    def _collect(self, batch, question_id, choice_id, count):
+        batch[question_id] += count
+
+    def _write(self, batch):
+        with transaction.atomic():
+            # Already in Choice.votes, so subtracted if the question was deleted since
+            statistics.add_votes(batch, written=True)
+        return sum(batch.values())
+
+
+vote_buffer = VoteBuffer()
+vote_event_buffer = VoteEventBuffer()
+vote_rollups = RollupBuffer()
+statistics_buffer = StatisticsBuffer()
+
+# Guaranteed flush when the worker shuts down
+atexit.register(vote_buffer.flush)
+atexit.register(vote_event_buffer.flush)
+atexit.register(vote_rollups.flush)
+atexit.register(statistics_buffer.flush)
+
+
+def rollups_enabled():
+    return getattr(settings, 'POLLS_VOTE_ROLLUPS', True)
+
+
+def record_vote(choice):
+    """Count one vote for ``choice`` using the configured vote mode"""
+    mode = get_vote_mode()
+    if mode == BUFFERED:
+        vote_buffer.add(choice.question_id, choice.pk)
+    elif mode == EVENT_LOG:
+        vote_event_buffer.add(choice.question_id, choice.pk)
+    else:
+        question = choice.question
+        with transaction.atomic():
+            if question.vote_shards > 1:
+                record_sharded_vote(choice.pk, question.vote_shards)
+            else:
+                Choice.objects.filter(pk=choice.pk).update(votes=F('votes') + 1)
+                Question.objects.filter(pk=question.pk).update(total_votes=F('total_votes') + 1)
+            transaction.on_commit(partial(statistics_buffer.add, question.pk, choice.pk))
+        touch_questions([question.pk])
+    if rollups_enabled():
+        vote_rollups.add(choice.question_id, choice.pk)
+    if trending_board.loaded:
+        trending_board.add(choice.question_id)
+
+
+def record_votes(choices):
+    """Count one vote for each choice of a ballot in a single transaction
+
+    ``choices`` holds (question_id, choice_id, vote_shards) tuples that the
+    caller has already validated.
+    """
+    mode = get_vote_mode()
+    if mode in (BUFFERED, EVENT_LOG):
+        buffer = vote_buffer if mode == BUFFERED else vote_event_buffer
+        for question_id, choice_id, vote_shards in choices:
+            buffer.add(question_id, choice_id)
+    else:
+        increments = defaultdict(int)
+        sharded = defaultdict(int)
+        with transaction.atomic():
+            for question_id, choice_id, vote_shards in choices:
+                if vote_shards > 1:
+                    record_sharded_vote(choice_id, vote_shards)
+                    sharded[question_id] += 1
+                else:
+                    increments[(question_id, choice_id)] += 1
+            apply_vote_increments(increments)
+            touch_questions(sharded)
+            for question_id, choice_id, vote_shards in choices:
+                transaction.on_commit(partial(statistics_buffer.add, question_id, choice_id))
+    if rollups_enabled():
+        for question_id, choice_id, vote_shards in choices:
+            vote_rollups.add(question_id, choice_id)
+    if trending_board.loaded:
+        for question_id, choice_id, vote_shards in choices:
+            trending_board.add(question_id)
+
+
+def pending_votes(choice_ids=None):
+    """Return increments still held in a buffer (empty in strict mode)"""
+    mode = get_vote_mode()
+    if mode == BUFFERED:
+        return vote_buffer.pending(choice_ids)
+    if mode == EVENT_LOG:
+        return vote_event_buffer.pending(choice_ids)
+    return {}
+
+
+def record_sharded_vote(choice_id, shard_count):
+    """Add one vote to a random shard row of ``choice_id``"""
+    shard = random.randrange(shard_count)
+    updated = ChoiceVoteShard.objects.filter(choice_id=choice_id, shard=shard).update(
+        votes=F('votes') + 1
+    )
+    if not updated:
+        # First vote on this shard: create the row (another worker may win the race)
+        shard_row, created = ChoiceVoteShard.objects.get_or_create(
+            choice_id=choice_id, shard=shard, defaults={'votes': 1}
+        )
+        if not created:
+            ChoiceVoteShard.objects.filter(pk=shard_row.pk).update(votes=F('votes') + 1)
+
+
+def fold_vote_shards(question_ids=None):
+    """Move shard counts into Choice.votes / Question.total_votes; returns votes folded"""
+    with transaction.atomic():
+        shards = ChoiceVoteShard.objects.select_for_update().filter(votes__gt=0)
+        if question_ids is not None:
+            shards = shards.filter(choice__question_id__in=question_ids)
+        rows = list(shards.values_list('pk', 'choice_id', 'choice__question_id', 'votes'))
+        if not rows:
+            return 0
+
+        choice_totals = defaultdict(int)
+        question_totals = defaultdict(int)
+        shards_by_count = defaultdict(list)
+        for pk, choice_id, question_id, votes in rows:
+            choice_totals[choice_id] += votes
+            question_totals[question_id] += votes
+            shards_by_count[votes].append(pk)
+
+        # Subtract what was read rather than zeroing, so the fold is exact
+        # even on backends where select_for_update() is a no-op
+        for votes, pks in shards_by_count.items():
+            ChoiceVoteShard.objects.filter(pk__in=pks).update(votes=F('votes') - votes)
+        for choice_id, votes in choice_totals.items():
+            Choice.objects.filter(pk=choice_id).update(votes=F('votes') + votes)
+        for question_id, votes in question_totals.items():
+            Question.objects.filter(pk=question_id).update(total_votes=F('total_votes') + votes)
+        touch_questions(question_totals)
+    return sum(choice_totals.values())
+
+
+# Vote event log
+#
+# VoteEvent rows are append-only. The "choice_votes" checkpoint records the
+# highest event id already folded into Choice.votes / Question.total_votes, so
+# materialize_vote_events() only ever reads events above it. Events are read
+# in id ranges of POLLS_VOTE_LOG_CHUNK_SIZE and grouped in the database, so
+# memory stays bounded by the number of choices, not the length of the log.
+#
+# The high-water mark assumes event ids become visible in order. That holds on
+# SQLite, where one writer commits at a time. On backends with concurrent
+# writers (PostgreSQL, MySQL) a lower id can commit after a higher one has been
+# folded and would then never be counted, so event_log mode is SQLite-only.
+
+VOTE_LOG_CHECKPOINT = 'choice_votes'
+
+
+def get_vote_log_chunk_size():
+    return getattr(settings, 'POLLS_VOTE_LOG_CHUNK_SIZE', 10000)
+
+
+def append_vote_events(events):
+    """Insert (question_id, choice_id, created_at) tuples with batched INSERTs"""
+    VoteEvent.objects.bulk_create(
+        [
+            VoteEvent(question_id=question_id, choice_id=choice_id, created_at=created_at)
+            for question_id, choice_id, created_at in events
+        ],
+        batch_size=500,
+    )
+    return len(events)
+
+
+def _count_events(first_id, last_id):
+    """Return {(question_id, choice_id): votes} for events in (first_id, last_id]"""
+    rows = (
+        VoteEvent.objects.filter(pk__gt=first_id, pk__lte=last_id)
+        .order_by()
+        .values_list('question_id', 'choice_id')
+        .annotate(votes=Count('id'))
+    )
+    return {(question_id, choice_id): votes for question_id, choice_id, votes in rows}
+
+
+def materialize_vote_events(chunk_size=None):
+    """Fold events above the high-water mark into the counters; returns votes folded"""
+    chunk_size = chunk_size or get_vote_log_chunk_size()
+    checkpoint, _ = VoteTallyCheckpoint.objects.get_or_create(name=VOTE_LOG_CHECKPOINT)
+    last_id = VoteEvent.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    folded = 0
+    while True:
+        with transaction.atomic():
+            start = VoteTallyCheckpoint.objects.get(pk=checkpoint.pk).last_event_id
+            if start >= last_id:
+                break
+            end = min(start + chunk_size, last_id)
+            # Claim the range with a compare-and-set so two workers can never
+            # fold the same events twice
+            claimed = VoteTallyCheckpoint.objects.filter(
+                pk=checkpoint.pk, last_event_id=start
+            ).update(last_event_id=end)
+            if not claimed:
+                break
+            increments = _count_events(start, end)
+            statistics.add_votes(apply_vote_increments(increments))
+        folded += sum(increments.values())
+    return folded
+
+
+def rebuild_votes_from_log(question_ids=None, chunk_size=None):
+    """Recompute Choice.votes purely from the event log without pausing voting
+
+    Only event_log deployments have every vote in the log; anywhere else the
+    rewrite would wipe votes recorded in strict or buffered mode, so it is
+    refused with ImproperlyConfigured. Events are counted chunk by chunk up to
+    the current high-water mark; the result is written in one short
+    transaction once the mark is confirmed not to have moved (otherwise the
+    newly folded range is counted and we retry). Returns the number of
+    choices rewritten.
+    """
+    if get_vote_mode() != EVENT_LOG:
+        raise ImproperlyConfigured(
+            f"Rebuilding votes from the event log needs POLLS_VOTE_MODE = '{EVENT_LOG}'"
+        )
+    chunk_size = chunk_size or get_vote_log_chunk_size()
+    if question_ids is not None:
+        question_ids = set(question_ids)
+    checkpoint, _ = VoteTallyCheckpoint.objects.get_or_create(name=VOTE_LOG_CHECKPOINT)
+    counts = defaultdict(int)
+    scanned_to = 0
+    while True:
+        mark = VoteTallyCheckpoint.objects.get(pk=checkpoint.pk).last_event_id
+        while scanned_to < mark:
+            end = min(scanned_to + chunk_size, mark)
+            for (question_id, choice_id), votes in _count_events(scanned_to, end).items():
+                if question_ids is None or question_id in question_ids:
+                    counts[choice_id] += votes
+            scanned_to = end
+
+        with transaction.atomic():
+            # Re-asserting the mark takes the row's write lock, holding off the
+            # materializer until the rewritten counters are committed
+            if not VoteTallyCheckpoint.objects.filter(
+                pk=checkpoint.pk, last_event_id=mark
+            ).update(last_event_id=mark):
+                continue
+            choices = Choice.objects.all()
+            if question_ids is not None:
+                choices = choices.filter(question_id__in=question_ids)
+            by_count = defaultdict(list)
+            for choice_id in choices.values_list('pk', flat=True).iterator():
+                by_count[counts.get(choice_id, 0)].append(choice_id)
+            for votes, choice_ids in by_count.items():
+                for i in range(0, len(choice_ids), 500):
+                    Choice.objects.filter(pk__in=choice_ids[i:i + 500]).update(votes=votes)
+            Question.objects.rebuild_total_votes(question_ids)
+            return sum(len(choice_ids) for choice_ids in by_count.values())
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""
+Concurrent vote correctness and throughput harness for the polls apps
+Run this with: python3 vote_harness.py [--app myapp] [--votes 2000] [--workers 32]
+
+For each app it migrates a fresh database in a temporary directory, creates
+a question, starts `manage.py runserver` on a free local port and fires votes
+at the app's vote view from a thread (or process) pool. It then reports
+votes/sec, p50/p99 latency and how many acknowledged votes never reached the
+database (lost updates). The app runs with a generated settings module that
+imports its own and points the database and every other file it writes
+(caches, rate limit buckets, search index) into that directory, so the real
+app databases are never touched; --keep leaves the directory behind.
+
+Rate limiting (myapp's POLLS_RATE_LIMITS) is switched off by default: every
+harness request comes from 127.0.0.1 and would share one client bucket. Pass
+--rate-limits to keep the app's limits; votes rejected with 429 are then
+reported as "shed".
+"""
+
+import argparse
+import json
+import random
+import signal
+import socket
+import string
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+
+APPS = {
+    'djangotutorial': {'vote_url': '/polls/{question_id}/vote/', 'settings': 'mysite.settings'},
+    'myapp': {'vote_url': '/polls/{question_id}/vote/', 'settings': 'myapp.settings'},
+}
+
+SETTINGS_CODE = """
+from pathlib import Path
+
+from {settings} import *  # noqa: F401,F403
+
+# Vote harness run: keep everything this run writes in its own directory
+HARNESS_DIR = Path({workdir!r})
+DATABASES = {{**DATABASES, 'default': {{**DATABASES['default'], 'NAME': HARNESS_DIR / 'db.sqlite3'}}}}
+CACHES = {{
+    alias: {{**cache, 'LOCATION': HARNESS_DIR / f'cache-{{alias}}'}}
+    if cache['BACKEND'].endswith('FileBasedCache') else cache
+    for alias, cache in globals().get('CACHES', {{}}).items()
+}} or {{'default': {{'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}}}
+POLLS_RATE_LIMIT_SHARED_PATH = HARNESS_DIR / 'polls_ratelimit.buckets'
+POLLS_TRIGRAM_INDEX_PATH = HARNESS_DIR / 'polls_trigram.idx'
+{rate_limits}
+"""
+
+SETUP_CODE = """
+import json
+from django.utils import timezone
+from polls.models import Question, Choice
+question = Question.objects.create(question_text='Vote harness', pub_date=timezone.now())
+choice_ids = [
+    Choice.objects.create(question=question, choice_text=f'Option {{i}}').id
+    for i in range({choices})
+]
+print(json.dumps({{'question_id': question.id, 'choice_ids': choice_ids}}))
+"""
+
+COUNT_CODE = """
+import json
+from polls.models import Choice
+try:
+    from polls.tallies import tally_question
+    votes = {{c['id']: c['votes'] for c in tally_question({question_id})['choices']}}
+except ImportError:
+    votes = dict(Choice.objects.filter(question_id={question_id}).values_list('id', 'votes'))
+print(json.dumps(votes))
+"""
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def harness_env(app, workdir, options):
+    """Environment running ``app`` with a settings module confined to ``workdir``"""
+    rate_limits = '' if options.rate_limits else 'POLLS_RATE_LIMITS = {}'
+    (Path(workdir) / 'harness_settings.py').write_text(SETTINGS_CODE.format(
+        settings=APPS[app]['settings'], workdir=str(workdir), rate_limits=rate_limits,
+    ))
+    pythonpath = [str(workdir), str(ROOT / app), os.environ.get('PYTHONPATH', '')]
+    return {
+        **os.environ,
+        'DJANGO_SETTINGS_MODULE': 'harness_settings',
+        'PYTHONPATH': os.pathsep.join(filter(None, pythonpath)),
+    }
+
+
+def manage(app, env, *args):
+    return subprocess.run(
+        [sys.executable, 'manage.py', *args],
+        cwd=ROOT / app, env=env, check=True, capture_output=True, text=True,
+    ).stdout
+
+
+def django_shell(app, env, code):
+    return json.loads(manage(app, env, 'shell', '-c', code).strip().splitlines()[-1] or 'null')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'runserver did not start on port {port}')
+
+
+def cast_vote(url, choice_id):
+    """POST one vote; returns (HTTP status or None, latency in seconds)"""
+    # Any well-formed secret works as long as cookie and header agree
+    token = ''.join(random.choices(string.ascii_letters + string.digits, k=32))
+    request = urllib.request.Request(
+        url,
+        data=urllib.parse.urlencode({'choice': choice_id}).encode(),
+        headers={'Cookie': f'csrftoken={token}', 'X-CSRFToken': token},
+    )
+    opener = urllib.request.build_opener(NoRedirect)
+    started = time.perf_counter()
+    try:
+        opener.open(request, timeout=30)
+        status = 200
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = None
+    return status, time.perf_counter() - started
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+    return samples[index]
+
+
+def run_app(app, options):
+    workdir = tempfile.mkdtemp(prefix=f'vote-harness-{app}-')
+    try:
+        return run_in(app, workdir, options)
+    finally:
+        if options.keep:
+            print(f'{app}: kept {workdir}', file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_in(app, workdir, options):
+    env = harness_env(app, workdir, options)
+    manage(app, env, 'migrate', '--noinput')
+    setup = django_shell(app, env, SETUP_CODE.format(choices=options.choices))
+    question_id, choice_ids = setup['question_id'], setup['choice_ids']
+
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, 'manage.py', 'runserver', f'127.0.0.1:{port}', '--noreload'],
+        cwd=ROOT / app, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_server(port)
+        url = f'http://127.0.0.1:{port}' + APPS[app]['vote_url'].format(question_id=question_id)
+        targets = [random.choice(choice_ids) for _ in range(options.votes)]
+
+        pool_class = ProcessPoolExecutor if options.processes else ThreadPoolExecutor
+        started = time.perf_counter()
+        with pool_class(max_workers=options.workers) as pool:
+            results = list(pool.map(cast_vote, [url] * len(targets), targets, chunksize=1))
+        elapsed = time.perf_counter() - started
+    finally:
+        # SIGINT lets the server run its shutdown hooks (e.g. buffered vote flush)
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    counted = django_shell(app, env, COUNT_CODE.format(question_id=question_id))
+
+    # The vote views redirect to the results page after a successful vote
+    acknowledged = sum(1 for status, latency in results if status == 302)
+    shed = sum(1 for status, latency in results if status == 429)
+    latencies = [latency for status, latency in results if status == 302]
+    observed = sum(counted.values())
+    return {
+        'app': app,
+        'votes_sent': len(results),
+        'acknowledged': acknowledged,
+        'shed': shed,
+        'errors': len(results) - acknowledged - shed,
+        'counted': observed,
+        'lost_updates': acknowledged - observed,
+        'votes_per_sec': acknowledged / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--app', choices=sorted(APPS), action='append',
+                        help='App to test (repeatable, default: all)')
+    parser.add_argument('--votes', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--choices', type=int, default=4)
+    parser.add_argument('--processes', action='store_true',
+                        help='Use a process pool instead of threads')
+    parser.add_argument('--rate-limits', action='store_true',
+                        help="Keep the app's rate limits (off by default)")
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the temporary database directory for inspection')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    options = parser.parse_args()
+
+    reports = [run_app(app, options) for app in options.app or sorted(APPS)]
+    if options.json:
+        print(json.dumps(reports, indent=2))
+        return
+
+    print(f"{'app':<16}{'votes/sec':>10}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'acked':>8}{'counted':>9}{'lost':>6}{'shed':>6}{'errors':>8}")
+    for r in reports:
+        print(f"{r['app']:<16}{r['votes_per_sec']:>10.0f}{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}"
+              f"{r['acknowledged']:>8}{r['counted']:>9}{r['lost_updates']:>6}{r['shed']:>6}{r['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()